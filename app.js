@@ -1,4 +1,5 @@
 const express = require('express');
+const net = require('net');
 const {web3} = require('./web3Config')
 const { body, param, validationResult } = require('express-validator');
 const rateLimit = require('express-rate-limit');
@@ -32,6 +33,18 @@ const limiter = rateLimit({
 });
 app.use(limiter);
 
+// Push battle events to the bot's side channel (length-prefixed JSON frames)
+const BOT_SIDE_CHANNEL_PORT = process.env.BOT_SIDE_CHANNEL_PORT || 9999;
+function notifyBot(event) {
+  const body = Buffer.from(JSON.stringify(event), 'utf8');
+  const header = Buffer.alloc(4);
+  header.writeUInt32BE(body.length);
+  const socket = net.createConnection({ host: 'localhost', port: BOT_SIDE_CHANNEL_PORT }, () => {
+    socket.end(Buffer.concat([header, body]));
+  });
+  socket.on('error', (error) => console.error('Bot side channel error:', error.message));
+}
+
 // Validation middleware for starting battle
 const validateBattleStart = [
   body('track1').trim().notEmpty().withMessage('Track 1 is required'),
@@ -115,6 +128,9 @@ app.post(
 
       
       if(result!=undefined){
+        if (result.transactionHash) {
+          notifyBot({ type: 'vote_recorded', battleId: Number(battleId), trackNumber, userAddress });
+        }
         res.json({
           message: `Vote registered for Track ${trackNumber}!`,
           ...result
@@ -138,6 +154,59 @@ app.post(
 
 
 
+// Runs the /votetrack checks on one vote of a batch; returns its 400 result, or null when it is valid
+const validateBatchVote = async (vote) => {
+  const voteReq = { body: vote !== null && typeof vote === 'object' ? vote : {} };
+  await Promise.all(validateVote.map((chain) => chain.run(voteReq)));
+  const errors = validationResult(voteReq);
+  if (!errors.isEmpty()) {
+    return { status: 400, body: { errors: errors.array() } };
+  }
+  if (!voteReq.body.userAddress) {
+    return { status: 400, body: { error: 'User address is required' } };
+  }
+  return null;
+};
+
+// Bulk voting: the bot forwards queued votes together and gets one result per vote
+app.post(
+  '/votetrack/batch',
+  body('votes').isArray().withMessage('votes must be an array'),
+  handleValidationErrors,
+  async (req, res) => {
+    const { votes } = req.body;
+    // An invalid vote gets the answer /votetrack would give it, without failing the rest of the batch
+    const invalid = await Promise.all(votes.map(validateBatchVote));
+
+    const settled = await Promise.allSettled(
+      votes.map((vote, index) =>
+        invalid[index] ? null : voteTrack(vote.battleId, vote.trackNumber, vote.userAddress, vote.paymentAmount)
+      )
+    );
+
+    const results = settled.map((outcome, index) => {
+      if (invalid[index]) {
+        return invalid[index];
+      }
+      const { battleId, trackNumber, userAddress } = votes[index];
+      if (outcome.status === 'rejected') {
+        console.error('Vote Error:', outcome.reason);
+        return { status: 500, body: { error: 'Failed to register vote' } };
+      }
+      const result = outcome.value;
+      if (result === undefined) {
+        return { status: 200, body: { message: `Vote already registered for Track ${trackNumber}!` } };
+      }
+      if (result.transactionHash) {
+        notifyBot({ type: 'vote_recorded', battleId: Number(battleId), trackNumber, userAddress });
+      }
+      return { status: 200, body: { message: `Vote registered for Track ${trackNumber}!`, ...result } };
+    });
+
+    res.json({ results });
+  }
+);
+
 // // Route to get the leaderboard
 // app.get('/leaderboard/', (req, res) => {
 //   try {
@@ -275,6 +344,7 @@ app.get(
     try {
       const { battleId } = req.params;
       const winner = await getWinner(battleId);
+      notifyBot({ type: 'battle_closed', battleId: parseInt(battleId) });
 
       res.json({
         battleId: parseInt(battleId),
@@ -0,0 +1,206 @@
+"""
+Shared async HTTP client for the Express backend (app.js).
+
+Every bot handler goes through one pooled, keep-alive session instead of
+calling the blocking `requests` API inside the event loop.
+
+Run `python backend_client.py bench` to compare the throughput of many
+concurrent handlers against the stub backend (stubs.py) with blocking
+`requests` calls, as the handlers used to make them, and with this client.
+"""
+import argparse
+import asyncio
+import json
+import logging
+import multiprocessing
+import statistics
+import time
+
+import httpx
+
+from circuit_breaker import BreakerGroup, endpoint_key, is_outage
+from metrics import stage
+
+logger = logging.getLogger(__name__)
+
+# Default per-call timeout (seconds) for read endpoints
+DEFAULT_TIMEOUT = 10.0
+
+# /startbattle and /votetrack wait for an on-chain transaction, so give them longer
+TRANSACTION_TIMEOUT = 60.0
+
+# POSTs that submit an on-chain transaction. Giving up early would report a failure for a
+# transaction that was sent anyway, and the user's retry would send it again, so they get a
+# fixed TRANSACTION_TIMEOUT instead of the adaptive one and their timeouts do not open the breaker.
+TRANSACTION_PATHS = frozenset({"/startbattle", "/votetrack", "/votetrack/batch", "/transferToOwner"})
+
+
+class BackendClient:
+    """Pooled async client for the music battle backend."""
+
+    def __init__(self, base_url, pool_size=20, keepalive_connections=None, timeout=DEFAULT_TIMEOUT, breakers=None):
+        self.base_url = base_url.rstrip("/")
+        self.pool_size = pool_size
+        self.timeout = timeout
+        # One circuit breaker per endpoint; `timeout` becomes the ceiling of the adaptive timeout
+        self.breakers = breakers or BreakerGroup("backend ")
+        self._limits = httpx.Limits(
+            max_connections=pool_size,
+            max_keepalive_connections=keepalive_connections or pool_size,
+            keepalive_expiry=30.0,
+        )
+        # Callers beyond pool_size queue here, in order; the pool itself hands freed connections
+        # to its waiters in no particular order, which leaves some callers waiting for seconds
+        self._slots = asyncio.Semaphore(pool_size)
+        self._client = None
+
+    @property
+    def client(self):
+        """The underlying session, created on first use so it binds to the running loop."""
+        if self._client is None or self._client.is_closed:
+            self._client = httpx.AsyncClient(
+                base_url=self.base_url,
+                limits=self._limits,
+                timeout=self.timeout,
+                headers={"Connection": "keep-alive"},
+            )
+        return self._client
+
+    async def get(self, path, timeout=None):
+        """Sends a GET request to the backend and returns the response."""
+        return await self.request("GET", path, timeout=timeout)
+
+    async def post(self, path, payload, timeout=None):
+        """Sends a JSON POST request to the backend and returns the response."""
+        return await self.request("POST", path, payload=payload, timeout=timeout)
+
+    async def request(self, method, path, payload=None, timeout=None):
+        """Sends a request through the endpoint's circuit breaker.
+
+        Raises CircuitOpenError without touching the network while the
+        endpoint is failing.
+        """
+        kwargs = {}
+        if payload is not None:
+            kwargs["json"] = payload
+        if method == "POST" and path in TRANSACTION_PATHS:
+            breaker = self.breakers.get(
+                endpoint_key(method, path), max_timeout=timeout or TRANSACTION_TIMEOUT,
+                adaptive_timeout=False, timeouts_are_failures=False,
+            )
+        else:
+            breaker = self.breakers.get(endpoint_key(method, path), max_timeout=timeout or self.timeout)
+
+        async def send(call_timeout):
+            with stage("backend"):
+                async with self._slots:
+                    return await self.client.request(method, path, timeout=call_timeout, **kwargs)
+
+        # app.js answers reverted transactions (late votes, unknown battles) with 500: those are the
+        # caller's errors, so only transport errors, timeouts and 502/503/504 count towards opening
+        return await breaker.call(send, is_failure=is_outage)
+
+    async def close(self):
+        """Closes the pooled connections."""
+        if self._client is not None and not self._client.is_closed:
+            await self._client.aclose()
+        self._client = None
+
+
+def _serve_stub(latency, connection):
+    from stubs import StubBackend
+
+    async def serve():
+        backend = StubBackend(latency=latency)
+        await backend.start()
+        connection.send(backend.url)
+        await asyncio.Event().wait()
+    asyncio.run(serve())
+
+
+class _StubProcess:
+    """The stub backend in a process of its own, as app.js is, so that blocking clients can be timed against it."""
+
+    def __init__(self, latency):
+        self._receiver, sender = multiprocessing.Pipe(duplex=False)
+        self._process = multiprocessing.Process(target=_serve_stub, args=(latency, sender), daemon=True)
+
+    def __enter__(self):
+        self._process.start()
+        return self._receiver.recv()
+
+    def __exit__(self, *exc_info):
+        self._process.terminate()
+        self._process.join()
+
+
+async def _time_handlers(call, handlers, calls):
+    """Runs `handlers` concurrent handlers making `calls` backend calls each, while timing the event loop."""
+    latencies = []
+    stalls = []
+
+    async def handler(index):
+        for number in range(calls):
+            started = time.perf_counter()
+            await call(f"/battle/{index * calls + number}/votes")
+            latencies.append(time.perf_counter() - started)
+
+    async def ticker(interval=0.01):
+        # How late a 10ms timer fires: the time every other chat waits
+        while True:
+            started = time.perf_counter()
+            await asyncio.sleep(interval)
+            stalls.append(time.perf_counter() - started - interval)
+
+    ticking = asyncio.create_task(ticker())
+    started = time.perf_counter()
+    await asyncio.gather(*(handler(index) for index in range(handlers)))
+    elapsed = time.perf_counter() - started
+    ticking.cancel()
+    latencies.sort()
+    return {
+        "requests_per_s": round(len(latencies) / elapsed, 1),
+        "p50_ms": round(statistics.median(latencies) * 1000, 2),
+        "p99_ms": round(latencies[int(len(latencies) * 0.99) - 1] * 1000, 2),
+        "max_loop_stall_ms": round(max(stalls, default=elapsed) * 1000, 1),
+    }
+
+
+def benchmark(handlers, calls, latency, pool_size):
+    """Times blocking per-call `requests` against a pooled BackendClient on the same workload."""
+    import requests
+
+    with _StubProcess(latency) as url:
+        async def blocking(path):
+            # A new connection per call, and the event loop frozen until the response arrives
+            requests.get(url + path, timeout=DEFAULT_TIMEOUT).json()
+
+        async def run_pooled():
+            client = BackendClient(url, pool_size=pool_size)
+            try:
+                async def pooled(path):
+                    (await client.get(path)).json()
+                return await _time_handlers(pooled, handlers, calls)
+            finally:
+                await client.close()
+
+        return {
+            "handlers": handlers,
+            "calls_per_handler": calls,
+            "backend_latency_ms": latency * 1000,
+            "before": asyncio.run(_time_handlers(blocking, handlers, calls)),
+            "after": asyncio.run(run_pooled()),
+        }
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Backend client maintenance")
+    subcommands = parser.add_subparsers(dest="command", required=True)
+    bench = subcommands.add_parser("bench", help="Compare blocking requests with the pooled client")
+    bench.add_argument("--handlers", type=int, default=50, help="handlers running at once")
+    bench.add_argument("--calls", type=int, default=20, help="backend calls per handler")
+    bench.add_argument("--latency-ms", type=float, default=20.0, help="stub backend response time")
+    bench.add_argument("--pool-size", type=int, default=20)
+    args = parser.parse_args()
+
+    print(json.dumps(benchmark(args.handlers, args.calls, args.latency_ms / 1000, args.pool_size), indent=2))
@@ -0,0 +1,119 @@
+"""
+Timers that fire when a battle's voting period ends.
+
+Deadlines live in a heap (O(log n) to schedule, O(1) to find the next one)
+and a single task sleeps until the earliest of them. Rescheduling or
+cancelling a battle only updates `_deadlines`; heap entries that no longer
+match are skipped when they surface.
+
+The scheduler itself keeps nothing on disk: at startup the bot hands it
+the persisted sessions through `reschedule`.
+"""
+import asyncio
+import heapq
+import itertools
+import logging
+import time
+
+logger = logging.getLogger(__name__)
+
+
+class BattleScheduler:
+    """Calls `on_expire(battle_id)` once per scheduled battle when its deadline passes."""
+
+    def __init__(self, max_concurrent=8, clock=time.time, sleep=asyncio.sleep):
+        self.on_expire = None
+        self.clock = clock
+        self.sleep = sleep
+        self._heap = []
+        self._deadlines = {}
+        self._sequence = itertools.count()
+        self._wakeup = asyncio.Event()
+        self._limit = asyncio.Semaphore(max_concurrent)
+        self._task = None
+        self._running = set()
+        self.expired = 0
+
+    def __len__(self):
+        return len(self._deadlines)
+
+    def schedule(self, battle_id, deadline):
+        """Fires `battle_id` at `deadline` (a `clock()` timestamp), replacing any earlier timer."""
+        self._deadlines[battle_id] = deadline
+        heapq.heappush(self._heap, (deadline, next(self._sequence), battle_id))
+        if self._heap[0][2] == battle_id:
+            # New earliest deadline: the loop may be sleeping until a later one
+            self._wakeup.set()
+
+    def cancel(self, battle_id):
+        if self._deadlines.pop(battle_id, None) is not None and len(self._heap) > 2 * len(self._deadlines) + 64:
+            self._compact()
+
+    def deadline(self, battle_id):
+        return self._deadlines.get(battle_id)
+
+    def reschedule(self, sessions, grace=0):
+        """Schedules the open battles of a `BattleSessionStore` with a known end; overdue ones fire at once."""
+        for session in sessions.open_sessions():
+            if session.ends_at is not None:
+                self.schedule(session.battle_id, session.ends_at + grace)
+
+    def start(self, on_expire):
+        """Starts firing timers; `on_expire(battle_id)` is awaited for each expired battle."""
+        self.on_expire = on_expire
+        if self._task is None:
+            self._task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        tasks = [task for task in (self._task, *self._running) if task is not None]
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+        self._task = None
+
+    def stats(self):
+        return {
+            "pending": len(self._deadlines),
+            "heap": len(self._heap),
+            "running": len(self._running),
+            "expired": self.expired,
+        }
+
+    async def _run(self):
+        while True:
+            self._wakeup.clear()
+            now = self.clock()
+            while self._heap and self._heap[0][0] <= now:
+                deadline, _, battle_id = heapq.heappop(self._heap)
+                if self._deadlines.get(battle_id) != deadline:
+                    continue  # cancelled or rescheduled
+                del self._deadlines[battle_id]
+                self._fire(battle_id)
+
+            if not self._heap:
+                await self._wakeup.wait()
+                continue
+            sleeper = asyncio.ensure_future(self.sleep(self._heap[0][0] - now))
+            woken = asyncio.ensure_future(self._wakeup.wait())
+            try:
+                await asyncio.wait((sleeper, woken), return_when=asyncio.FIRST_COMPLETED)
+            finally:
+                sleeper.cancel()
+                woken.cancel()
+
+    def _fire(self, battle_id):
+        self.expired += 1
+        task = asyncio.create_task(self._expire(battle_id))
+        self._running.add(task)
+        task.add_done_callback(self._running.discard)
+
+    async def _expire(self, battle_id):
+        async with self._limit:
+            try:
+                await self.on_expire(battle_id)
+            except Exception:
+                logger.error("Closing expired battle %s failed", battle_id, exc_info=True)
+
+    def _compact(self):
+        self._heap = [entry for entry in self._heap if self._deadlines.get(entry[2]) == entry[0]]
+        heapq.heapify(self._heap)
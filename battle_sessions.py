@@ -0,0 +1,231 @@
+"""
+State of battles started from the bot, keyed by battle id.
+
+A `BattleSession` holds what the bot showed when the battle started (genre,
+tracks, creators, payment amount), the voting messages to keep up to date
+and the vote counts. Sessions of closed battles are kept for `closed_ttl`
+seconds and then evicted. Bare sessions, made by `ensure` for battles
+started elsewhere, have no known end and may never be closed; they are
+treated as closed when they were created, so they expire the same way.
+
+With a `path`, the open sessions are snapshotted to a JSON file (written
+atomically, a few seconds after the last change) and reloaded at startup,
+so keyboards keep being updated across restarts.
+"""
+import asyncio
+import json
+import logging
+import time
+
+from wallet_store import write_json_atomic
+
+logger = logging.getLogger(__name__)
+
+
+class BattleSession:
+    __slots__ = (
+        "battle_id", "genre", "tracks", "creators", "payment_amount",
+        "votes", "messages", "created_at", "ends_at", "closed_at",
+    )
+
+    def __init__(self, battle_id, genre=None, tracks=(), creators=(), payment_amount=None, created_at=0.0,
+                 ends_at=None):
+        self.battle_id = battle_id
+        self.genre = genre
+        # ((name, artist), (name, artist)) for track 1 and track 2
+        self.tracks = tracks
+        self.creators = creators
+        self.payment_amount = payment_amount
+        # [track1, track2], or None until the counts are known
+        self.votes = None
+        # {(chat_id, message_id): payment_amount} of the voting keyboards
+        self.messages = {}
+        self.created_at = created_at
+        # When voting ends (unix time), if known
+        self.ends_at = ends_at
+        self.closed_at = None
+
+    def voting_open(self, now):
+        """False once the battle is closed or its voting period has passed."""
+        return self.closed_at is None and (self.ends_at is None or now < self.ends_at)
+
+    def expires_from(self):
+        """When the `closed_ttl` countdown started: at close, or at creation if the end is unknown."""
+        if self.closed_at is not None:
+            return self.closed_at
+        # Battles with a known end are closed by the scheduler, even after a restart
+        return self.created_at if self.ends_at is None else None
+
+    def track_name(self, track_number):
+        """"<name> by <artist>" for track 1 or 2, or None if the tracks are unknown."""
+        if len(self.tracks) < track_number:
+            return None
+        name, artist = self.tracks[track_number - 1]
+        return f"{name} by {artist}"
+
+    def to_dict(self):
+        return {
+            "battle_id": self.battle_id,
+            "genre": self.genre,
+            "tracks": self.tracks,
+            "creators": self.creators,
+            "payment_amount": self.payment_amount,
+            "votes": self.votes,
+            "messages": [[chat_id, message_id, amount] for (chat_id, message_id), amount in self.messages.items()],
+            "created_at": self.created_at,
+            "ends_at": self.ends_at,
+        }
+
+    @classmethod
+    def from_dict(cls, data):
+        session = cls(
+            data["battle_id"],
+            genre=data.get("genre"),
+            tracks=tuple(tuple(track) for track in data.get("tracks", ())),
+            creators=tuple(data.get("creators", ())),
+            payment_amount=data.get("payment_amount"),
+            created_at=data.get("created_at", 0.0),
+            ends_at=data.get("ends_at"),
+        )
+        session.votes = data.get("votes")
+        session.messages = {(chat_id, message_id): amount for chat_id, message_id, amount in data.get("messages", ())}
+        return session
+
+
+class BattleSessionStore:
+    """In-memory sessions with TTL eviction after close and optional JSON persistence."""
+
+    def __init__(self, path=None, closed_ttl=3600, flush_delay=5.0, evict_interval=60, clock=time.time):
+        self.path = path
+        self.closed_ttl = closed_ttl
+        self.flush_delay = flush_delay
+        self.evict_interval = evict_interval
+        self.clock = clock
+        self._sessions = {}
+        self._closed = 0
+        self._flush_task = None
+        self._evict_task = None
+
+    def __contains__(self, battle_id):
+        return battle_id in self._sessions
+
+    def __len__(self):
+        return len(self._sessions)
+
+    def get(self, battle_id):
+        return self._sessions.get(battle_id)
+
+    def open_sessions(self):
+        return [session for session in self._sessions.values() if session.closed_at is None]
+
+    def create(self, battle_id, genre=None, tracks=(), creators=(), payment_amount=None, ends_at=None):
+        """Registers a battle the bot has just started."""
+        session = BattleSession(
+            battle_id, genre, tracks, creators, payment_amount, created_at=self.clock(), ends_at=ends_at
+        )
+        existing = self._sessions.get(battle_id)
+        if existing is not None:
+            # Votes or messages may have been seen before the start was recorded
+            session.votes, session.messages = existing.votes, existing.messages
+        self._sessions[battle_id] = session
+        self.changed()
+        return session
+
+    def ensure(self, battle_id):
+        """Returns the battle's session, creating a bare one for battles started elsewhere."""
+        session = self._sessions.get(battle_id)
+        if session is None:
+            session = self._sessions[battle_id] = BattleSession(battle_id, created_at=self.clock())
+        return session
+
+    def close(self, battle_id):
+        """Marks a battle closed; its session is evicted `closed_ttl` seconds later."""
+        session = self._sessions.get(battle_id)
+        if session is not None and session.closed_at is None:
+            session.closed_at = self.clock()
+            self._closed += 1
+            self.changed()
+
+    def changed(self):
+        """Schedules a snapshot after `flush_delay` seconds (no-op without a path)."""
+        if self.path is None:
+            return
+        if self._flush_task is None or self._flush_task.done():
+            try:
+                self._flush_task = asyncio.get_running_loop().create_task(self._delayed_flush())
+            except RuntimeError:
+                # Not running in the event loop (e.g. at startup); the next change or stop() writes it
+                pass
+
+    def load(self):
+        """Loads the open sessions saved by a previous run."""
+        if self.path is None:
+            return
+        try:
+            with open(self.path, "r") as file:
+                saved = json.load(file)
+        except FileNotFoundError:
+            return
+        for data in saved:
+            session = BattleSession.from_dict(data)
+            self._sessions[session.battle_id] = session
+        # Sessions that expired while the bot was down are not brought back
+        expired = self.evict()
+        logger.info(f"Loaded {len(saved) - expired} battle sessions ({expired} expired)")
+
+    async def flush(self):
+        if self.path is None:
+            return
+        snapshot = [session.to_dict() for session in self._sessions.values() if session.closed_at is None]
+        await asyncio.to_thread(write_json_atomic, self.path, snapshot)
+
+    def start(self):
+        if self._evict_task is None:
+            self._evict_task = asyncio.create_task(self._evict_loop())
+
+    async def stop(self):
+        for task in (self._evict_task, self._flush_task):
+            if task is not None and not task.done():
+                task.cancel()
+                try:
+                    await task
+                except asyncio.CancelledError:
+                    pass
+        self._evict_task = self._flush_task = None
+        await self.flush()
+
+    def evict(self):
+        """Drops sessions closed (or made bare) more than `closed_ttl` seconds ago; returns how many."""
+        cutoff = self.clock() - self.closed_ttl
+        expired = []
+        for battle_id, session in self._sessions.items():
+            expires_from = session.expires_from()
+            if expires_from is not None and expires_from <= cutoff:
+                expired.append(battle_id)
+        snapshotted = False
+        for battle_id in expired:
+            if self._sessions.pop(battle_id).closed_at is not None:
+                self._closed -= 1
+            else:
+                snapshotted = True
+        if snapshotted:
+            # Bare sessions were in the snapshot
+            self.changed()
+        return len(expired)
+
+    def stats(self):
+        return {"sessions": len(self._sessions), "open": len(self._sessions) - self._closed, "closed": self._closed}
+
+    async def _delayed_flush(self):
+        await asyncio.sleep(self.flush_delay)
+        try:
+            await self.flush()
+        except Exception as e:
+            logger.error(f"Failed to save battle sessions: {e}")
+
+    async def _evict_loop(self):
+        while True:
+            await asyncio.sleep(self.evict_interval)
+            evicted = self.evict()
+            if evicted:
+                logger.debug("Evicted %d expired battle sessions", evicted)
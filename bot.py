@@ -1,41 +1,152 @@
-
-import random
+import asyncio
+import json
 import logging
-from telegram import Update, InlineKeyboardButton, InlineKeyboardMarkup
-from telegram.ext import ContextTypes
-import requests
-from telegram import Update
-from telegram.ext import Application, CommandHandler, ContextTypes
-from telegram import Update
+import os
+import random
+import sys
+import time
+
+import httpx
+from telegram import Bot, Update
+from telegram.error import BadRequest, TelegramError
 from telegram.ext import (
     Application,
+    CallbackContext,
+    CallbackQueryHandler,
     CommandHandler,
-    MessageHandler,
     ContextTypes,
-    filters,
-    CallbackContext,
-    CallbackQueryHandler
 )
-from telegram import InlineKeyboardButton, InlineKeyboardMarkup
-import asyncio
-from telegram import Update
-from telegram.ext import ContextTypes
-import json
-# Enable logging
-logging.basicConfig(
-    format="%(asctime)s - %(name)s - %(levelname)s - %(message)s", level=logging.INFO
+from telegram.helpers import escape_markdown
+from telegram.request import HTTPXRequest
+
+from backend_client import BackendClient, TRANSACTION_TIMEOUT
+from battle_scheduler import BattleScheduler
+from battle_sessions import BattleSessionStore
+from callbacks import (
+    CallbackError, CallbackRegistry, decode as decode_callback,
+    KIND_GENRE, KIND_PAGE, KIND_VOTE,
 )
+from circuit_breaker import BreakerGroup, CircuitBreaker, CircuitOpenError
+from config import BotConfig
+from keyboards import genre_keyboard, memoized_vote_keyboard
+from leaderboard import Leaderboard, SqliteLeaderboard
+from logging_setup import setup_logging
+from metrics import MetricsServer, instrument, registry, stage, summary
+from outbound import OutboundScheduler, outbound_priority, PRIORITY_HIGH, PRIORITY_LOW
+from pagination import PageCache
+from response_cache import ResponseCache
+from sharding import ShardFront, ShardReceiver, WorkerProcesses, wait_for_signal
+from side_channel import SideChannelServer, BATTLE_CLOSED, VOTE_RECORDED
+from spotify_client import SpotifyClient
+from track_cache import GenreTrackCache
+from update_processor import OrderedUpdateProcessor
+from vote_queue import VoteQueue
+from vote_tally import VoteTally, EditDebouncer
+from wallet_store import create_wallet_store
+
 logger = logging.getLogger(__name__)
-import random
 
-# Telegram bot token
-BOT_TOKEN = "7606681330:AAHNUpi_k1tfUIKyBeFGn1HusWDahrnUxMw"
+# Deployment settings (token, addresses, paths), overridable through environment variables
+config = BotConfig.from_env()
+
+# Connections Telegram may open at once to deliver webhook updates
+WEBHOOK_MAX_CONNECTIONS = 40
+
+# In sharded mode, seconds the front waits for a backed-up worker before answering 503 (Telegram retries later)
+SHARD_FORWARD_TIMEOUT = 5.0
+
+# The workers of a sharded bot send on the same bot token and the same Spotify app,
+# so each gets an equal share of the budgets that are per token (or per app)
+BUDGET_SHARES = config.workers if config.shard_index is not None and config.workers else 1
+
+# Updates processed at the same time, and updates buffered before the webhook applies backpressure
+CONCURRENT_UPDATES = 16
+UPDATE_QUEUE_SIZE = 1000
+
+# Handlers run concurrently across chats, but in arrival order within each chat and each user
+update_processor = OrderedUpdateProcessor(max_workers=CONCURRENT_UPDATES, max_pending=UPDATE_QUEUE_SIZE)
+
+# Outgoing Telegram calls are throttled below the flood limits (global, private chat, group).
+# A chat is always handled by the same worker, so only the global budget is shared.
+TELEGRAM_GLOBAL_RATE = 30 / BUDGET_SHARES
+TELEGRAM_GLOBAL_BURST = max(1, 30 // BUDGET_SHARES)
+TELEGRAM_CHAT_RATE = 1
+TELEGRAM_GROUP_RATE = 20 / 60
+outbound = OutboundScheduler(
+    global_rate=TELEGRAM_GLOBAL_RATE,
+    global_burst=TELEGRAM_GLOBAL_BURST,
+    chat_rate=TELEGRAM_CHAT_RATE,
+    group_rate=TELEGRAM_GROUP_RATE,
+)
+
+# Connection pool for backend calls
+BACKEND_POOL_SIZE = 20
+BACKEND_TIMEOUT = 10.0
+
+# Circuit breakers: open after this many consecutive failures, probe again after the reset timeout
+BREAKER_FAILURE_THRESHOLD = 5
+BREAKER_RESET_TIMEOUT = 15.0
+backend_breakers = BreakerGroup(
+    "backend ", failure_threshold=BREAKER_FAILURE_THRESHOLD, reset_timeout=BREAKER_RESET_TIMEOUT
+)
 
-# Backend API URL
-BASE_URL = "http://localhost:5000"
+# Shared backend client used by every handler
+backend = BackendClient(config.backend_url, pool_size=BACKEND_POOL_SIZE, timeout=BACKEND_TIMEOUT, breakers=backend_breakers)
+
+# Battles started from the bot (tracks, voting messages, counts); kept for a while after close
+# and saved to config.battle_sessions_path so keyboards keep updating after a restart
+BATTLE_SESSION_TTL = 3600
+battle_sessions = BattleSessionStore(config.battle_sessions_path, closed_ttl=BATTLE_SESSION_TTL)
+
+# Voting period (MusicBattle.sol MAX_BATTLE_DURATION), used when the backend does not return endTime,
+# and how long after it the bot closes the battle and posts the result
+BATTLE_DURATION = 60
+BATTLE_CLOSE_GRACE = 3
+battle_scheduler = BattleScheduler()
+
+# Track, creator and voter rankings across all battles, saved to config.leaderboard_path
+# at most once per LEADERBOARD_SNAPSHOT_INTERVAL seconds; the ranking commands show the top LEADERBOARD_SIZE
+LEADERBOARD_SNAPSHOT_INTERVAL = 60
+LEADERBOARD_SIZE = 10
+if config.shard_index is not None and config.leaderboard_path:
+    # Sharded workers keep one set of rankings together, in a database next to the snapshot path
+    leaderboard = SqliteLeaderboard(os.path.splitext(config.leaderboard_path)[0] + ".db")
+else:
+    leaderboard = Leaderboard(config.leaderboard_path, flush_delay=LEADERBOARD_SNAPSHOT_INTERVAL)
+
+# Optimistic vote counts, reconciled with the backend every VOTE_RECONCILE_INTERVAL seconds
+VOTE_RECONCILE_INTERVAL = 30
+vote_tally = VoteTally(battle_sessions, reconcile_interval=VOTE_RECONCILE_INTERVAL)
+
+# Each voting keyboard is edited at most once per KEYBOARD_EDIT_INTERVAL seconds
+KEYBOARD_EDIT_INTERVAL = 2.0
+keyboard_debouncer = EditDebouncer(interval=KEYBOARD_EDIT_INTERVAL)
+
+# Per-endpoint freshness (seconds) of cached battle read commands
+READ_CACHE_TTLS = {
+    "votes": 5,
+    "details": 10,
+    "voters": 10,
+    "votersList": 15,
+    "leaderboard": 5,
+}
+READ_CACHE_SIZE = 1024
+read_cache = ResponseCache(READ_CACHE_TTLS, max_entries=READ_CACHE_SIZE)
 
-# Global dictionary to store user wallet information
-user_wallet_mapping = {}
+# Long lists (wallets, voters) are sent a page at a time; pages are rendered on demand and kept for a while
+LIST_PAGE_QUERIES = 256
+LIST_PAGE_TTL = 900
+list_pages = PageCache(max_queries=LIST_PAGE_QUERIES, ttl=LIST_PAGE_TTL)
+# Rows fetched per wallet_store / owner lookup while rendering pages
+LIST_FETCH_SIZE = 500
+
+# Vote intake: dedups (user, battle) pairs locally and bounds concurrent /votetrack calls.
+# Set VOTE_BATCHING to forward votes to /votetrack/batch in groups instead.
+VOTE_MAX_IN_FLIGHT = 8
+VOTE_BATCHING = False
+
+# Store holding each user's wallet information; its data is loaded in post_init
+wallet_store = create_wallet_store(config.wallet_store_backend, config.wallet_store_path)
 
 commands = [
     ("start", "Start the bot"),
@@ -43,6 +154,7 @@ commands = [
     ("startbattle", "Start a music battle"),
     ("getbattledetails", "Get details of a battle"),
     ("leaderboard", "View leaderboard"),
+    ("toptracks", "Most voted tracks"),
     ("closebattle", "Close a battle"),
     ("setwallet", "Set your wallet address"),
     ("getwallet", "Get your wallet address"),
@@ -64,10 +176,15 @@ async def help_command(update: Update, context: ContextTypes.DEFAULT_TYPE) -> No
         "/battledetails <battleId> - Get details of a battle\n"
         "/battlevoters <battleId> - Get total voters for a battle\n"
         "/leaderboard <battleId> - Get the top voters\n"
+        "/toptracks [genre] - Most voted tracks across all battles, or within a genre\n"
+        "/topcreators - Creators ranked by the votes their tracks received\n"
+        "/topvoters - Users who voted the most\n"
         "/getVotersList <battleId> - Get voters of the Battle\n"
         "/getContractBalance - Get the balance held by the contract\n"
         "/closeBattle <battleId> - Close the battle with specific battleId\n"
         "/transferToOwner <amount> <userAddress> <senderAddress> - Send the money from contract to the senderAddress: Only Owner\n"
+        "/cachestats - Show cache statistics\n"
+        "/stats - Show handler latency and queue statistics (admins)\n"
         
         # Wallet-related commands
         "\n\nWallet Management:\n"
@@ -78,8 +195,6 @@ async def help_command(update: Update, context: ContextTypes.DEFAULT_TYPE) -> No
     )
     await update.message.reply_text(help_text)
 
-from telegram import InlineKeyboardButton, InlineKeyboardMarkup
-
 # Predefined mappings
 GENRES = {
     "Pop": 5,  # Payment amount for Pop genre
@@ -88,6 +203,9 @@ GENRES = {
     "Classical": 3,
 }
 
+# The genre keyboard never changes, so it is built (and serialized) once
+GENRE_KEYBOARD = genre_keyboard(GENRES)
+
 CREATOR_NAME_MAPPING = {
     "0x14dC79964da2C08b23698B3D3cc7Ca32193d9955": "Creator A",
     "0x23618e81E3f5cdF7f54C3d65f7FBc0aBf5B21E8f": "Creator B",
@@ -125,14 +243,28 @@ SONG_CREATOR_MAPPING = {
     ],
 }
 
-from spotipy import Spotify
-from spotipy.oauth2 import SpotifyClientCredentials
-sp_client = Spotify(
-    client_credentials_manager=SpotifyClientCredentials(
-        client_id="c06977428df14ed698a9ac3d48472ff3",
-        client_secret="d910bed851e74323be72a49dd78679f0")
+# Track pools per genre, refreshed in the background
+TRACK_POOL_SIZE = 200
+TRACK_POOL_TTL = 3600
+spotify_breaker = CircuitBreaker(
+    "spotify", failure_threshold=BREAKER_FAILURE_THRESHOLD, reset_timeout=BREAKER_RESET_TIMEOUT
 )
 
+# Spotify searches: requests per second shared by all searches, the burst allowed above it
+# (enough for warming every genre's pool at startup) and requests in flight at once
+SPOTIFY_RATE = 10 / BUDGET_SHARES
+SPOTIFY_BURST = max(1, 20 // BUDGET_SHARES)
+SPOTIFY_CONCURRENCY = 4
+spotify = SpotifyClient(
+    config.spotify_client_id,
+    config.spotify_client_secret,
+    rate=SPOTIFY_RATE,
+    burst=SPOTIFY_BURST,
+    max_concurrency=SPOTIFY_CONCURRENCY,
+    breaker=spotify_breaker,
+)
+track_cache = GenreTrackCache(spotify, pool_size=TRACK_POOL_SIZE, ttl=TRACK_POOL_TTL)
+
 def is_valid_json(response_text):
     try:
         # Try to parse the response as JSON
@@ -141,8 +273,6 @@ def is_valid_json(response_text):
     except json.JSONDecodeError:
         # If an error occurs during parsing, it's not valid JSON
         return False
-    
-from telegram import InlineKeyboardButton, InlineKeyboardMarkup
 
 async def start_battle(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
     """Starts a new music battle with genre selection."""
@@ -152,294 +282,320 @@ async def start_battle(update: Update, context: ContextTypes.DEFAULT_TYPE) -> No
         )
         return
 
-    # Step 1: Create Inline Keyboard for Genre Selection
-    buttons = []
-    for genre in GENRES.keys():
-        buttons.append([InlineKeyboardButton(genre, callback_data=f"genre|{genre}")])
-
-    keyboard = InlineKeyboardMarkup(buttons)
-
+    # Step 1: Send the genre selection keyboard
     await update.message.reply_text(
         "🎶 Select a music genre for the battle:",
-        reply_markup=keyboard,
+        reply_markup=GENRE_KEYBOARD,
     )
 
 
-# Callback handler for genre selection
-
-# Initialize logger
-logger = logging.getLogger(__name__)
-
-# Constants (to be replaced with actual values in your project)
-BASE_URL = "http://localhost:5000"  # Replace with your backend URL
-# GENRES = {"pop": 10, "rock": 15}  # Example genre-to-payment mapping
-
-SONG_CREATOR_MAPPING = {
-    "Pop": [
-        {"song": "Pop Song 1", "creator": "0x14dC79964da2C08b23698B3D3cc7Ca32193d9955"},
-        {"song": "Pop Song 2", "creator": "0x23618e81E3f5cdF7f54C3d65f7FBc0aBf5B21E8f"},
-    ],
-    "Rock": [
-        {"song": "Rock Song 1", "creator": "0xa0Ee7A142d267C1f36714E4a8F75612F20a79720"},
-        {"song": "Rock Song 2", "creator": "0xBcd4042DE499D14e55001CcbB24a551F3b954096"},
-    ],
-    "Hip-Hop": [
-        {"song": "Hip-Hop Song 1", "creator": "0x71bE63f3384f5fb98995898A86B02Fb2426c5788"},
-        {"song": "Hip-Hop Song 2", "creator": "0x1CBd3b2770909D4e10f157cABC84C7264073C9Ec"},
-    ],
-    "Classical": [
-        {"song": "Classical Song 1", "creator": "0xdF3e18d64BC6A983f673Ab319CCaE4f1a57C7097"},
-        {"song": "Classical Song 2", "creator": "0xcd3B766CCDd6AE721141F452C550Ca635964ce71"},
-    ],
-}
- 
 async def fetch_battle_data(payload):
     """Function to fetch battle data from the backend."""
     try:
-        logger.info(f"Payload type: {type(payload)}")
-        logger.info(f"Raw payload: {payload}")
+        logger.debug("Raw payload (%s): %s", type(payload).__name__, payload)
         
         # Make sure payload is a proper dictionary
         if isinstance(payload, str):
             payload = json.loads(payload)  # Convert string to dict if needed
         
-        response = requests.post(
-            f"{BASE_URL}/startbattle", 
-            json=payload,
-            headers={'Content-Type': 'application/json'}
-        )
+        response = await backend.post("/startbattle", payload, timeout=TRANSACTION_TIMEOUT)
         
-        logger.info(f"Response status: {response.status_code}")
+        logger.info("Start battle response status: %s", response.status_code)
         
         if response.status_code == 200:
             return response.json()
         else:
-            logger.error(f"Error response: {response.text}")
+            logger.error("Error response: %s", response.text)
             return {"error": f"HTTP {response.status_code}: {response.text}"}
     except json.JSONDecodeError as e:
         logger.error(f"JSON Decode Error: {e}")
         raise
+    except CircuitOpenError:
+        raise
     except Exception as e:
         logger.error("Error during request:", exc_info=True)
         raise Exception("Failed to connect to the backend") from e
 
-# Callback handler for genre selection
-async def handle_genre_selection(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
-    """Handles genre selection, starts the battle, and sets up voting UI."""
-    query = update.callback_query
-    await query.answer()
+class StageError(Exception):
+    """A stage of starting a battle failed; `message` is what the user is shown."""
 
-    # Extract selected genre
-    print(f"Callback data received: {query.data}")
-    _, genre = query.data.split("|")
-    print(f"Selected genre: {genre}")
+    def __init__(self, message):
+        super().__init__(message)
+        self.message = message
+
+async def run_stages(*stages):
+    """Runs the coroutines concurrently and returns their results in order.
+
+    The first failure cancels the other stages and is re-raised as is rather
+    than wrapped in an ExceptionGroup.
+    """
+    try:
+        async with asyncio.TaskGroup() as group:
+            tasks = [group.create_task(stage) for stage in stages]
+    except BaseExceptionGroup as e:
+        raise e.exceptions[0] from None
+    return [task.result() for task in tasks]
+
+async def edit_or_log(query, text):
+    """Edits the callback's message; a failed edit is logged rather than failing the caller."""
+    try:
+        await query.edit_message_text(text)
+    except TelegramError as e:
+        logger.warning("Could not edit message: %s", e)
 
-    # Step 1: Fetch two random tracks from Spotify for the selected genre
+async def select_tracks(genre):
+    """Picks two random tracks of `genre` and two creators; returns ((name, artist), ...), (creator, ...)."""
     try:
-        print("Fetching tracks from Spotify...")
-        results = sp_client.search(q=f"genre:{genre}", type="track", limit=10)
-        tracks = results["tracks"]["items"]
-        print(f"Tracks fetched: {len(tracks)} found.")
+        tracks = await track_cache.get(genre)
+        logger.debug("Tracks available for %s: %d", genre, len(tracks))
 
         if len(tracks) < 2:
-            print("Not enough tracks found.")
-            await query.edit_message_text("❌ Not enough tracks found in the selected genre.")
-            return
+            logger.warning("Not enough tracks found for %s", genre)
+            raise StageError("❌ Not enough tracks found in the selected genre.")
 
-        # Randomly select two tracks
         selected_tracks = random.sample(tracks, 2)
-        track1 = selected_tracks[0]
-        track2 = selected_tracks[1]
-        selected_addresses = random.sample(addresses_list, 2)
-        creator1 = selected_addresses[0]
-        creator2 = selected_addresses[1]
-
-        # Extract track details
-        track1_id = track1["id"]
-        track1_name = sanitize_string(track1["name"])
-        track1_artist = sanitize_string(track1["artists"][0]["name"])
-        track1_preview = track1.get("preview_url", "No preview available")
-
-
-        track2_id = track2["id"]
-        track2_name = sanitize_string(track2["name"])
-        track2_artist = sanitize_string(track2["artists"][0]["name"])
-        track2_preview = track2.get("preview_url", "No preview available")
-
-
-        # Debug track details
-        print(f"Track 1: {track1_name} by {track1_artist}")
-        print(f"Track 2: {track2_name} by {track2_artist}")
-
-        print("track1_preview:---------:",track1_preview)
-        print("track2_preview:---------:",track2_preview)
-
-        # Store track details in context for later use
-        context.user_data["tracks"] = {
-            track1_id: {"name": track1_name, "artist": track1_artist},
-            track2_id: {"name": track2_name, "artist": track2_artist},
-        }
-
-        dictionaryStoringArtistsWithWalletAddresses={
-            creator1:track1_artist,
-            creator2:track2_artist,
-        }
-
+        creators = tuple(random.sample(addresses_list, 2))
+        for track in selected_tracks:
+            logger.debug("Track: %s by %s (preview: %s)", track["name"], track["artists"][0]["name"],
+                         track.get("preview_url", "No preview available"))
+        return tuple(
+            (sanitize_string(track["name"]), sanitize_string(track["artists"][0]["name"])) for track in selected_tracks
+        ), creators
+    except StageError:
+        raise
+    except CircuitOpenError as e:
+        raise StageError(f"⏳ Spotify is not responding right now, try again in {e.retry_after:.0f}s.") from e
     except Exception as e:
-        logger.error(f"Error fetching tracks: {e}")
-        print(f"Error fetching tracks: {e}")
-        await query.edit_message_text("❌ Failed to fetch tracks from Spotify.")
-        return
-
-    # Step 3: Get payment amount for the selected genre
-    payment_amount = GENRES.get(genre, 0)
-    print(f"Payment amount for {genre}: {payment_amount}")
+        logger.error("Error fetching tracks: %s", e)
+        raise StageError("❌ Failed to fetch tracks from Spotify.") from e
 
-    # Retrieve the wallet address
-    user_address = ""
+async def resolve_wallet(user_id):
+    """The wallet address stored for `user_id`."""
     try:
-        user_id = query.from_user.id  # Get the unique user ID
-        user_id=str(user_id)
-
-    # Check if the user's wallet is stored in the global mapping
-        if user_id not in user_wallet_mapping:
-            await query.edit_message_text("❌ You haven't set your wallet address yet. Use /setwallet to set it.")
-            return
-
-    # Retrieve the wallet address for the user
-        user_address = user_wallet_mapping[user_id]["wallet"]
-        await query.edit_message_text(f"✅ Your wallet address is {user_address}.")
+        entry = await wallet_store.get(user_id)
     except Exception as e:
-        logger.error(f"Exception occurred: {e}")
-        await query.edit_message_text("❌ Failed to retrieve wallet address.")
-
+        logger.error("Exception occurred while fetching wallet: %s", e)
+        raise StageError("❌ Failed to retrieve wallet address.") from e
+    if entry is None:
+        raise StageError("❌ You haven't set your wallet address yet. Use /setwallet to set it.")
+    return entry["wallet"]
+
+async def create_battle(payload):
+    """POSTs /startbattle; returns the backend's response data."""
+    json_payload = json.dumps(payload)
+    if not is_valid_json(json_payload):
+        logger.warning("Invalid start battle payload: %s", json_payload)
+    logger.debug("Start battle payload: %s", json_payload)
 
+    try:
+        data = await fetch_battle_data(json_payload)
+    except CircuitOpenError as e:
+        raise StageError(f"⏳ The backend is not responding right now, try again in {e.retry_after:.0f}s.") from e
     except Exception as e:
-        logger.error(f"Exception occurred: {e}")
-        print(f"Exception occurred while fetching wallet: {e}")
-        await query.edit_message_text("❌ Failed to retrieve wallet address.")
-        return
+        logger.error("General error occurred", exc_info=True)
+        raise StageError("❌ Failed to connect to the backend.") from e
 
-    # Step 4: Prepare payload
-    payload = {
-        "track1": track1_name,
-        "track2": track2_name,
-        "creatorTrack1": creator1,
-        "creatorTrack2": creator2,
-        "userAddress": user_address,
-        "paymentAmount": payment_amount,
-    }
-    
+    if "error" in data:
+        raise StageError(f"❌ Error: {data['error']}")
+    if data.get("battleId", "N/A") == "N/A":
+        raise StageError("❌ Battle creation failed.")
+    return data
 
+# Callback handler for genre selection
+async def handle_genre_selection(update: Update, context: ContextTypes.DEFAULT_TYPE, selection) -> None:
+    """Handles genre selection, starts the battle, and sets up voting UI.
+
+    Stages that do not depend on each other run concurrently: answering the
+    button, picking the tracks and looking up the wallet; then showing the
+    wallet alongside the /startbattle request; then the battle details
+    alongside the voting message. A failed stage cancels the rest and its
+    message replaces the genre keyboard.
+    """
+    query = update.callback_query
+    genre = selection.genre
+    logger.info("Genre selected", extra={"fields": {"genre": genre}})
 
-    
-    print(f"Payload prepared: {payload}")
-    json_payload = json.dumps(payload)
-    if is_valid_json(json_payload):
-        print(f"\n\n\nValid json payload\n")
-    else:
-        print(f"\n\n\n Invalid json payload\n\n")
-    print(f"Dumped Payload prepared: {json_payload}")
+    payment_amount = GENRES.get(genre, 0)
+    logger.debug("Payment amount for %s: %s", genre, payment_amount)
 
-    # Step 5: Send payload to the backend
     try:
-        data = await fetch_battle_data(json_payload)  # Call the separate function for fetching data
-        
-        if "error" in data:
-            # If an error is found in the data, return the error message
-            await query.edit_message_text(f"❌ Error: {data['error']}")
-            return
-
-        battleId = data.get("battleId", "N/A")
-        if battleId == "N/A":
-            await query.edit_message_text("❌ Battle creation failed.")
-            return
-
-        message = (
-            f"🎵 {data['message']}\n"
-            f"Battle ID: {battleId}\n"
-            f"Balance Before: {data['balanceBefore']}\n"
-            f"Balance After: {data['balanceAfter']}\n"
-            f"Transaction Hash: {data['transactionHash']}"
+        _, (tracks, creators), user_address = await run_stages(
+            query.answer(),
+            select_tracks(genre),
+            resolve_wallet(str(query.from_user.id)),
         )
-        await query.edit_message_text(message)
-        print("after the sending transaction of battle start")
 
-    except Exception as e:
-        # General error handling
-        logger.error("General error occurred", exc_info=True)
-        await query.edit_message_text("❌ Failed to connect to the backend.")
+        payload = {
+            "track1": tracks[0][0],
+            "track2": tracks[1][0],
+            "creatorTrack1": creators[0],
+            "creatorTrack2": creators[1],
+            "userAddress": user_address,
+            "paymentAmount": payment_amount,
+        }
+        _, data = await run_stages(
+            edit_or_log(query, f"✅ Your wallet address is {user_address}."),
+            create_battle(payload),
+        )
+    except StageError as e:
+        await query.edit_message_text(e.message)
         return
 
-    # Step 6: Set up the voting UI
-    messageToSendToCallBack=f"Vote for your favorite track below:\n\n"f"Track 1: {track1_name} by {creator1}\n"f"Track 2: {track2_name} by {creator2}\n"
-    buttons = [
-        [
-            InlineKeyboardButton(
-                f"🎵 Vote Track 1 (0 votes)",
-                callback_data=f"vote|track1|{battleId}|{payment_amount}",
-            ),
-            InlineKeyboardButton(
-                f"🎵 Vote Track 2 (0 votes)",
-                callback_data=f"vote|track2|{battleId}|{payment_amount}",
-            ),
-        ]
-    ]
-    voting_keyboard = InlineKeyboardMarkup(buttons)
-
-    await query.message.reply_text(
-        f"Vote for your favorite track below:\n\n"
-        f"Track 1: {track1_name} by {dictionaryStoringArtistsWithWalletAddresses[creator1]}\n"
-        f"Track 2: {track2_name} by {dictionaryStoringArtistsWithWalletAddresses[creator2]}\n"
+    battleId = data["battleId"]
+    logger.info("Battle started", extra={"fields": {"battle_id": battleId, "genre": genre}})
+
+    # The battle's state lives in its session, where the vote path and later restarts find it
+    ends_at = float(data["endTime"]) if data.get("endTime") else time.time() + BATTLE_DURATION
+    session = battle_sessions.create(
+        int(battleId),
+        genre=genre,
+        tracks=tracks,
+        creators=creators,
+        payment_amount=payment_amount,
+        ends_at=ends_at,
+    )
+    leaderboard.record_battle(session)
+    battle_scheduler.schedule(int(battleId), ends_at + BATTLE_CLOSE_GRACE)
+
+    message = (
+        f"🎵 {data['message']}\n"
+        f"Battle ID: {battleId}\n"
+        f"Balance Before: {data['balanceBefore']}\n"
+        f"Balance After: {data['balanceAfter']}\n"
+        f"Transaction Hash: {data['transactionHash']}"
     )
-    await query.message.reply_text("Give your votes here",reply_markup=voting_keyboard, )
+    # The track list and the vote buttons go out as one message
+    _, voting_message = await run_stages(
+        edit_or_log(query, message),
+        query.message.reply_text(
+            f"Vote for your favorite track below:\n\n"
+            f"Track 1: {session.track_name(1)}\n"
+            f"Track 2: {session.track_name(2)}\n",
+            reply_markup=build_vote_keyboard(battleId, payment_amount),
+        ),
+    )
+    vote_tally.set(int(battleId), 0, 0)
+    vote_tally.watch(int(battleId), voting_message.chat_id, voting_message.message_id, payment_amount)
+
+async def post_vote(payload):
+    """Sends one vote to the backend; returns (status_code, data)."""
+    response = await backend.post("/votetrack", payload, timeout=TRANSACTION_TIMEOUT)
+    try:
+        data = response.json()
+    except ValueError:
+        data = {}
+    return response.status_code, data
+
+async def post_vote_batch(payloads):
+    """Sends several votes to the backend's bulk endpoint; returns one (status_code, data) per vote.
+
+    When the whole batch is refused, every vote gets the batch's status and error.
+    """
+    response = await backend.post("/votetrack/batch", {"votes": payloads}, timeout=TRANSACTION_TIMEOUT)
+    try:
+        data = response.json()
+    except ValueError:
+        data = {}
+    if response.status_code != 200:
+        return [(response.status_code, data)] * len(payloads)
+    return [(entry["status"], entry["body"]) for entry in data["results"]]
+
+vote_queue = VoteQueue(
+    post_vote,
+    post_vote_batch if VOTE_BATCHING else None,
+    max_in_flight=VOTE_MAX_IN_FLIGHT,
+)
+
+# Button state too large for callback_data is kept here and referenced by a short token
+CALLBACK_REGISTRY_TTL = 7 * 24 * 3600
+callback_registry = CallbackRegistry(ttl=CALLBACK_REGISTRY_TTL)
+
+# Vote keyboards are memoized per (battle, payment, counts); most edits and sends reuse one
+VOTE_KEYBOARD_CACHE_SIZE = 4096
+build_vote_keyboard = memoized_vote_keyboard(callback_registry, VOTE_KEYBOARD_CACHE_SIZE)
+
+async def fetch_vote_counts(battle_id):
+    """Reads a battle's vote counts from the backend."""
+    response = await backend.get(f"/battle/{battle_id}/votes")
+    data = response.json()
+    if response.status_code != 200:
+        raise Exception(data.get("error", "Unknown error."))
+    return int(data["track1Votes"]), int(data["track2Votes"])
+
+def refresh_vote_keyboards(bot, battle_id):
+    """Schedules a debounced re-render of every voting message of a battle."""
+    for (chat_id, message_id), payment_amount in vote_tally.messages(battle_id).items():
+        async def render(chat_id=chat_id, message_id=message_id, payment_amount=payment_amount):
+            counts = vote_tally.get(battle_id)
+            session = battle_sessions.get(battle_id)
+            if counts is None or (session is not None and session.closed_at is not None):
+                # The keyboard of a closed battle has been replaced by the final result
+                return
+            try:
+                await bot.edit_message_reply_markup(
+                    chat_id=chat_id,
+                    message_id=message_id,
+                    reply_markup=build_vote_keyboard(battle_id, payment_amount, *counts),
+                    rate_limit_args={"priority": PRIORITY_LOW},
+                )
+            except BadRequest as e:
+                # Telegram rejects edits that would not change the keyboard
+                if "not modified" not in str(e):
+                    raise
+        keyboard_debouncer.schedule((chat_id, message_id), render)
+
+def reply_in_background(context, coroutine):
+    """Sends a reply without awaiting it.
+
+    The handler holds its chat's ordering slot until it returns, so awaiting a
+    send that waits on the chat's rate budget (20 messages/min in groups) would
+    hold back the next vote in that chat as well.
+    """
+    context.application.create_task(coroutine)
 
 # Callback handler for voting (handles both UI updates and functionality)
-async def handle_voting(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
+async def handle_voting(update: Update, context: ContextTypes.DEFAULT_TYPE, vote) -> None:
     """Handles voting for tracks and updates the user with a separate message."""
     query = update.callback_query
+    # Vote confirmations go ahead of informational messages when sends are throttled
+    outbound_priority.set(PRIORITY_HIGH)
     await query.answer()
 
-    # Extract the data from the callback_data
-    try:
-        # Unpack the data based on the updated structure
-        _, voted_track, battle_id, payment_amount= query.data.split("|")
-    except ValueError:
-        await query.message.reply_text("❌ Invalid voting data received. Please try again.")
-        return
+    # The button's callback data was decoded (and typed) by handle_callback
+    battle_id = vote.battle_id
+    payment_amount = vote.payment_amount
+    track_number = vote.track
 
-    # Convert battle_id and payment_amount to appropriate types
-    try:
-        battle_id = int(battle_id)  # Convert to integer if necessary
-        payment_amount = float(payment_amount)  # Convert to float for numeric operations
-    except ValueError:
-        await query.message.reply_text("❌ Invalid data format in voting information.")
+    # Presses after the voting period would only fail on chain
+    session = battle_sessions.get(battle_id)
+    if session is not None and not session.voting_open(time.time()):
+        reply_in_background(context, query.message.reply_text("❌ Battle voting period has ended"))
         return
 
-    # Determine the track number (1 or 2) based on the vote
-    track_number = 1 if voted_track == "track1" else 2
-
     user_address = ""
     try:
         user_id = query.from_user.id  # Get the unique user ID
         user_id=str(user_id)
 
-    # Check if the user's wallet is stored in the global mapping
-        if user_id not in user_wallet_mapping:
-            await query.edit_message_text("❌ You haven't set your wallet address yet. Use /setwallet to set it.")
+    # Check if the user's wallet is stored
+        entry = await wallet_store.get(user_id)
+        if entry is None:
+            reply_in_background(
+                context, query.edit_message_text("❌ You haven't set your wallet address yet. Use /setwallet to set it.")
+            )
             return
 
     # Retrieve the wallet address for the user
-        user_address = user_wallet_mapping[user_id]["wallet"]
+        user_address = entry["wallet"]
         # await query.edit_message_text(f"✅ Your wallet address is {user_address}.")
     except Exception as e:
         logger.error(f"Exception occurred: {e}")
-        await query.edit_message_text("❌ Failed to retrieve wallet address.")
+        reply_in_background(context, query.edit_message_text("❌ Failed to retrieve wallet address."))
 
 
     # Prepare the payload to send to the backend
     if not battle_id or not user_address or not payment_amount:
-        await query.message.reply_text("❌ Missing required information to process your vote.")
+        reply_in_background(context, query.message.reply_text("❌ Missing required information to process your vote."))
         return
 
     payload = {
@@ -452,73 +608,65 @@ async def handle_voting(update: Update, context: ContextTypes.DEFAULT_TYPE) -> N
     transaction_hash = ""
     try:
         # Step 1: Make API request to process the vote
-        print("YOUR PAYLOAD IS THIS:")
-        print(payload)
-        response = requests.post(f"{BASE_URL}/votetrack", json=payload)
-
-        # Try to parse the JSON response
-        data = response.json() if response.status_code == 200 else {}
+        logger.info("Vote submitted", extra={"sample": "vote", "fields": payload})
+        result = await vote_queue.submit(user_id, battle_id, payload)
+        status_code, data = result
 
         # Step 2: Handle response status codes
         message_from_backend=""
-        if response.status_code == 200:
+        if status_code == 200:
             transaction_hash = data.get("transactionHash", "N/A")
             message_from_backend = data.get("message", "N/A")
 
-            if message_from_backend=="You have already voted in this battle." :
+            if result.duplicate:
+                # A repeated press: the original press reports the outcome of this vote
+                transaction_hash = ""
+                message = "❌ You have already voted in this battle."
+            elif message_from_backend=="You have already voted in this battle." :
                 message = message = "❌ You have already voted in this battle."
             elif transaction_hash!="N/A":
+                voted_for = f"Track {track_number}"
+                session = battle_sessions.get(battle_id)
+                if session is not None and session.track_name(track_number):
+                    voted_for += f" ({session.track_name(track_number)})"
                 message = (
-                f"✅ Your vote for Track {track_number} has been recorded!\n"
+                f"✅ Your vote for {voted_for} has been recorded!\n"
                 f"Transaction Hash: {transaction_hash}")
             else:
                 message="ELse Case ----"
-        elif response.status_code == 500 and message_from_backend=="Battle voting period has ended":
+        elif status_code == 500 and message_from_backend=="Battle voting period has ended":
                 message = "❌ Battle voting period has ended"
         else:
             # Handle non-200 status codes
             message = f"❌ Error: {data.get('error', 'Unknown error occurred.')}"
-    except requests.exceptions.RequestException as e:
+    except CircuitOpenError as e:
+        # Fail fast instead of queueing behind a backend that keeps timing out
+        message = f"⏳ Voting is temporarily unavailable, try again in {e.retry_after:.0f}s."
+    except httpx.HTTPError as e:
     # Catch network-related exceptions
         message = f"❌ Failed to connect to the backend. {str(e)}"
+    except Exception as e:
+        # E.g. a malformed answer from the batch endpoint: the voter still gets a reply
+        logger.error(f"Exception occurred while submitting a vote: {e}")
+        message = "❌ Failed to process your vote."
 
     # Send the user a separate response message
-    await query.message.reply_text(message)
-
-    # Step 2: Update the voting UI with backend vote counts
+    reply_in_background(context, query.message.reply_text(message))
 
-    try:
-            # Fetch updated vote counts from the backend
-            response = requests.get(f"{BASE_URL}/battle/{battle_id}/votes")
-            data = response.json()
-
-            if response.status_code == 200:
-                buttons = [
-                    [
-                        InlineKeyboardButton(
-                            f"🎵 Vote Track 1 ({data['track1Votes']} votes)",
-                            callback_data=f"vote|track1|{battle_id}|{payment_amount}",
-                        ),
-                        InlineKeyboardButton(
-                            f"🎵 Vote Track 2 ({data['track2Votes']} votes)",
-                            callback_data=f"vote|track2|{battle_id}|{payment_amount}",
-                        ),
-                    ]
-                ]
-                voting_keyboard = InlineKeyboardMarkup(buttons)
-
-                # Update the voting UI with current vote counts
-                await query.edit_message_text(
-                    "Give your votes here",
-                    reply_markup=voting_keyboard,
-                )
+    # Step 2: Update the voting UI with the optimistic vote counts
+    if transaction_hash not in ("", "N/A"):
+        leaderboard.record_vote(battle_id, track_number, user_address, battle_sessions.get(battle_id))
+        try:
+            read_cache.invalidate(battle_id)
+            if battle_id not in vote_tally:
+                # First vote seen for this battle since startup: seed from the backend
+                vote_tally.set(battle_id, *await fetch_vote_counts(battle_id))
             else:
-                await query.message.reply_text(
-                    f"❌ Failed to fetch updated votes. Error: {data.get('error', 'Unknown error.')}"
-                )
-    except Exception as e:
+                vote_tally.record(battle_id, track_number)
+            vote_tally.watch(battle_id, query.message.chat_id, query.message.message_id, payment_amount)
+            refresh_vote_keyboards(context.bot, battle_id)
+        except Exception as e:
             logger.error(f"Exception occurred while updating UI: {e}")
-            # await query.message.reply_text("❌ Failed to update the voting UI.")
 
 # Command: /votetrack
 async def vote_track(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
@@ -538,10 +686,11 @@ async def vote_track(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None
         }
 
         # Making API request
-        response = requests.post(f"{BASE_URL}/votetrack", json=payload)
+        response = await backend.post("/votetrack", payload, timeout=TRANSACTION_TIMEOUT)
         data = response.json()
 
         if response.status_code == 200:
+            read_cache.invalidate(battleId)
             message = (
                 f"✅ {data['message']} \n"
                 f"Transaction Hash: {data.get('transactionHash', 'N/A')}"
@@ -554,7 +703,39 @@ async def vote_track(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None
         logger.error(f"Exception occurred: {e}")
         message = "❌ Failed to connect to the backend."
 
-    await update.message.reply_text(message)
+    reply_in_background(context, update.message.reply_text(message))
+
+# Backend read endpoints served through read_cache
+READ_PATHS = {
+    "votes": "/battle/{}/votes",
+    "details": "/battle/{}/details",
+    "voters": "/battle/{}/voters",
+    "votersList": "/battle/{}/votersList",
+    "leaderboard": "/leaderboard/{}",
+}
+
+async def cached_read(endpoint, battle_id):
+    """Reads a battle endpoint through the response cache; returns (status_code, data)."""
+    async def fetch():
+        response = await backend.get(READ_PATHS[endpoint].format(battle_id))
+        data = response.json()
+        return (response.status_code, data), response.status_code == 200
+    return await read_cache.get(endpoint, battle_id, fetch)
+
+# Command: /cachestats
+async def cache_stats(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
+    """Shows hit/miss statistics of the bot's caches."""
+    lines = ["📊 Cache statistics"]
+    for name, stats in (
+        ("Battle reads", read_cache.stats()),
+        ("Genre tracks", track_cache.stats()),
+        ("Vote queue", vote_queue.stats()),
+        ("List pages", list_pages.stats()),
+        ("Vote keyboards", build_vote_keyboard.cache_info()._asdict()),
+    ):
+        lines.append(f"\n{name}:")
+        lines.extend(f"  {key}: {value}" for key, value in stats.items())
+    await update.message.reply_text("\n".join(lines))
 
 # Command: /battlevotes
 async def get_votes(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
@@ -566,16 +747,14 @@ async def get_votes(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
     battleId = context.args[0]
 
     try:
-        response = requests.get(f"{BASE_URL}/battle/{battleId}/votes")
-        
         try:
-            data = response.json()
+            status_code, data = await cached_read("votes", battleId)
         except ValueError:
             logger.error("Invalid JSON response")
             await update.message.reply_text("❌ Backend returned an invalid response.")
             return
 
-        if response.status_code == 200:
+        if status_code == 200:
             message = (
                 f"🎶 Battle ID: {data['battleId']}\n"
                 f"Track 1 Votes: {data['track1Votes']}\n"
@@ -599,10 +778,9 @@ async def get_battle_details(update: Update, context: ContextTypes.DEFAULT_TYPE)
     battleId = context.args[0]
 
     try:
-        response = requests.get(f"{BASE_URL}/battle/{battleId}/details")
-        data = response.json()
+        status_code, data = await cached_read("details", battleId)
 
-        if response.status_code == 200:
+        if status_code == 200:
             message = (
                 f"🎶 Battle ID: {data['battleId']}\n"
                 f"Track 1: {data['track1']} (Votes: {data['votesTrack1']})\n"
@@ -628,10 +806,9 @@ async def get_total_voters(update: Update, context: ContextTypes.DEFAULT_TYPE) -
     battleId = context.args[0]
 
     try:
-        response = requests.get(f"{BASE_URL}/battle/{battleId}/voters")
-        data = response.json()
+        status_code, data = await cached_read("voters", battleId)
 
-        if response.status_code == 200:
+        if status_code == 200:
             message = f"🎶 Total Voters for Battle {data['battleId']}: {data['totalVoters']}"
         else:
             message = f"❌ Error: {data['error']}"
@@ -642,15 +819,18 @@ async def get_total_voters(update: Update, context: ContextTypes.DEFAULT_TYPE) -
     await update.message.reply_text(message)
 
 # Command: /leaderboard
-async def leaderboard(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
+async def leaderboard_command(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
     """Fetches the leaderboard for top tracks."""
+    if not context.args:
+        # Without a battle: the ranking across all battles
+        await top_tracks(update, context)
+        return
     try:
         # Assuming 'battleId' is somehow available in the context, for example, from the command
         battle_id = context.args[0]  # Replace with actual battleId from context or message
-        response = requests.get(f"{BASE_URL}/leaderboard/{battle_id}")  # Pass battleId here
-        data = response.json()
+        status_code, data = await cached_read("leaderboard", battle_id)  # Pass battleId here
 
-        if response.status_code == 200:
+        if status_code == 200:
             leaderboard_text = "🎶 Leaderboard\n"
             for idx, entry in enumerate(data['leaderboard']):
                 leaderboard_text += f"{idx+1}. {entry['track']} - {entry['votes']} votes\n"
@@ -662,22 +842,122 @@ async def leaderboard(update: Update, context: ContextTypes.DEFAULT_TYPE) -> Non
 
     await update.message.reply_text(leaderboard_text)
 
+def ranking_text(title, lines):
+    if not lines:
+        return f"{title}\nNo votes have been recorded yet."
+    return "\n".join([title] + [f"{position}. {line}" for position, line in enumerate(lines, 1)])
+
+# Command: /toptracks [genre]
+async def top_tracks(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
+    """Shows the most voted tracks across all battles, or within one genre."""
+    if context.args:
+        requested = " ".join(context.args).lower()
+        genre = next((name for name in GENRES if name.lower() == requested), None)
+        if genre is None:
+            await update.message.reply_text(f"❌ Unknown genre. Choose from: {', '.join(GENRES)}")
+            return
+        title = f"🎶 Top {genre} tracks"
+    else:
+        genre, title = None, "🎶 Top tracks across all battles"
+    entries = await leaderboard.top_tracks(LEADERBOARD_SIZE, genre)
+    await update.message.reply_text(ranking_text(title, [f"{track} - {votes} votes" for track, votes in entries]))
+
+# Command: /topcreators
+async def top_creators(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
+    """Shows the creators whose tracks received the most votes."""
+    lines = [
+        f"{CREATOR_NAME_MAPPING.get(creator, creator)} - {votes} votes, {wins} battles won"
+        for creator, votes, wins in await leaderboard.top_creators(LEADERBOARD_SIZE)
+    ]
+    await update.message.reply_text(ranking_text("🎤 Top creators", lines))
+
+# Command: /topvoters
+async def top_voters(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
+    """Shows the users who voted the most, and where the caller stands."""
+    entries = await leaderboard.top_voters(LEADERBOARD_SIZE)
+    owners = await wallet_store.users_for_wallets([voter for voter, _ in entries])
+    text = ranking_text("🗳 Top voters", [f"{format_voter(voter, owners)} - {votes} votes" for voter, votes in entries])
+
+    entry = await wallet_store.get(str(update.effective_user.id))
+    standing = await leaderboard.voter_standing(entry["wallet"]) if entry is not None else None
+    if standing is not None:
+        text += f"\n\nYou: #{standing[0]} with {standing[1]} votes"
+    await update.message.reply_text(text)
+
+def format_voter(address, owners, markdown=False):
+    """Appends the Telegram username to a voter address when the wallet is known."""
+    if address not in owners:
+        return address
+    username = owners[address][1]
+    if markdown:
+        username = escape_markdown(username)
+    return f"{address} (@{username})"
+
+async def voter_lines(voters, markdown=False, bullet=""):
+    """Yields one line per voter, looking up wallet owners a chunk at a time."""
+    for start in range(0, len(voters), LIST_FETCH_SIZE):
+        chunk = voters[start:start + LIST_FETCH_SIZE]
+        owners = await wallet_store.users_for_wallets(chunk)
+        for voter in chunk:
+            yield f"{bullet}{format_voter(voter, owners, markdown)}"
+
+async def close_battle_lines(winner_voters, result_message):
+    async for line in voter_lines(winner_voters):
+        yield line
+    yield ""
+    yield "Balance Sheet"
+    yield ""
+    for line in str(result_message).splitlines():
+        yield line
+
+async def reply_paginated(message, lines, header="", parse_mode=None):
+    """Replies with the first page of a long list; Next/Prev buttons fetch the rest."""
+    _, page = await list_pages.open(lines, header=header, parse_mode=parse_mode)
+    await message.reply_text(page.text, parse_mode=page.parse_mode, reply_markup=page.keyboard)
+
+async def send_paginated(bot, chat_id, lines, header="", parse_mode=None):
+    """Like reply_paginated, for messages the bot sends on its own."""
+    _, page = await list_pages.open(lines, header=header, parse_mode=parse_mode)
+    await bot.send_message(chat_id, page.text, parse_mode=page.parse_mode, reply_markup=page.keyboard)
+
+# Callback: Next/Prev buttons of paginated lists
+async def handle_page(update: Update, context: ContextTypes.DEFAULT_TYPE, position) -> None:
+    """Shows another page of a paginated list."""
+    query = update.callback_query
+    page = await list_pages.page(position.query_id, position.index)
+    if page is None:
+        await query.answer("This list has expired, please run the command again.", show_alert=True)
+        return
+
+    await query.answer()
+    try:
+        await query.edit_message_text(page.text, parse_mode=page.parse_mode, reply_markup=page.keyboard)
+    except BadRequest as e:
+        # Pressing the current page number does not change the message
+        if "not modified" not in str(e):
+            raise
+
 # Command: /closebattle
 async def close_battle(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
     """Closes a battle and retrieves the winner."""
     try:
         # Making API request to get the winner after battle is closed
         battleId = context.args[0] 
-        response = requests.get(f"http://localhost:5000/battle/{battleId}/winner")
+        response = await backend.get(f"/battle/{battleId}/winner")
         data = response.json()
 
         if response.status_code == 200:
+            finish_battle(int(battleId))
             winnerVotersList = data.get("winnerVotersList", [])
             winner = data.get("part1","N/A")
             resultMessage=data.get("resultMessage","Not able to get Balance Sheet")
             
-            voters = "\n".join(winnerVotersList)
-            message = f"👥 {winner} \n\n👥 Winner Voters are : {voters}\n\n Balance Sheet\n\n {resultMessage}"
+            await reply_paginated(
+                update.message,
+                close_battle_lines(winnerVotersList, resultMessage),
+                header=f"👥 {winner} \n\n👥 Winner Voters are :",
+            )
+            return
         else:
             message = f"❌ Error: {data.get('error', 'Unknown error')}"
 
@@ -692,7 +972,7 @@ async def get_balance(update: Update, context: ContextTypes.DEFAULT_TYPE) -> Non
     """Fetches and displays the current balance."""
     try:
         # Making API request
-        response = requests.get("http://localhost:5000/balance")
+        response = await backend.get("/balance")
         data = response.json()
 
         if response.status_code == 200:
@@ -721,19 +1001,20 @@ async def get_voters_list(update: Update, context: ContextTypes.DEFAULT_TYPE) ->
 
     try:
         # Making API request
-        response = requests.get(f"http://localhost:5000/battle/{battle_id}/votersList")
-        data = response.json()
+        status_code, data = await cached_read("votersList", battle_id)
 
-        if response.status_code == 200:
+        if status_code == 200:
             battle_id = data.get("battleId", "Unknown")
             voters_list = data.get("votersList", [])
 
             if voters_list:
-                voters = "\n".join([f"🔸 {voter}" for voter in voters_list])
-                message = (
-                    f"👥 **Voters for Battle ID {battle_id}:**\n\n"
-                    f"{voters}"
+                await reply_paginated(
+                    update.message,
+                    voter_lines(voters_list, markdown=True, bullet="🔸 "),
+                    header=f"👥 **Voters for Battle ID {battle_id}:**\n",
+                    parse_mode="Markdown",
                 )
+                return
             else:
                 message = f"👥 **No voters yet for Battle ID {battle_id}.**"
         else:
@@ -757,7 +1038,7 @@ async def transfer_to_owner(update: Update, context: ContextTypes.DEFAULT_TYPE)
 
     try:
         # Making POST request
-        response = requests.post("http://localhost:5000/transferToOwner", json=payload)
+        response = await backend.post("/transferToOwner", payload, timeout=TRANSACTION_TIMEOUT)
         data = response.json()
 
         if response.status_code == 200 and data.get("success"):
@@ -782,9 +1063,10 @@ async def set_wallet(update: Update, context: CallbackContext):
     user_id=str(user_id)
 
     # Check if the user already has a wallet address set
-    if user_id in user_wallet_mapping:
+    entry = await wallet_store.get(user_id)
+    if entry is not None:
         # If the wallet is already set, notify the user with their current wallet
-        wallet = user_wallet_mapping[user_id]["wallet"]
+        wallet = entry["wallet"]
         await update.message.reply_text(
             f"Your wallet address is already set to {wallet}. If you want to change it, use /changewallet."
         )
@@ -799,36 +1081,19 @@ async def set_wallet(update: Update, context: CallbackContext):
     wallet = " ".join(context.args)
     
     # Store the wallet address for the user
-    user_wallet_mapping[user_id] = {
-        "wallet": wallet,
-        "user_info": update.message.from_user.username or "Unknown",
-    }
-
     try:
-        save_user_wallet_data()  # Save the updated data
+        await wallet_store.set(user_id, wallet, update.message.from_user.username or "Unknown")
     except Exception as e:
         logger.error(f"Problem in storing data: {e}")
 
     # Confirm the wallet address has been set
     await update.message.reply_text(f"Wallet address for @{update.message.from_user.username} set to {wallet}.")
 
-# Save data to a file for persistence
-def save_user_wallet_data():
-    with open("user_wallet_mapping.json", "w") as file:
-        json.dump(user_wallet_mapping, file)
-
-# Load data from a file during bot initialization
+# Load the stored wallets, battle sessions and leaderboard during bot initialization (post_init)
 def load_user_wallet_data():
-    print("load_user_wallet_data--------------------------------------------starts")
-    global user_wallet_mapping
-    try:
-        with open("user_wallet_mapping.json", "r") as file:
-            user_wallet_mapping = json.load(file)
-            print("userwallet:",user_wallet_mapping)
-    except FileNotFoundError as e:
-        print("error",e)
-        print("Failed to get the file:--------------------error::::::")
-        user_wallet_mapping = {}
+    wallet_store.load()
+    battle_sessions.load()
+    leaderboard.load()
 
 async def change_wallet(update: Update, context: CallbackContext):
     """Allow the user to change their existing wallet address."""
@@ -836,7 +1101,7 @@ async def change_wallet(update: Update, context: CallbackContext):
     user_id=str(user_id)
 
     # Check if the user has a wallet address set
-    if user_id not in user_wallet_mapping:
+    if await wallet_store.get(user_id) is None:
         await update.message.reply_text("You haven't set your wallet address yet. Use /setwallet to set it.")
         return
 
@@ -848,11 +1113,9 @@ async def change_wallet(update: Update, context: CallbackContext):
     # Join the arguments to form the new wallet address
     new_wallet = " ".join(context.args)
 
-    # Update the wallet address in the mapping
-    user_wallet_mapping[user_id]["wallet"] = new_wallet
-
+    # Update the wallet address in the store
     try:
-        save_user_wallet_data()  # Save the updated data
+        await wallet_store.set(user_id, new_wallet)
     except Exception as e:
         logger.error(f"Problem in storing data: {e}")
 
@@ -861,154 +1124,406 @@ async def change_wallet(update: Update, context: CallbackContext):
 
 
 async def get_wallet(update: Update, context: CallbackContext):
-    print("user_wallet_mapping in get wallet function",user_wallet_mapping)
     """Retrieve the wallet address for the user."""
     user_id = update.message.from_user.id
     
 
-    # print("user Id",user_id)
     user_id=str(user_id)
-    print("user Id",user_id)
 
     # Check if the user's wallet is stored
-    if user_id not in user_wallet_mapping:
+    entry = await wallet_store.get(user_id)
+    if entry is None:
         await update.message.reply_text("You haven't set your wallet address yet.")
-        print("Not Availble useraddress")
         return ""
 
-    wallet = user_wallet_mapping[user_id]["wallet"]
-    user_info = user_wallet_mapping[user_id]["user_info"]
+    wallet = entry["wallet"]
+    user_info = entry["user_info"]
 
     await update.message.reply_text(f"Your wallet address is {wallet} (Linked to {user_info}).")
     return wallet
 
 async def list_wallets(update: Update, context: CallbackContext):
-    print("user_wallet_mapping",user_wallet_mapping)
     """List all wallet addresses stored globally."""
-    if not user_wallet_mapping:
+    if not await wallet_store.count():
         await update.message.reply_text("No wallet addresses have been set yet.")
         return
 
-    response = "Global Wallet Mappings:\n"
-    for user_id, info in user_wallet_mapping.items():
-        user_info = info["user_info"]
-        wallet = info["wallet"]
-        response += f"User ID {user_id} ({user_info}): {wallet}\n"
-
-    await update.message.reply_text(response)
-
-
-
-
-
-import socket
-
-server = socket.socket()
-
-server.bind(( 'localhost' ,9999))
-
-server.listen(1)
-print('waiting for connection')
-
-while True:
-    c,address=server.accept()
-    name=c.recv(1024).decode()
-    print("Connected With",address,name)
-    c.send(bytes("Connection Established",'utf-8'))
-    c.close()
-
-
-
-
-
-
-
-
-
-
-
-
-
-
-
-
-
-
-
-
-
-
-
-
-
-
-
-
-
-
-
-
-
-
-
+    await reply_paginated(update.message, wallet_lines(), header="Global Wallet Mappings:")
 
+async def wallet_lines():
+    """Yields one line per stored wallet, reading the store a chunk at a time."""
+    offset = 0
+    while True:
+        wallets = await wallet_store.items(offset, LIST_FETCH_SIZE)
+        for user_id, info in wallets:
+            yield f"User ID {user_id} ({info['user_info']}): {info['wallet']}"
+        if len(wallets) < LIST_FETCH_SIZE:
+            return
+        offset += len(wallets)
 
 
 
 
 
+# Side channel the backend uses to push battle events into the bot
+side_channel = SideChannelServer(config.side_channel_host, config.side_channel_port)
 
+async def on_vote_recorded(event: dict) -> None:
+    """Handles a vote pushed by the backend."""
+    read_cache.invalidate(event["battleId"])
+    if event.get("userAddress") and event.get("trackNumber") in (1, 2):
+        battle_id = int(event["battleId"])
+        leaderboard.record_vote(battle_id, event["trackNumber"], event["userAddress"], battle_sessions.get(battle_id))
+    logger.info(
+        "Backend recorded a vote for track %s in battle %s", event.get("trackNumber"), event.get("battleId"),
+        extra={"sample": "vote"},
+    )
 
+async def on_battle_closed(event: dict) -> None:
+    """Handles a battle close pushed by the backend."""
+    logger.info(f"Backend closed battle {event.get('battleId')}")
+    finish_battle(int(event["battleId"]))
+
+def finish_battle(battle_id):
+    """Marks a battle closed and drops its cached reads, vote intake state and close timer."""
+    read_cache.invalidate(battle_id)
+    # A keyboard refresh still waiting to be sent would otherwise land after the final edit
+    for key in vote_tally.messages(battle_id):
+        keyboard_debouncer.cancel(key)
+    # Before the session is closed, so the win is only credited once
+    leaderboard.record_close(battle_id, battle_sessions.get(battle_id))
+    vote_tally.forget(battle_id)
+    vote_queue.forget_battle(battle_id)
+    battle_scheduler.cancel(battle_id)
+
+async def expire_battle(bot, battle_id):
+    """Closes a battle whose voting period has ended and posts the result where it was voted on."""
+    session = battle_sessions.get(battle_id)
+    if session is None or session.closed_at is not None:
+        return
+    messages = list(session.messages)
+    track1_votes, track2_votes = session.votes or (0, 0)
+    finish_battle(battle_id)
 
+    # Replace each voting keyboard with the final counts
+    for chat_id, message_id in messages:
+        try:
+            await bot.edit_message_text(
+                f"🔒 Voting has closed.\nTrack 1: {track1_votes} votes\nTrack 2: {track2_votes} votes",
+                chat_id=chat_id,
+                message_id=message_id,
+            )
+        except BadRequest as e:
+            logger.warning("Could not close the voting keyboard of battle %s: %s", battle_id, e)
 
+    chats = {chat_id for chat_id, _ in messages}
+    try:
+        response = await backend.get(f"/battle/{battle_id}/winner")
+        data = response.json()
+    except Exception as e:
+        logger.error("Failed to close battle %s: %s", battle_id, e)
+        response, data = None, {"error": "Failed to connect to the backend."}
+
+    for chat_id in chats:
+        if response is not None and response.status_code == 200:
+            await send_paginated(
+                bot,
+                chat_id,
+                close_battle_lines(data.get("winnerVotersList", []), data.get("resultMessage", "Not able to get Balance Sheet")),
+                header=f"🏁 Battle {battle_id} has ended\n\n👥 {data.get('part1', 'N/A')} \n\n👥 Winner Voters are :",
+            )
+        else:
+            await bot.send_message(
+                chat_id,
+                f"❌ Battle {battle_id} has ended but its result is unavailable: {data.get('error', 'Unknown error')}\n"
+                f"Use /closeBattle {battle_id} to fetch it.",
+            )
 
+side_channel.on(VOTE_RECORDED, on_vote_recorded)
+side_channel.on(BATTLE_CLOSED, on_battle_closed)
+
+class InstrumentedRequest(HTTPXRequest):
+    """Times every Telegram Bot API call made by the handlers."""
+
+    __slots__ = ()
+
+    async def do_request(self, *args, **kwargs):
+        with stage("telegram"):
+            return await super().do_request(*args, **kwargs)
+
+def collect_gauges(application: Application) -> None:
+    """Refreshes queue-depth and cache-size gauges before each metrics scrape."""
+    registry.set_gauge("bot_update_queue_depth", (), application.update_queue.qsize())
+    for key, value in update_processor.stats().items():
+        registry.set_gauge("bot_update_processor", (("field", key),), value)
+    for name, stats in (
+        ("read_cache", read_cache.stats()),
+        ("track_cache", track_cache.stats()),
+        ("spotify", spotify.stats()),
+        ("vote_queue", vote_queue.stats()),
+        ("outbound", outbound.stats()),
+        ("battle_sessions", battle_sessions.stats()),
+        ("battle_scheduler", battle_scheduler.stats()),
+        ("leaderboard", leaderboard.stats()),
+    ):
+        for key, value in stats.items():
+            registry.set_gauge("bot_component", (("component", name), ("field", key)), value)
+
+# Prometheus-style metrics endpoint
+metrics_server = MetricsServer(config.metrics_host, config.metrics_port)
+
+# Command: /stats
+async def stats_command(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
+    """Shows handler latency, error counts and update queue depth (admins only)."""
+    # Internal metrics: with no ADMIN_USER_IDS configured nobody may read them
+    if update.effective_user.id not in config.admin_user_ids:
+        await update.message.reply_text("❌ This command is only available to bot admins.")
+        return
 
+    rows, errors = summary()
+    lines = ["📈 Bot statistics", ""]
+    for row in rows:
+        lines.append(
+            f"{row['kind']} {row['name']}: {row['count']} calls, avg {row['avg_ms']} ms, "
+            f"p50 ≤{row['p50_ms']:g} ms, p99 ≤{row['p99_ms']:g} ms"
+        )
+    if errors:
+        lines.append("")
+        lines.extend(f"errors {key}: {value}" for key, value in errors.items())
+    lines.append("")
+    lines.append(f"update queue: {context.application.update_queue.qsize()}")
+    lines.extend(f"processor {key}: {value}" for key, value in update_processor.stats().items())
+    lines.extend(f"outbound {key}: {value}" for key, value in outbound.stats().items())
+    breakers = {spotify_breaker.name: spotify_breaker.state, **backend_breakers.states()}
+    lines.extend(f"circuit {name}: {state}" for name, state in breakers.items())
+    await update.message.reply_text("\n".join(lines))
+
+# Handlers for each kind of inline button
+CALLBACK_ROUTES = {
+    KIND_VOTE: instrument(handle_voting),
+    KIND_GENRE: instrument(handle_genre_selection),
+    KIND_PAGE: instrument(handle_page),
+}
 
+# Callback: every inline button press
+async def handle_callback(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
+    """Decodes the button's callback data and hands it to the handler for its kind."""
+    query = update.callback_query
+    try:
+        kind, payload = decode_callback(query.data, callback_registry)
+    except CallbackError as e:
+        logger.warning("Rejected callback data %r: %s", query.data, e)
+        await query.answer("❌ This button is no longer valid.", show_alert=True)
+        return
+    await CALLBACK_ROUTES[kind](update, context, payload)
+
+async def _refresh_after_reconcile(bot, battle_id):
+    refresh_vote_keyboards(bot, battle_id)
+
+async def post_init(application: Application) -> None:
+    """Loads the stored data, warms the genre track pools and starts the background services."""
+    spotify.start()
+    # Reading the wallet and session files overlaps the Spotify searches of the warm-up
+    await asyncio.gather(asyncio.to_thread(load_user_wallet_data), track_cache.warm(list(GENRES)))
+    track_cache.start()
+    # In sharded mode the front owns the side channel and passes its events on to every worker
+    if config.shard_index is None:
+        await side_channel.start()
+    metrics_server.collectors.append(lambda: collect_gauges(application))
+    await metrics_server.start()
+    battle_sessions.start()
+    # Battles still open from a previous run; overdue ones are closed right away
+    battle_scheduler.reschedule(battle_sessions, BATTLE_CLOSE_GRACE)
+    battle_scheduler.start(lambda battle_id: expire_battle(application.bot, battle_id))
+    vote_tally.start(fetch_vote_counts, lambda battle_id: _refresh_after_reconcile(application.bot, battle_id))
+
+async def post_shutdown(application: Application) -> None:
+    """Stops background tasks, flushes wallet changes and closes the pooled backend connections."""
+    await wallet_store.close()
+    await side_channel.stop()
+    await metrics_server.stop()
+    await vote_tally.stop()
+    await vote_queue.close()
+    await battle_scheduler.stop()
+    await battle_sessions.stop()
+    await leaderboard.stop()
+    await track_cache.stop()
+    logger.info(f"Track cache stats: {track_cache.stats()}")
+    await spotify.close()
+    await backend.close()
+
+def register_handlers(application: Application) -> None:
+    """Adds every command and button handler of the bot to `application`."""
+    # Register commands
+    application.add_handler(CommandHandler("start", instrument(start)))
+    application.add_handler(CommandHandler("help", instrument(help_command)))
+    application.add_handler(CommandHandler("startbattle", instrument(start_battle)))
+    application.add_handler(CommandHandler("votetrack", instrument(vote_track)))
+    application.add_handler(CommandHandler("battlevotes", instrument(get_votes)))
+    application.add_handler(CommandHandler("battledetails", instrument(get_battle_details)))
+    application.add_handler(CommandHandler("battlevoters", instrument(get_total_voters)))
+    application.add_handler(CommandHandler("leaderboard", instrument(leaderboard_command)))
+    application.add_handler(CommandHandler("toptracks", instrument(top_tracks)))
+    application.add_handler(CommandHandler("topcreators", instrument(top_creators)))
+    application.add_handler(CommandHandler("topvoters", instrument(top_voters)))
+    application.add_handler(CommandHandler("transferToOwner", instrument(transfer_to_owner)))
+    application.add_handler(CommandHandler("getVotersList", instrument(get_voters_list)))
+    application.add_handler(CommandHandler("getContractBalance", instrument(get_balance)))
+    application.add_handler(CommandHandler("closeBattle", instrument(close_battle)))
+    application.add_handler(CommandHandler("cachestats", instrument(cache_stats)))
+    application.add_handler(CommandHandler("stats", instrument(stats_command)))
+
+    # Every inline button is routed by handle_callback on the kind byte of its callback data
+    application.add_handler(CallbackQueryHandler(handle_callback))
 
+    # Add wallet-related commands
+    application.add_handler(CommandHandler("setwallet", instrument(set_wallet)))
+    application.add_handler(CommandHandler("changewallet", instrument(change_wallet)))  # Add change_wallet handler
+    application.add_handler(CommandHandler("getwallet", instrument(get_wallet)))
+    application.add_handler(CommandHandler("listwallets", instrument(list_wallets)))
 
+    # Set the command menu for the bot
+    application.add_handler(CommandHandler("start", instrument(set_bot_commands)))
+
+def application_builder():
+    """The Application settings shared by the single-process and the sharded modes."""
+    return (
+        Application.builder()
+        .token(config.bot_token)
+        .request(InstrumentedRequest(connection_pool_size=256))
+        # A bounded queue makes the webhook server wait (and Telegram back off) when handlers fall behind
+        .update_queue(asyncio.Queue(maxsize=UPDATE_QUEUE_SIZE))
+        .concurrent_updates(update_processor)
+        .rate_limiter(outbound)
+        .post_init(post_init)
+        .post_shutdown(post_shutdown)
+    )
 
+def shard_environment(index):
+    """Settings of worker `index`: its own metrics port and battle session file.
 
+    BOT_WORKERS tells the worker how many ways the shared rate budgets are split. The
+    leaderboard database is shared, so LEADERBOARD_PATH is passed on unchanged.
+    """
+    environment = {
+        "SHARD_INDEX": str(index),
+        "BOT_WORKERS": str(config.workers),
+        "METRICS_PORT": str(config.metrics_port + 1 + index),
+    }
+    if config.battle_sessions_path:
+        stem, extension = os.path.splitext(config.battle_sessions_path)
+        environment["BATTLE_SESSIONS_PATH"] = f"{stem}.{index}{extension}"
+    return environment
+
+async def run_shard_front():
+    """Receives the webhook and dispatches updates to config.workers worker processes."""
+    if config.wallet_store_backend != "sqlite":
+        # Each worker would otherwise keep its own copy of the wallets
+        raise SystemExit(
+            "BOT_WORKERS needs WALLET_STORE_BACKEND=sqlite (python wallet_store.py migrate copies the JSON data)"
+        )
+    if not config.leaderboard_path:
+        # The workers share their rankings through a database next to it
+        raise SystemExit("BOT_WORKERS needs LEADERBOARD_PATH")
+    workers = WorkerProcesses([sys.executable, os.path.abspath(__file__)], config.workers, shard_environment)
+    front = ShardFront(
+        [(config.shard_host, config.shard_base_port + index) for index in range(config.workers)],
+        host=config.webhook_listen,
+        port=config.webhook_port,
+        path=config.webhook_path,
+        secret_token=config.webhook_secret,
+        forward_timeout=SHARD_FORWARD_TIMEOUT,
+    )
+    events = SideChannelServer(config.side_channel_host, config.side_channel_port)
+    events.on(VOTE_RECORDED, front.broadcast)
+    events.on(BATTLE_CLOSED, front.broadcast)
+    front_metrics = MetricsServer(config.metrics_host, config.metrics_port)
+
+    def collect_front_gauges():
+        for key, value in front.stats().items():
+            registry.set_gauge("bot_shard_front", (("field", key),), value)
+        registry.set_gauge("bot_shard_front", (("field", "restarts"),), workers.restarts)
+    front_metrics.collectors.append(collect_front_gauges)
+
+    if config.webhook_url:
+        async with Bot(config.bot_token) as telegram_bot:
+            await telegram_bot.set_webhook(
+                f"{config.webhook_url.rstrip('/')}/{config.webhook_path}",
+                secret_token=config.webhook_secret,
+                max_connections=WEBHOOK_MAX_CONNECTIONS,
+            )
 
+    await workers.start()
+    await front.start()
+    await events.start()
+    await front_metrics.start()
+    logger.info(f"Bot started in sharded mode with {config.workers} workers...")
+    try:
+        await wait_for_signal()
+    finally:
+        await front_metrics.stop()
+        await events.stop()
+        await front.stop()
+        await workers.stop()
+
+async def run_shard_worker():
+    """Runs the handlers for the chats the front assigns to worker config.shard_index."""
+    application = application_builder().updater(None).build()
+    register_handlers(application)
+    receiver = ShardReceiver(
+        config.shard_host,
+        config.shard_base_port + config.shard_index,
+        application.bot,
+        application.update_queue.put,
+        side_channel.dispatch,
+    )
+    async with application:
+        await post_init(application)
+        await application.start()
+        await receiver.start()
+        logger.info(f"Worker {config.shard_index} started...")
+        try:
+            await wait_for_signal()
+        finally:
+            await receiver.stop()
+            await application.stop()
+    await post_shutdown(application)
 
+# Log records tagged extra={"sample": key} of which only 1 in LOG_SAMPLING[key] is kept
+LOG_SAMPLING = {"vote": 10}
 
 # Main function to run the bot
 def main():
-    application = Application.builder().token(BOT_TOKEN).build()
-     # Set the command menu for the bot
-    # application.add_handler(CommandHandler("start", set_bot_commands))  
-    
-    load_user_wallet_data()
     """Run the bot."""
+    # Structured JSON logs written by a background thread
+    setup_logging(logging.INFO, keep_one_in=LOG_SAMPLING)
+    # httpx logs every request at INFO, which floods the log under load
+    logging.getLogger("httpx").setLevel(logging.WARNING)
 
-    # Register commands
-    application.add_handler(CommandHandler("start", start))
-    application.add_handler(CommandHandler("help", help_command))
-    application.add_handler(CommandHandler("startbattle", start_battle))
-    application.add_handler(CommandHandler("votetrack", vote_track))
-    application.add_handler(CommandHandler("battlevotes", get_votes))
-    application.add_handler(CommandHandler("battledetails", get_battle_details))
-    application.add_handler(CommandHandler("battlevoters", get_total_voters))
-    application.add_handler(CommandHandler("leaderboard", leaderboard))
-    application.add_handler(CommandHandler("transferToOwner", transfer_to_owner))
-    application.add_handler(CommandHandler("getVotersList", get_voters_list))
-    application.add_handler(CommandHandler("getContractBalance", get_balance))
-    application.add_handler(CommandHandler("closeBattle", close_battle))
-
-    application.add_handler(CallbackQueryHandler(handle_voting, pattern=r"^vote\|"))
-    application.add_handler(CallbackQueryHandler(handle_genre_selection, pattern=r"^genre\|"))
-
-    # Add wallet-related commands
-    application.add_handler(CommandHandler("setwallet", set_wallet))
-    application.add_handler(CommandHandler("changewallet", change_wallet))  # Add change_wallet handler
-    application.add_handler(CommandHandler("getwallet", get_wallet))
-    application.add_handler(CommandHandler("listwallets", list_wallets))
+    if config.shard_index is not None:
+        asyncio.run(run_shard_worker())
+        return
+    if config.workers:
+        asyncio.run(run_shard_front())
+        return
 
-    # Set the command menu for the bot
-    application.add_handler(CommandHandler("start", set_bot_commands))  
+    application = application_builder().build()
+    register_handlers(application)
 
     # Start the bot
-    logger.info("Bot started...")
-    application.run_polling()
+    if config.mode == "webhook":
+        logger.info(f"Bot started in webhook mode on {config.webhook_listen}:{config.webhook_port}/{config.webhook_path}...")
+        application.run_webhook(
+            listen=config.webhook_listen,
+            port=config.webhook_port,
+            url_path=config.webhook_path,
+            webhook_url=f"{config.webhook_url.rstrip('/')}/{config.webhook_path}" if config.webhook_url else None,
+            secret_token=config.webhook_secret,
+            max_connections=WEBHOOK_MAX_CONNECTIONS,
+        )
+    else:
+        logger.info("Bot started...")
+        application.run_polling()
 
 
 if __name__ == "__main__":
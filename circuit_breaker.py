@@ -0,0 +1,199 @@
+"""
+Circuit breakers with latency-based adaptive timeouts.
+
+Each breaker tracks one endpoint. After `failure_threshold` consecutive
+failures it opens and rejects calls immediately with `CircuitOpenError`
+for `reset_timeout` seconds, then lets a single probe through (half-open)
+and closes again if the probe succeeds.
+
+While closed, the timeout given to each call follows the endpoint's recent
+latency: `timeout_multiplier` x the `timeout_percentile` of the last
+`window` calls, clamped to [min_timeout, max_timeout]. Calls that time out
+are sampled at the timeout they hit, so a slower endpoint raises the
+timeout instead of failing every call. Until enough samples exist, and for
+half-open probes, the call gets `max_timeout`; opening the breaker drops
+the samples. With `adaptive_timeout=False` every call gets `max_timeout`.
+
+Only outages should count as failures: exceptions (transport errors,
+timeouts) always do, returned values only when `is_failure` says so, e.g.
+`is_outage` for HTTP responses. With `timeouts_are_failures=False` a call
+that runs into its timeout is re-raised without counting, for endpoints
+where slow means busy rather than down.
+"""
+import logging
+import re
+import time
+from collections import deque
+
+from metrics import registry
+
+logger = logging.getLogger(__name__)
+
+CLOSED = "closed"
+OPEN = "open"
+HALF_OPEN = "half_open"
+
+_STATE_VALUES = {CLOSED: 0, HALF_OPEN: 1, OPEN: 2}
+
+# Statuses meaning the server is down or overloaded. Other errors, such as app.js answering a
+# reverted contract call with 500, are about the request and leave the breaker alone.
+OUTAGE_STATUSES = frozenset({502, 503, 504})
+
+
+def is_outage(response):
+    """`is_failure` for HTTP responses: true for gateway errors and 503."""
+    return response.status_code in OUTAGE_STATUSES
+
+
+class CircuitOpenError(Exception):
+    """Raised instead of calling an endpoint whose breaker is open."""
+
+    def __init__(self, name, retry_after):
+        super().__init__(f"{name} is unavailable, retry in {retry_after:.0f}s")
+        self.name = name
+        self.retry_after = retry_after
+
+
+class CircuitBreaker:
+    def __init__(self, name, failure_threshold=5, reset_timeout=15.0, min_timeout=1.0,
+                 max_timeout=10.0, timeout_percentile=0.99, timeout_multiplier=2.0,
+                 window=100, min_samples=20, adaptive_timeout=True, timeouts_are_failures=True,
+                 clock=time.monotonic):
+        self.name = name
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.min_timeout = min_timeout
+        self.max_timeout = max_timeout
+        self.timeout_percentile = timeout_percentile
+        self.timeout_multiplier = timeout_multiplier
+        self.min_samples = min_samples
+        self.adaptive_timeout = adaptive_timeout
+        self.timeouts_are_failures = timeouts_are_failures
+        self.clock = clock
+
+        self.state = CLOSED
+        self.failures = 0
+        self.opened_at = 0.0
+        self.rejected = 0
+        self._probe_in_flight = False
+        self._latencies = deque(maxlen=window)
+        self._timeout = max_timeout
+        self._labels = (("breaker", name),)
+        self._publish()
+
+    def timeout(self):
+        """The timeout the next call should use."""
+        return self._timeout
+
+    async def call(self, operation, is_failure=None):
+        """Runs `operation(timeout)` through the breaker.
+
+        `is_failure(result)` lets a returned value (e.g. an HTTP 503) count
+        as a failure without raising.
+        """
+        self._before_call()
+        # A probe must not fail only because the timeout learned before the outage is too short
+        timeout = self.max_timeout if self.state == HALF_OPEN else self._timeout
+        started = self.clock()
+        try:
+            result = await operation(timeout)
+        except Exception:
+            elapsed = self.clock() - started
+            if elapsed >= timeout:
+                if not self.timeouts_are_failures:
+                    self._probe_in_flight = False
+                    raise
+                # Timed out: the endpoint takes at least this long now
+                self._record_latency(elapsed)
+            self._on_failure()
+            raise
+        except BaseException:
+            # Cancelled: counts as neither success nor failure
+            self._probe_in_flight = False
+            raise
+        if is_failure is not None and is_failure(result):
+            self._on_failure()
+        else:
+            self._on_success(self.clock() - started)
+        return result
+
+    def _before_call(self):
+        if self.state == OPEN:
+            remaining = self.opened_at + self.reset_timeout - self.clock()
+            if remaining > 0:
+                self._reject(remaining)
+            self._transition(HALF_OPEN)
+        if self.state == HALF_OPEN:
+            if self._probe_in_flight:
+                self._reject(self.reset_timeout)
+            self._probe_in_flight = True
+
+    def _reject(self, retry_after):
+        self.rejected += 1
+        registry.inc("bot_circuit_rejections_total", self._labels)
+        raise CircuitOpenError(self.name, retry_after)
+
+    def _on_success(self, latency):
+        self._probe_in_flight = False
+        self.failures = 0
+        if self.state != CLOSED:
+            self._transition(CLOSED)
+        self._record_latency(latency)
+
+    def _record_latency(self, latency):
+        if not self.adaptive_timeout:
+            return
+        self._latencies.append(latency)
+        if len(self._latencies) >= self.min_samples:
+            ordered = sorted(self._latencies)
+            index = min(len(ordered) - 1, int(self.timeout_percentile * len(ordered)))
+            self._timeout = min(self.max_timeout, max(self.min_timeout, ordered[index] * self.timeout_multiplier))
+            registry.set_gauge("bot_circuit_timeout_seconds", self._labels, self._timeout)
+
+    def _on_failure(self):
+        self._probe_in_flight = False
+        self.failures += 1
+        registry.inc("bot_circuit_failures_total", self._labels)
+        if self.state == HALF_OPEN or self.failures >= self.failure_threshold:
+            self.opened_at = self.clock()
+            # Latency from before the outage says nothing about the endpoint once it is back
+            self._latencies.clear()
+            self._timeout = self.max_timeout
+            self._transition(OPEN)
+
+    def _transition(self, state):
+        if state != self.state:
+            logger.warning("Circuit %s: %s -> %s", self.name, self.state, state)
+        self.state = state
+        self._publish()
+
+    def _publish(self):
+        registry.set_gauge("bot_circuit_state", self._labels, _STATE_VALUES[self.state])
+        registry.set_gauge("bot_circuit_timeout_seconds", self._labels, self._timeout)
+
+
+class BreakerGroup:
+    """Creates one breaker per endpoint on first use, sharing the same settings."""
+
+    def __init__(self, prefix, **settings):
+        self.prefix = prefix
+        self.settings = settings
+        self.breakers = {}
+
+    def get(self, endpoint, **overrides):
+        breaker = self.breakers.get(endpoint)
+        if breaker is None:
+            breaker = CircuitBreaker(f"{self.prefix}{endpoint}", **{**self.settings, **overrides})
+            self.breakers[endpoint] = breaker
+        return breaker
+
+    def states(self):
+        return {breaker.name: breaker.state for breaker in self.breakers.values()}
+
+
+_ID_SEGMENT = re.compile(r"/\d+(?=/|$)")
+
+
+def endpoint_key(method, path):
+    """Collapses ids so e.g. GET /battle/7/votes and /battle/9/votes share a breaker."""
+    return f"{method} {_ID_SEGMENT.sub('/:id', path.split('?')[0])}"
@@ -0,0 +1,112 @@
+"""
+Deployment settings of the bot, read once at startup.
+
+Everything that differs between deployments (credentials, addresses,
+storage paths, update delivery) lives on a `BotConfig`; tuning constants
+stay next to the code they tune in bot.py. `BotConfig.from_env()` reads
+the settings from environment variables, falling back to the defaults
+below. Credentials have no defaults: BOT_TOKEN, SPOTIFY_CLIENT_ID and
+SPOTIFY_CLIENT_SECRET must be set, and startup stops when one is missing.
+"""
+import os
+
+# Environment variables without a default
+REQUIRED_VARIABLES = ("BOT_TOKEN", "SPOTIFY_CLIENT_ID", "SPOTIFY_CLIENT_SECRET")
+
+
+class BotConfig:
+    def __init__(
+        self,
+        bot_token=None,
+        mode="polling",
+        webhook_listen="0.0.0.0",
+        webhook_port=8443,
+        webhook_path="telegram",
+        webhook_url="",
+        webhook_secret=None,
+        backend_url="http://localhost:5000",
+        spotify_client_id=None,
+        spotify_client_secret=None,
+        wallet_store_backend="json",
+        wallet_store_path=None,
+        battle_sessions_path="battle_sessions.json",
+        leaderboard_path="leaderboard.json",
+        metrics_host="localhost",
+        metrics_port=9100,
+        side_channel_host="localhost",
+        side_channel_port=9999,
+        admin_user_ids=frozenset(),
+        workers=0,
+        shard_index=None,
+        shard_host="127.0.0.1",
+        shard_base_port=9300,
+    ):
+        self.bot_token = bot_token
+        # Update delivery: "polling" or "webhook".
+        # Webhook mode needs python-telegram-bot[webhooks] and a public HTTPS URL in front of webhook_port.
+        self.mode = mode
+        self.webhook_listen = webhook_listen
+        self.webhook_port = webhook_port
+        self.webhook_path = webhook_path
+        # Public base URL Telegram posts updates to
+        self.webhook_url = webhook_url
+        self.webhook_secret = webhook_secret
+        self.backend_url = backend_url
+        self.spotify_client_id = spotify_client_id
+        self.spotify_client_secret = spotify_client_secret
+        # "json" (in-memory dict + journal) or "sqlite"; the path defaults to user_wallet_mapping.json / user_wallets.db
+        self.wallet_store_backend = wallet_store_backend
+        self.wallet_store_path = wallet_store_path
+        # None keeps battle sessions in memory only
+        self.battle_sessions_path = battle_sessions_path
+        # None keeps the cross-battle leaderboard in memory only; sharded workers share <stem>.db beside it instead
+        self.leaderboard_path = leaderboard_path
+        self.metrics_host = metrics_host
+        self.metrics_port = metrics_port
+        self.side_channel_host = side_channel_host
+        self.side_channel_port = side_channel_port
+        # Users allowed to run /stats (empty: no one)
+        self.admin_user_ids = admin_user_ids
+        # With workers > 0 this process is the webhook front of that many worker processes (see sharding.py);
+        # worker i listens on shard_host:shard_base_port + i and is started with shard_index = i (and the same workers)
+        self.workers = workers
+        self.shard_index = shard_index
+        self.shard_host = shard_host
+        self.shard_base_port = shard_base_port
+
+    @classmethod
+    def from_env(cls, environ=os.environ):
+        """Settings from BOT_TOKEN, BOT_MODE, WEBHOOK_*, BACKEND_URL, SPOTIFY_*, BOT_WORKERS, ... variables.
+
+        Raises SystemExit naming the REQUIRED_VARIABLES that are unset.
+        """
+        missing = [name for name in REQUIRED_VARIABLES if not environ.get(name)]
+        if missing:
+            raise SystemExit(f"Missing required environment variables: {', '.join(missing)}")
+        defaults = cls()
+        get = environ.get
+        return cls(
+            bot_token=environ["BOT_TOKEN"],
+            mode=get("BOT_MODE", defaults.mode),
+            webhook_listen=get("WEBHOOK_LISTEN", defaults.webhook_listen),
+            webhook_port=int(get("WEBHOOK_PORT", defaults.webhook_port)),
+            webhook_path=get("WEBHOOK_PATH", defaults.webhook_path),
+            webhook_url=get("WEBHOOK_URL", defaults.webhook_url),
+            webhook_secret=get("WEBHOOK_SECRET") or defaults.webhook_secret,
+            backend_url=get("BACKEND_URL", defaults.backend_url),
+            spotify_client_id=environ["SPOTIFY_CLIENT_ID"],
+            spotify_client_secret=environ["SPOTIFY_CLIENT_SECRET"],
+            wallet_store_backend=get("WALLET_STORE_BACKEND", defaults.wallet_store_backend),
+            wallet_store_path=get("WALLET_STORE_PATH") or defaults.wallet_store_path,
+            battle_sessions_path=get("BATTLE_SESSIONS_PATH", defaults.battle_sessions_path) or None,
+            leaderboard_path=get("LEADERBOARD_PATH", defaults.leaderboard_path) or None,
+            metrics_host=get("METRICS_HOST", defaults.metrics_host),
+            metrics_port=int(get("METRICS_PORT", defaults.metrics_port)),
+            side_channel_host=get("SIDE_CHANNEL_HOST", defaults.side_channel_host),
+            side_channel_port=int(get("SIDE_CHANNEL_PORT", defaults.side_channel_port)),
+            admin_user_ids=frozenset(int(user_id) for user_id in get("ADMIN_USER_IDS", "").split(",") if user_id),
+            workers=int(get("BOT_WORKERS", defaults.workers)),
+            shard_index=int(get("SHARD_INDEX")) if get("SHARD_INDEX") else defaults.shard_index,
+            shard_host=get("SHARD_HOST", defaults.shard_host),
+            shard_base_port=int(get("SHARD_BASE_PORT", defaults.shard_base_port)),
+        )
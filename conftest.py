@@ -0,0 +1,4 @@
+"""
+pytest configuration: the bot's modules live at the repository root, so
+this file being here puts the root on sys.path for the tests in tests/.
+"""
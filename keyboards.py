@@ -0,0 +1,107 @@
+"""
+Inline keyboards that are built once and sent many times.
+
+`CachedKeyboardMarkup` remembers its `to_dict()` output, which is what
+PTB serializes on every send, so sending the same keyboard again skips
+walking the buttons. PTB keyboards are immutable, so the cached dict never
+goes stale; callers must not modify the returned dict.
+
+Vote keyboards change with the vote counts, so they are memoized per
+(battle, payment, counts) by `memoized_vote_keyboard` rather than built
+once. `python keyboards.py bench` times building and serializing both
+keyboards per call, fresh and reused.
+"""
+import argparse
+import functools
+import json
+import time
+
+from telegram import InlineKeyboardButton, InlineKeyboardMarkup
+
+from callbacks import encode_genre, encode_vote
+
+
+class CachedKeyboardMarkup(InlineKeyboardMarkup):
+    """InlineKeyboardMarkup whose serialized form is computed once."""
+
+    __slots__ = ("_dict",)
+
+    def __init__(self, inline_keyboard, *, api_kwargs=None):
+        super().__init__(inline_keyboard, api_kwargs=api_kwargs)
+        with self._unfrozen():
+            self._dict = None
+
+    def to_dict(self, recursive=True):
+        if not recursive:
+            return super().to_dict(recursive=False)
+        if self._dict is None:
+            self._dict = super().to_dict()
+        return self._dict
+
+
+def genre_keyboard(genres):
+    """One button per genre, in `genres` order."""
+    return CachedKeyboardMarkup(
+        [[InlineKeyboardButton(genre, callback_data=encode_genre(genre))] for genre in genres]
+    )
+
+
+def vote_keyboard(battle_id, payment_amount, track1_votes=0, track2_votes=0, registry=None,
+                  markup_class=CachedKeyboardMarkup):
+    """The voting keyboard of a battle, showing the current vote counts."""
+    return markup_class([
+        [
+            InlineKeyboardButton(
+                f"🎵 Vote Track 1 ({track1_votes} votes)",
+                callback_data=encode_vote(battle_id, 1, payment_amount, registry),
+            ),
+            InlineKeyboardButton(
+                f"🎵 Vote Track 2 ({track2_votes} votes)",
+                callback_data=encode_vote(battle_id, 2, payment_amount, registry),
+            ),
+        ]
+    ])
+
+
+def memoized_vote_keyboard(registry=None, maxsize=4096):
+    """`vote_keyboard` behind a bounded LRU keyed by (battle, payment, counts)."""
+    @functools.lru_cache(maxsize=maxsize, typed=True)
+    def build_vote_keyboard(battle_id, payment_amount, track1_votes=0, track2_votes=0):
+        return vote_keyboard(battle_id, payment_amount, track1_votes, track2_votes, registry)
+
+    return build_vote_keyboard
+
+
+def benchmark(calls, genres):
+    """Microseconds per call to build a keyboard and serialize it as a send does, fresh and reused."""
+    names = [f"Genre {index}" for index in range(genres)]
+    build_vote_keyboard = memoized_vote_keyboard()
+
+    def timed(build):
+        started = time.perf_counter()
+        for index in range(calls):
+            json.dumps(build(index).to_dict())
+        return round((time.perf_counter() - started) / calls * 1e6, 2)
+
+    # Battles see many presses per count change; reuse every keyboard 10 times
+    return {
+        "calls": calls,
+        "genres": genres,
+        "vote_fresh_us": timed(lambda index: vote_keyboard(
+            7, 5, index // 10, index // 20, markup_class=InlineKeyboardMarkup)),
+        "vote_memoized_us": timed(lambda index: build_vote_keyboard(7, 5, index // 10, index // 20)),
+        "genre_fresh_us": timed(lambda index: InlineKeyboardMarkup(
+            [[InlineKeyboardButton(genre, callback_data=encode_genre(genre))] for genre in names])),
+        "genre_prebuilt_us": timed(lambda index, keyboard=genre_keyboard(names): keyboard),
+    }
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Keyboard maintenance")
+    subcommands = parser.add_subparsers(dest="command", required=True)
+    bench = subcommands.add_parser("bench", help="Measure keyboard build and serialization time per call")
+    bench.add_argument("--calls", type=int, default=100000)
+    bench.add_argument("--genres", type=int, default=4)
+    args = parser.parse_args()
+
+    print(json.dumps(benchmark(args.calls, args.genres), indent=2))
@@ -0,0 +1,568 @@
+"""
+Rankings across all battles: tracks (overall and per genre), creators and
+voters, kept up to date from the votes and battle closes the bot observes.
+
+Each ranking is a `RankIndex`: keys with the same score share a bucket and
+the distinct scores are kept in a sorted list. A vote moves a key from its
+bucket to the next one up (a few dict operations plus a bisect over the
+distinct scores), and the top k are read by walking the buckets down from
+the highest score, touching only the k entries returned. Ties rank in the
+order the keys reached the score.
+
+A vote can be reported twice, by the voting handler and by the backend's
+side channel, so each battle remembers who it has counted until it closes.
+With a `path`, the rankings are snapshotted to a JSON file (written
+atomically, at most once per `flush_delay` seconds while votes come in) and
+reloaded at startup; votes after the last snapshot are lost on a crash.
+
+The workers of the sharded mode each see only the battles started from
+their own chats, so they share a `SqliteLeaderboard` instead: the same
+rankings in one SQLite database, where every worker records the battles it
+starts and counts the votes any of them observes. Both classes answer the
+ranking commands through the same async queries.
+
+Run `python leaderboard.py bench --votes 1000000` to time updates and
+queries at scale.
+"""
+import argparse
+import asyncio
+import bisect
+import json
+import logging
+import random
+import sqlite3
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from wallet_store import write_json_atomic
+
+logger = logging.getLogger(__name__)
+
+
+class RankIndex:
+    """Positive integer scores of keys, ordered for top-k queries."""
+
+    def __init__(self):
+        self._scores = {}
+        # score -> {key: None}, keys in the order they reached the score
+        self._buckets = {}
+        # Distinct scores, ascending
+        self._order = []
+
+    def __len__(self):
+        return len(self._scores)
+
+    def __contains__(self, key):
+        return key in self._scores
+
+    def score(self, key):
+        return self._scores.get(key, 0)
+
+    def add(self, key, delta=1):
+        """Adds `delta` to the key's score (dropping it at 0 or below); returns the new score."""
+        old = self._scores.get(key, 0)
+        new = old + delta
+        if old > 0:
+            self._leave(key, old)
+        if new > 0:
+            self._scores[key] = new
+            self._enter(key, new)
+        else:
+            self._scores.pop(key, None)
+        return new
+
+    def top(self, k):
+        """The k highest (key, score) pairs, best first."""
+        result = []
+        if k <= 0:
+            return result
+        for score in reversed(self._order):
+            for key in self._buckets[score]:
+                result.append((key, score))
+                if len(result) == k:
+                    return result
+        return result
+
+    def rank(self, key):
+        """1 + the number of keys scoring higher, or None for an unranked key.
+
+        Costs one bucket size per distinct score above the key's.
+        """
+        score = self._scores.get(key)
+        if score is None:
+            return None
+        above = self._order[bisect.bisect_right(self._order, score):]
+        return 1 + sum(len(self._buckets[higher]) for higher in above)
+
+    def buckets(self):
+        """[score, [keys]] for every score, best first; `from_buckets` restores the same order.
+
+        Copying whole buckets keeps a snapshot of many keys quick enough to take on the event loop.
+        """
+        return [[score, list(self._buckets[score])] for score in reversed(self._order)]
+
+    @classmethod
+    def from_buckets(cls, buckets):
+        index = cls()
+        for score, keys in buckets:
+            if score <= 0:
+                continue
+            bucket = index._buckets[score] = dict.fromkeys(keys)
+            index._scores.update(dict.fromkeys(bucket, score))
+        index._order = sorted(index._buckets)
+        return index
+
+    def _enter(self, key, score):
+        bucket = self._buckets.get(score)
+        if bucket is None:
+            bucket = self._buckets[score] = {}
+            bisect.insort(self._order, score)
+        bucket[key] = None
+
+    def _leave(self, key, score):
+        bucket = self._buckets[score]
+        del bucket[key]
+        if not bucket:
+            del self._buckets[score]
+            del self._order[bisect.bisect_left(self._order, score)]
+
+
+class Leaderboard:
+    """Global, per-genre, creator and voter rankings with optional JSON persistence.
+
+    Tracks and creators are taken from the battle's `BattleSession`; votes in
+    battles the bot has no session for only count towards the voter ranking.
+    """
+
+    def __init__(self, path=None, flush_delay=60.0):
+        self.path = path
+        self.flush_delay = flush_delay
+        # Votes received, by "<name> by <artist>"
+        self.tracks = RankIndex()
+        # Genre -> RankIndex of its tracks
+        self.genres = {}
+        # Votes received and battles won, by creator address
+        self.creators = RankIndex()
+        self.creator_wins = RankIndex()
+        # Votes cast, by wallet address
+        self.voters = RankIndex()
+        self.votes = 0
+        self.repeats = 0
+        # Battle id -> voters already counted, until the battle closes
+        self._counted = {}
+        self._flush_task = None
+
+    def record_battle(self, session):
+        """Nothing to do: the session is passed along with each vote."""
+
+    def record_vote(self, battle_id, track_number, voter, session=None):
+        """Counts an accepted vote once per (battle, voter); returns False for a repeated report."""
+        counted = self._counted.setdefault(battle_id, set())
+        if voter in counted:
+            self.repeats += 1
+            return False
+        counted.add(voter)
+        self.votes += 1
+        self.voters.add(voter)
+        if session is not None:
+            track = session.track_name(track_number)
+            if track:
+                self.tracks.add(track)
+                if session.genre:
+                    self.genres.setdefault(session.genre, RankIndex()).add(track)
+            if len(session.creators) >= track_number:
+                self.creators.add(session.creators[track_number - 1])
+        self.changed()
+        return True
+
+    def record_close(self, battle_id, session=None):
+        """Credits the winning creator of a battle that is closing (call before the session is closed)."""
+        self._counted.pop(battle_id, None)
+        if session is None or session.closed_at is not None or not session.votes:
+            return
+        track1_votes, track2_votes = session.votes
+        if track1_votes == track2_votes:
+            return
+        winner = 1 if track1_votes > track2_votes else 2
+        if len(session.creators) >= winner:
+            self.creator_wins.add(session.creators[winner - 1])
+            self.changed()
+
+    async def top_tracks(self, k, genre=None):
+        """The k most voted (track, votes), across all battles or within one genre."""
+        index = self.tracks if genre is None else self.genres.get(genre)
+        return index.top(k) if index is not None else []
+
+    async def top_creators(self, k):
+        """(creator, votes, battles won) of the k most voted creators."""
+        return [(creator, votes, self.creator_wins.score(creator)) for creator, votes in self.creators.top(k)]
+
+    async def top_voters(self, k):
+        return self.voters.top(k)
+
+    async def voter_standing(self, voter):
+        """(rank, votes) of a voter, or None if they have not voted."""
+        if voter not in self.voters:
+            return None
+        return self.voters.rank(voter), self.voters.score(voter)
+
+    def changed(self):
+        """Schedules a snapshot after `flush_delay` seconds (no-op without a path)."""
+        if self.path is None:
+            return
+        if self._flush_task is None or self._flush_task.done():
+            try:
+                self._flush_task = asyncio.get_running_loop().create_task(self._delayed_flush())
+            except RuntimeError:
+                # Not running in the event loop; the next change or stop() writes it
+                pass
+
+    def snapshot(self):
+        return {
+            "votes": self.votes,
+            "tracks": self.tracks.buckets(),
+            "genres": {genre: index.buckets() for genre, index in self.genres.items()},
+            "creators": self.creators.buckets(),
+            "creator_wins": self.creator_wins.buckets(),
+            "voters": self.voters.buckets(),
+        }
+
+    def load(self):
+        """Loads the rankings saved by a previous run."""
+        if self.path is None:
+            return
+        try:
+            with open(self.path, "r") as file:
+                saved = json.load(file)
+        except FileNotFoundError:
+            return
+        self.votes = saved.get("votes", 0)
+        self.tracks = RankIndex.from_buckets(saved.get("tracks", ()))
+        self.genres = {genre: RankIndex.from_buckets(buckets) for genre, buckets in saved.get("genres", {}).items()}
+        self.creators = RankIndex.from_buckets(saved.get("creators", ()))
+        self.creator_wins = RankIndex.from_buckets(saved.get("creator_wins", ()))
+        self.voters = RankIndex.from_buckets(saved.get("voters", ()))
+        logger.info(f"Loaded leaderboard of {self.votes} votes")
+
+    async def flush(self):
+        if self.path is None:
+            return
+        # Copied on the loop, since votes keep changing the indexes while the thread writes
+        await asyncio.to_thread(write_json_atomic, self.path, self.snapshot())
+
+    async def stop(self):
+        if self._flush_task is not None and not self._flush_task.done():
+            self._flush_task.cancel()
+            try:
+                await self._flush_task
+            except asyncio.CancelledError:
+                pass
+        self._flush_task = None
+        await self.flush()
+
+    def stats(self):
+        return {
+            "votes": self.votes,
+            "repeats": self.repeats,
+            "tracks": len(self.tracks),
+            "creators": len(self.creators),
+            "voters": len(self.voters),
+            "open_battles": len(self._counted),
+        }
+
+    async def _delayed_flush(self):
+        await asyncio.sleep(self.flush_delay)
+        try:
+            await self.flush()
+        except Exception as e:
+            logger.error(f"Failed to save the leaderboard: {e}")
+
+
+class SqliteLeaderboard:
+    """The rankings of `Leaderboard` in a SQLite (WAL mode) database shared by several processes.
+
+    Every worker receives every vote (the front passes the backend's vote
+    events to all of them), but only the one that started a battle has its
+    session, so `record_battle` stores its genre, tracks and creators for the
+    others to credit. A (battle, voter) pair is counted in the same
+    transaction as the scores, so a vote reported by several workers counts
+    once; the pairs are kept for `closed_ttl` seconds after the battle
+    closes, since another worker may still be reporting its votes. Writes
+    are queued to a dedicated thread without waiting; queries wait for it,
+    after the writes queued before them.
+    """
+
+    def __init__(self, path="leaderboard.db", closed_ttl=3600, clock=time.time):
+        self.path = path
+        self.closed_ttl = closed_ttl
+        self.clock = clock
+        self.votes = 0
+        self.repeats = 0
+        self.pending = 0
+        self._conn = None
+        # One thread keeps the connection single-threaded and writes ordered
+        self._executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="leaderboard-db")
+
+    def load(self):
+        self._executor.submit(self._connect).result()
+
+    def record_battle(self, session):
+        """Stores the tracks and creators of a battle this process has started."""
+        battle = self._battle_row(session)
+
+        def store(conn):
+            with conn:
+                self._store_battle(conn, battle)
+        self._write(store)
+
+    def record_vote(self, battle_id, track_number, voter, session=None):
+        """Counts an accepted vote once per (battle, voter), whichever process reports it first."""
+        battle = self._battle_row(session) if session is not None else None
+
+        def count(conn):
+            with conn:
+                if battle is not None:
+                    self._store_battle(conn, battle)
+                if not conn.execute(
+                    "INSERT OR IGNORE INTO counted (battle_id, voter) VALUES (?, ?)", (battle_id, voter)
+                ).rowcount:
+                    self.repeats += 1
+                    return
+                self.votes += 1
+                self._add(conn, "voters", voter)
+                row = conn.execute(
+                    "SELECT genre, track1, track2, creator1, creator2 FROM battles WHERE battle_id = ?", (battle_id,)
+                ).fetchone()
+                if row is None:
+                    return
+                genre, track, creator = row[0], row[track_number], row[2 + track_number]
+                if track:
+                    self._add(conn, "tracks", track)
+                    if genre:
+                        self._add(conn, f"genre:{genre}", track)
+                if creator:
+                    self._add(conn, "creators", creator)
+        self._write(count)
+
+    def record_close(self, battle_id, session=None):
+        """Credits the winning creator of a battle that is closing (call before the session is closed)."""
+        winner = None
+        if session is not None and session.closed_at is None and session.votes:
+            track1_votes, track2_votes = session.votes
+            if track1_votes != track2_votes:
+                number = 1 if track1_votes > track2_votes else 2
+                if len(session.creators) >= number:
+                    winner = session.creators[number - 1]
+
+        now = self.clock()
+
+        def close(conn):
+            with conn:
+                conn.execute(
+                    "INSERT INTO battles (battle_id, closed_at) VALUES (?, ?) "
+                    "ON CONFLICT(battle_id) DO UPDATE SET closed_at = COALESCE(closed_at, excluded.closed_at)",
+                    (battle_id, now),
+                )
+                expired = "SELECT battle_id FROM battles WHERE closed_at < ?"
+                conn.execute(f"DELETE FROM counted WHERE battle_id IN ({expired})", (now - self.closed_ttl,))
+                conn.execute(f"DELETE FROM battles WHERE battle_id IN ({expired})", (now - self.closed_ttl,))
+                if winner is not None:
+                    self._add(conn, "creator_wins", winner)
+        self._write(close)
+
+    async def top_tracks(self, k, genre=None):
+        """The k most voted (track, votes), across all battles or within one genre."""
+        return await self._run(lambda conn: self._top(conn, "tracks" if genre is None else f"genre:{genre}", k))
+
+    async def top_creators(self, k):
+        """(creator, votes, battles won) of the k most voted creators."""
+        def query(conn):
+            return [
+                (creator, votes, self._score(conn, "creator_wins", creator))
+                for creator, votes in self._top(conn, "creators", k)
+            ]
+        return await self._run(query)
+
+    async def top_voters(self, k):
+        return await self._run(lambda conn: self._top(conn, "voters", k))
+
+    async def voter_standing(self, voter):
+        """(rank, votes) of a voter, or None if they have not voted."""
+        def query(conn):
+            score = self._score(conn, "voters", voter)
+            if not score:
+                return None
+            above = conn.execute(
+                "SELECT COUNT(*) FROM scores WHERE ranking = 'voters' AND score > ?", (score,)
+            ).fetchone()[0]
+            return 1 + above, score
+        return await self._run(query)
+
+    async def stop(self):
+        """Waits for the queued writes and closes the database."""
+        await asyncio.get_running_loop().run_in_executor(self._executor, self._disconnect)
+        self._executor.shutdown(wait=True)
+
+    def stats(self):
+        return {"votes": self.votes, "repeats": self.repeats, "pending_writes": self.pending}
+
+    @staticmethod
+    def _battle_row(session):
+        creator1, creator2 = (tuple(session.creators) + (None, None))[:2]
+        return (session.battle_id, session.genre, session.track_name(1), session.track_name(2), creator1, creator2)
+
+    @staticmethod
+    def _store_battle(conn, battle):
+        conn.execute(
+            "INSERT OR IGNORE INTO battles (battle_id, genre, track1, track2, creator1, creator2) "
+            "VALUES (?, ?, ?, ?, ?, ?)",
+            battle,
+        )
+
+    @staticmethod
+    def _add(conn, ranking, key):
+        # `reached` orders ties by when the key reached its score, as RankIndex does
+        conn.execute(
+            "INSERT INTO scores (ranking, key, score, reached) VALUES (?, ?, 1, ?) "
+            "ON CONFLICT(ranking, key) DO UPDATE SET score = score + 1, reached = excluded.reached",
+            (ranking, key, time.time_ns()),
+        )
+
+    @staticmethod
+    def _top(conn, ranking, k):
+        return conn.execute(
+            "SELECT key, score FROM scores WHERE ranking = ? ORDER BY score DESC, reached LIMIT ?", (ranking, k)
+        ).fetchall()
+
+    @staticmethod
+    def _score(conn, ranking, key):
+        row = conn.execute("SELECT score FROM scores WHERE ranking = ? AND key = ?", (ranking, key)).fetchone()
+        return row[0] if row else 0
+
+    def _write(self, statement):
+        self.pending += 1
+
+        def run():
+            try:
+                statement(self._connect())
+            except sqlite3.Error as e:
+                logger.error(f"Failed to update the leaderboard: {e}")
+            finally:
+                self.pending -= 1
+        self._executor.submit(run)
+
+    async def _run(self, query):
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(self._executor, lambda: query(self._connect()))
+
+    def _connect(self):
+        if self._conn is None:
+            self._conn = sqlite3.connect(self.path, check_same_thread=False)
+            self._conn.execute("PRAGMA journal_mode=WAL")
+            self._conn.execute("PRAGMA synchronous=NORMAL")
+            self._conn.execute(
+                "CREATE TABLE IF NOT EXISTS battles (battle_id INTEGER PRIMARY KEY, "
+                "genre TEXT, track1 TEXT, track2 TEXT, creator1 TEXT, creator2 TEXT, closed_at REAL)"
+            )
+            self._conn.execute(
+                "CREATE TABLE IF NOT EXISTS counted ("
+                "battle_id INTEGER, voter TEXT, PRIMARY KEY (battle_id, voter)) WITHOUT ROWID"
+            )
+            self._conn.execute(
+                "CREATE TABLE IF NOT EXISTS scores (ranking TEXT, key TEXT, score INTEGER NOT NULL, "
+                "reached INTEGER NOT NULL, PRIMARY KEY (ranking, key)) WITHOUT ROWID"
+            )
+            self._conn.execute("CREATE INDEX IF NOT EXISTS scores_by_rank ON scores (ranking, score DESC, reached)")
+        return self._conn
+
+    def _disconnect(self):
+        if self._conn is not None:
+            self._conn.close()
+            self._conn = None
+
+
+class _BenchSession:
+    """The parts of a BattleSession the leaderboard reads."""
+
+    def __init__(self, genre, tracks, creators):
+        self.genre = genre
+        self.tracks = tracks
+        self.creators = creators
+        self.votes = None
+        self.closed_at = None
+
+    def track_name(self, track_number):
+        name, artist = self.tracks[track_number - 1]
+        return f"{name} by {artist}"
+
+
+def benchmark(votes, battles, tracks, voters, creators, genres, k, seed=0):
+    """Times record_vote, top-k and rank queries on a leaderboard fed `votes` random votes."""
+    rng = random.Random(seed)
+    # Popularity is skewed, as it is in real battles: a few tracks and voters account for most votes
+    def skewed(count):
+        return int(count * rng.random() ** 3)
+
+    sessions = {}
+    for battle_id in range(battles):
+        pair = [skewed(tracks) for _ in range(2)]
+        sessions[battle_id] = _BenchSession(
+            f"genre {battle_id % genres}",
+            tuple((f"song {number}", f"artist {number % 500}") for number in pair),
+            tuple(f"creator {number % creators}" for number in pair),
+        )
+    stream = [(rng.randrange(battles), rng.choice((1, 2)), f"voter {skewed(voters)}") for _ in range(votes)]
+    board = Leaderboard()
+    started = time.perf_counter()
+    for battle_id, track_number, voter in stream:
+        board.record_vote(battle_id, track_number, voter, sessions[battle_id])
+    update_s = time.perf_counter() - started
+
+    queries = 10000
+    started = time.perf_counter()
+    for _ in range(queries):
+        board.tracks.top(k)
+    top_s = time.perf_counter() - started
+    started = time.perf_counter()
+    for genre in rng.choices(list(board.genres), k=queries):
+        board.genres[genre].top(k)
+    genre_s = time.perf_counter() - started
+    sample = rng.sample(list(board.voters._scores), min(1000, len(board.voters)))
+    started = time.perf_counter()
+    for voter in sample:
+        board.voters.rank(voter)
+    rank_s = time.perf_counter() - started
+    started = time.perf_counter()
+    snapshot = board.snapshot()
+    snapshot_s = time.perf_counter() - started
+    return {
+        "votes": board.votes,
+        "repeats": board.repeats,
+        "tracks": len(board.tracks),
+        "voters": len(board.voters),
+        "distinct_voter_scores": len(board.voters._order),
+        "record_vote_us": round(update_s / votes * 1e6, 3),
+        f"top{k}_us": round(top_s / queries * 1e6, 3),
+        f"genre_top{k}_us": round(genre_s / queries * 1e6, 3),
+        "voter_rank_us": round(rank_s / len(sample) * 1e6, 3),
+        "snapshot_ms": round(snapshot_s * 1000, 1),
+        "snapshot_keys": sum(len(keys) for buckets in snapshot.values() if isinstance(buckets, list) for _, keys in buckets),
+    }
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Leaderboard maintenance")
+    subcommands = parser.add_subparsers(dest="command", required=True)
+    bench = subcommands.add_parser("bench", help="Time updates and queries on synthetic votes")
+    bench.add_argument("--votes", type=int, default=1000000)
+    bench.add_argument("--battles", type=int, default=20000)
+    bench.add_argument("--tracks", type=int, default=50000)
+    bench.add_argument("--voters", type=int, default=200000)
+    bench.add_argument("--creators", type=int, default=8)
+    bench.add_argument("--genres", type=int, default=4)
+    bench.add_argument("--top", type=int, default=10)
+    args = parser.parse_args()
+
+    print(json.dumps(benchmark(
+        args.votes, args.battles, args.tracks, args.voters, args.creators, args.genres, args.top
+    ), indent=2))
@@ -0,0 +1,579 @@
+"""
+Offline load test of the bot's handlers.
+
+Synthetic updates (commands and button presses) are pushed through the real
+`Application` dispatcher and update processor of bot.py at a fixed rate,
+while the Telegram Bot API, the Express backend and Spotify are replaced by
+the local stubs of stubs.py. --backend-outage-every N makes every Nth
+backend request answer 503, and --spotify-throttle-every N makes every Nth
+Spotify search answer 429 with a Retry-After.
+
+The report gives throughput, p50/p99 latency per update kind, handler
+errors, calls made to each stub and memory use, plus startup cost: the
+cumulative `python -X importtime` of bot.py in a fresh interpreter and the
+time from building the `Application` to the first handled update (the
+startup budgets are enforced by tests/test_startup.py). With --max-p99-ms
+and/or --min-rate the exit status is 1 when the run is slower, so the
+script can gate changes:
+
+    python loadtest.py --rate 500 --count 20000 --max-p99-ms 250
+
+With --workers the same traffic goes through the sharded mode instead: a
+`ShardFront` in this process hands every update to one of N worker
+processes (each with its own Telegram stub, sharing the stub backend, the
+fake Spotify server, a SQLite wallet store and a SQLite leaderboard). A
+comma-separated list runs one pass per worker count, e.g. to see how
+throughput scales with the cores:
+
+    python loadtest.py --workers 1,2,4 --rate 3000 --count 30000 --telegram-latency-ms 0
+
+Latencies of a sharded run are measured in the workers, from receiving an
+update to its handler finishing; the front's forwarding is called directly
+rather than over HTTP.
+
+Logs go to stderr through the bot's pipeline (setup_logging, with its vote
+sampling) at --log-level. --log-pipeline sync logs through the blocking
+`logging.basicConfig` handler the bot used before instead, so the cost of
+logging under load can be compared:
+
+    python loadtest.py --log-level INFO --log-pipeline sync 2>sync.log
+    python loadtest.py --log-level INFO 2>queue.log
+"""
+import argparse
+import asyncio
+import itertools
+import json
+import logging
+import os
+import random
+import resource
+import subprocess
+import sys
+import tempfile
+import time
+from collections import defaultdict
+
+from telegram import Update
+from telegram.ext import Application
+
+# bot.py requires credentials at import; the stubs accept any
+BOT_TOKEN = "123456:LOADTEST"
+os.environ.setdefault("BOT_TOKEN", BOT_TOKEN)
+os.environ.setdefault("SPOTIFY_CLIENT_ID", "loadtest")
+os.environ.setdefault("SPOTIFY_CLIENT_SECRET", "secret")
+
+import bot
+from callbacks import encode_genre, encode_vote
+from leaderboard import SqliteLeaderboard
+from logging_setup import setup_logging
+from metrics import summary
+from outbound import OutboundScheduler
+from sharding import ShardFront, ShardReceiver, WorkerProcesses, wait_for_signal
+from stubs import FakeSpotify, FakeTelegramRequest, StubBackend
+from wallet_store import create_wallet_store
+
+# Relative weight of each kind of update in the generated traffic
+DEFAULT_MIX = {
+    "vote": 60,
+    "startbattle": 4,
+    "genre": 4,
+    "getwallet": 6,
+    "setwallet": 2,
+    "battlevotes": 8,
+    "leaderboard": 4,
+    "voterslist": 6,
+    "listwallets": 2,
+    "balance": 4,
+    "rankings": 2,
+}
+
+
+def percentile(sorted_values, fraction):
+    if not sorted_values:
+        return 0.0
+    index = min(len(sorted_values) - 1, int(fraction * len(sorted_values)))
+    return sorted_values[index]
+
+
+def rss_mb():
+    """Current resident set size in MB (Linux)."""
+    with open("/proc/self/statm") as file:
+        return int(file.read().split()[1]) * os.sysconf("SC_PAGE_SIZE") / 2**20
+
+
+class TrafficGenerator:
+    """Builds Telegram update payloads for a population of synthetic users."""
+
+    def __init__(self, users, mix, seed=0):
+        self.users = users
+        self.kinds = list(mix)
+        self.weights = [mix[kind] for kind in self.kinds]
+        self.random = random.Random(seed)
+        self.battles = []
+        self._update_ids = itertools.count(1)
+        self._message_ids = itertools.count(1)
+
+    def next(self):
+        kind = self.random.choices(self.kinds, self.weights)[0]
+        if kind == "vote" and not self.battles:
+            kind = "genre"
+        return kind, self.build(kind, self.random.randrange(1, self.users + 1))
+
+    def build(self, kind, user_id):
+        if kind == "vote":
+            battle_id, payment_amount = self.random.choice(self.battles)
+            return self.callback(user_id, encode_vote(battle_id, self.random.choice((1, 2)), payment_amount))
+        if kind == "genre":
+            return self.callback(user_id, encode_genre(self.random.choice(list(bot.GENRES))))
+        battle_id = str(self.random.choice(self.battles)[0]) if self.battles else "1"
+        text = {
+            "startbattle": "/startbattle",
+            "getwallet": "/getwallet",
+            "setwallet": f"/setwallet {wallet_address(user_id)}",
+            "battlevotes": f"/battlevotes {battle_id}",
+            "leaderboard": f"/leaderboard {battle_id}",
+            "voterslist": f"/getVotersList {battle_id}",
+            "listwallets": "/listwallets",
+            "balance": "/getContractBalance",
+            "rankings": self.random.choice(
+                ["/toptracks", f"/toptracks {self.random.choice(list(bot.GENRES))}", "/topcreators", "/topvoters"]
+            ),
+        }[kind]
+        return self.command(user_id, text)
+
+    def command(self, user_id, text):
+        return {
+            "update_id": next(self._update_ids),
+            "message": {
+                **self._message(user_id),
+                "from": self._user(user_id),
+                "text": text,
+                "entities": [{"type": "bot_command", "offset": 0, "length": len(text.split()[0])}],
+            },
+        }
+
+    def callback(self, user_id, data):
+        update_id = next(self._update_ids)
+        return {
+            "update_id": update_id,
+            "callback_query": {
+                "id": str(update_id),
+                "from": self._user(user_id),
+                "chat_instance": str(user_id),
+                "data": data,
+                "message": self._message(user_id),
+            },
+        }
+
+    def _message(self, user_id):
+        return {
+            "message_id": next(self._message_ids),
+            "date": int(time.time()),
+            "chat": {"id": user_id, "type": "private"},
+        }
+
+    @staticmethod
+    def _user(user_id):
+        return {"id": user_id, "is_bot": False, "first_name": f"User {user_id}", "username": f"user{user_id}"}
+
+
+def wallet_address(user_id):
+    return f"0x{user_id:040x}"
+
+
+def measure_import_ms(module="bot"):
+    """Cumulative import time of `module` in a fresh interpreter, as reported by -X importtime."""
+    result = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", f"import {module}"],
+        capture_output=True, text=True, check=True, cwd=os.path.dirname(os.path.abspath(__file__)),
+    )
+    # "import time: <self us> | <cumulative us> | <module>", innermost modules first
+    for line in reversed(result.stderr.splitlines()):
+        fields = line.split("|")
+        if len(fields) == 3 and fields[2].strip() == module:
+            return int(fields[1]) / 1000
+    raise RuntimeError(f"No import time reported for {module}")
+
+
+async def run(args):
+    backend = StubBackend(latency=args.backend_latency_ms / 1000, outage_every=args.backend_outage_every)
+    await backend.start()
+    spotify = FakeSpotify(latency=args.spotify_latency_ms / 1000, throttle_every=args.spotify_throttle_every)
+    await spotify.start()
+    telegram = FakeTelegramRequest(latency=args.telegram_latency_ms / 1000)
+    workdir = tempfile.mkdtemp(prefix="loadtest-")
+
+    # Point the bot's shared clients and stores at the stubs
+    bot.backend = bot.BackendClient(backend.url, pool_size=bot.BACKEND_POOL_SIZE, breakers=bot.backend_breakers)
+    bot.spotify = bot.track_cache.client = spotify_client(spotify.url)
+    bot.wallet_store = create_wallet_store("json", os.path.join(workdir, "wallets.json"))
+    bot.wallet_store.load()
+    bot.battle_sessions.path = None
+    bot.leaderboard.path = None
+
+    # Without --rate-limit the scheduler still runs (handlers pass it priorities) but never throttles
+    outbound = bot.outbound if args.rate_limit else unthrottled_scheduler()
+    startup_started = time.perf_counter()
+    application = (
+        Application.builder()
+        .token(BOT_TOKEN)
+        .request(telegram)
+        .updater(None)
+        .concurrent_updates(bot.update_processor)
+        .rate_limiter(outbound)
+        .build()
+    )
+    bot.register_handlers(application)
+
+    traffic = TrafficGenerator(args.users, args.mix, seed=args.seed)
+    latencies = defaultdict(list)
+
+    async def process(kind, payload):
+        update = Update.de_json(payload, application.bot)
+        started = time.perf_counter()
+        await application.update_processor.process_update(update, application.process_update(update))
+        latencies[kind].append(time.perf_counter() - started)
+
+    async with application:
+        bot.spotify.start()
+        await bot.track_cache.warm(list(bot.GENRES))
+        bot.battle_scheduler.start(lambda battle_id: bot.expire_battle(application.bot, battle_id))
+        await process("startup", traffic.build("getwallet", 1))
+        first_update = time.perf_counter() - startup_started
+
+        # Every user has a wallet, and a few battles exist before measuring
+        for user_id in range(1, args.users + 1):
+            await bot.wallet_store.set(str(user_id), wallet_address(user_id), f"user{user_id}")
+        for _ in range(args.battles):
+            await process("warmup", traffic.build("genre", 1))
+        traffic.battles = [
+            (session.battle_id, session.payment_amount) for session in bot.battle_sessions.open_sessions()
+        ]
+        latencies.clear()
+
+        rss_before = rss_mb()
+        tasks = []
+        started = time.perf_counter()
+        for index in range(args.count):
+            delay = started + index / args.rate - time.perf_counter()
+            if delay > 0:
+                await asyncio.sleep(delay)
+            tasks.append(asyncio.create_task(process(*traffic.next())))
+        await asyncio.gather(*tasks)
+        elapsed = time.perf_counter() - started
+        rss_after = rss_mb()
+        # Let the debounced keyboard edits of the last votes go out
+        await asyncio.sleep(bot.KEYBOARD_EDIT_INTERVAL + 0.5)
+
+        await bot.battle_scheduler.stop()
+        await bot.wallet_store.close()
+    await bot.backend.close()
+    await bot.spotify.close()
+    await backend.stop()
+    await spotify.stop()
+
+    everything = sorted(value for values in latencies.values() for value in values)
+    by_kind = {}
+    for kind, values in sorted(latencies.items()):
+        values.sort()
+        by_kind[kind] = {
+            "count": len(values),
+            "p50_ms": round(percentile(values, 0.50) * 1000, 2),
+            "p99_ms": round(percentile(values, 0.99) * 1000, 2),
+        }
+    _, errors = summary()
+    return {
+        "updates": len(everything),
+        "elapsed_s": round(elapsed, 3),
+        "rate_per_s": round(len(everything) / elapsed, 1) if elapsed else 0.0,
+        "p50_ms": round(percentile(everything, 0.50) * 1000, 2),
+        "p99_ms": round(percentile(everything, 0.99) * 1000, 2),
+        "by_kind": by_kind,
+        "handler_errors": errors,
+        "telegram_calls": dict(telegram.calls),
+        "backend_calls": dict(backend.calls),
+        "spotify_calls": dict(spotify.calls),
+        "startup_ms": {
+            "import": round(measure_import_ms(), 1),
+            "first_update": round(first_update * 1000, 1),
+        },
+        "rss_mb": {
+            "before": round(rss_before, 1),
+            "after": round(rss_after, 1),
+            "peak": round(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024, 1),
+        },
+    }
+
+
+def spotify_client(url):
+    """The bot's Spotify client, with its production limits, pointed at a FakeSpotify server."""
+    return bot.SpotifyClient(
+        "loadtest", "secret", api_url=url + "/v1", token_url=url + "/api/token",
+        rate=bot.SPOTIFY_RATE, burst=bot.SPOTIFY_BURST, max_concurrency=bot.SPOTIFY_CONCURRENCY,
+        breaker=bot.spotify_breaker,
+    )
+
+
+def unthrottled_scheduler():
+    """An OutboundScheduler that never throttles (handlers still pass it priorities)."""
+    unlimited = float("inf")
+    return OutboundScheduler(
+        global_rate=unlimited, global_burst=unlimited, chat_rate=unlimited, chat_burst=unlimited,
+        group_rate=unlimited, group_burst=unlimited,
+    )
+
+
+async def run_sharded(args, workers):
+    backend = StubBackend(latency=args.backend_latency_ms / 1000, outage_every=args.backend_outage_every)
+    await backend.start()
+    spotify = FakeSpotify(latency=args.spotify_latency_ms / 1000, throttle_every=args.spotify_throttle_every)
+    await spotify.start()
+    workdir = tempfile.mkdtemp(prefix="loadtest-")
+    wallet_db = os.path.join(workdir, "wallets.db")
+    store = create_wallet_store("sqlite", wallet_db)
+    store.bulk_insert([(str(user_id), wallet_address(user_id), f"user{user_id}") for user_id in range(1, args.users + 1)])
+    store.close_sync()
+
+    command = [
+        sys.executable, os.path.abspath(__file__), "--shard-worker", workdir,
+        "--backend-url", backend.url, "--spotify-url", spotify.url, "--wallet-db", wallet_db,
+        "--telegram-latency-ms", str(args.telegram_latency_ms),
+        "--log-level", args.log_level,
+        "--log-pipeline", args.log_pipeline,
+    ]
+    if args.rate_limit:
+        command.append("--rate-limit")
+    base_port = bot.config.shard_base_port
+    processes = WorkerProcesses(
+        command,
+        workers,
+        lambda index: {"SHARD_INDEX": str(index), "BOT_WORKERS": str(workers), "SHARD_BASE_PORT": str(base_port)},
+    )
+    front = ShardFront([(bot.config.shard_host, base_port + index) for index in range(workers)])
+    traffic = TrafficGenerator(args.users, args.mix, seed=args.seed)
+
+    async def send(payload):
+        await front.forward(json.dumps(payload).encode())
+
+    await processes.start()
+    try:
+        # Battles are started from different chats, so on different workers
+        for index in range(args.battles):
+            await send(traffic.build("genre", index % args.users + 1))
+        while len(backend.battles) < args.battles:
+            await asyncio.sleep(0.05)
+        traffic.battles = list(backend.battles)
+        await front.broadcast({"type": "loadtest_reset"})
+
+        cpu_before = time.process_time()
+        started = time.monotonic()
+        for index in range(args.count):
+            delay = started + index / args.rate - time.monotonic()
+            if delay > 0:
+                await asyncio.sleep(delay)
+            await send(traffic.next()[1])
+        front_cpu = time.process_time() - cpu_before
+        await front.broadcast({"type": "loadtest_report"})
+
+        reports = [os.path.join(workdir, f"worker-{index}.json") for index in range(workers)]
+        while not all(os.path.exists(path) for path in reports):
+            await asyncio.sleep(0.1)
+    finally:
+        await front.stop()
+        await processes.stop()
+        await backend.stop()
+        await spotify.stop()
+
+    per_worker = []
+    everything = []
+    for path in reports:
+        with open(path) as file:
+            report = json.load(file)
+        everything.extend(report.pop("latencies"))
+        per_worker.append(report)
+    everything.sort()
+    elapsed = max(report["finished_at"] for report in per_worker) - started
+    return {
+        "workers": workers,
+        "updates": len(everything),
+        "elapsed_s": round(elapsed, 3),
+        "rate_per_s": round(len(everything) / elapsed, 1) if elapsed else 0.0,
+        "p50_ms": round(percentile(everything, 0.50) * 1000, 2),
+        "p99_ms": round(percentile(everything, 0.99) * 1000, 2),
+        "front_cpu_s": round(front_cpu, 3),
+        "per_worker": [
+            {"updates": report["updates"], "cpu_s": report["cpu_s"], "handler_errors": report["handler_errors"]}
+            for report in per_worker
+        ],
+        "backend_calls": dict(backend.calls),
+        "spotify_calls": dict(spotify.calls),
+    }
+
+
+async def run_worker(args):
+    """One worker process of run_sharded(); writes its report to the --shard-worker directory."""
+    index = bot.config.shard_index
+    telegram = FakeTelegramRequest(latency=args.telegram_latency_ms / 1000)
+    bot.backend = bot.BackendClient(args.backend_url, pool_size=bot.BACKEND_POOL_SIZE, breakers=bot.backend_breakers)
+    bot.spotify = bot.track_cache.client = spotify_client(args.spotify_url)
+    bot.wallet_store = create_wallet_store("sqlite", args.wallet_db)
+    bot.wallet_store.load()
+    bot.battle_sessions.path = None
+    # The workers rank their battles together, as in production
+    bot.leaderboard = SqliteLeaderboard(os.path.join(args.shard_worker, "leaderboard.db"))
+    bot.leaderboard.load()
+    application = (
+        Application.builder()
+        .token(BOT_TOKEN)
+        .request(telegram)
+        .updater(None)
+        .concurrent_updates(bot.update_processor)
+        .rate_limiter(bot.outbound if args.rate_limit else unthrottled_scheduler())
+        .build()
+    )
+    bot.register_handlers(application)
+
+    latencies = []
+    pending = set()
+    finished_at = 0.0
+    reported = asyncio.Event()
+
+    async def process(update):
+        nonlocal finished_at
+        started = time.perf_counter()
+        await application.update_processor.process_update(update, application.process_update(update))
+        latencies.append(time.perf_counter() - started)
+        finished_at = time.monotonic()
+
+    async def submit(update):
+        task = asyncio.create_task(process(update))
+        pending.add(task)
+        task.add_done_callback(pending.discard)
+
+    async def on_event(event):
+        if event.get("type") == "loadtest_reset":
+            await asyncio.gather(*pending)
+            latencies.clear()
+        elif event.get("type") == "loadtest_report":
+            await asyncio.gather(*pending)
+            _, errors = summary()
+            report = {
+                "updates": len(latencies),
+                "finished_at": finished_at,
+                "cpu_s": round(time.process_time(), 3),
+                "handler_errors": errors,
+                "latencies": latencies,
+            }
+            path = os.path.join(args.shard_worker, f"worker-{index}.json")
+            with open(path + ".tmp", "w") as file:
+                json.dump(report, file)
+            os.replace(path + ".tmp", path)
+            reported.set()
+
+    receiver = ShardReceiver(
+        bot.config.shard_host, bot.config.shard_base_port + index, application.bot, submit, on_event
+    )
+    async with application:
+        bot.spotify.start()
+        await bot.track_cache.warm(list(bot.GENRES))
+        bot.battle_scheduler.start(lambda battle_id: bot.expire_battle(application.bot, battle_id))
+        await receiver.start()
+        await reported.wait()
+        # Exit when run_sharded() stops the workers, as production workers do
+        await wait_for_signal()
+        await receiver.stop()
+        # Let the debounced keyboard edits of the last votes go out
+        await asyncio.sleep(bot.KEYBOARD_EDIT_INTERVAL + 0.5)
+        await bot.battle_scheduler.stop()
+        await bot.wallet_store.close()
+        await bot.leaderboard.stop()
+    await bot.backend.close()
+    await bot.spotify.close()
+
+
+def parse_workers(text):
+    try:
+        counts = [int(count) for count in text.split(",")]
+    except ValueError:
+        raise argparse.ArgumentTypeError(f"Expected worker counts such as 4 or 1,2,4, got {text!r}")
+    if not counts or min(counts) < 1:
+        raise argparse.ArgumentTypeError("Worker counts must be at least 1")
+    return counts
+
+
+def check(report, args):
+    """The budgets `report` exceeds."""
+    failures = []
+    if args.max_p99_ms is not None and report["p99_ms"] > args.max_p99_ms:
+        failures.append(f"p99 {report['p99_ms']} ms > {args.max_p99_ms} ms")
+    if args.min_rate is not None and report["rate_per_s"] < args.min_rate:
+        failures.append(f"rate {report['rate_per_s']}/s < {args.min_rate}/s")
+    return failures
+
+
+def parse_mix(text):
+    mix = dict(DEFAULT_MIX)
+    for item in filter(None, text.split(",")):
+        kind, _, weight = item.partition("=")
+        if kind not in DEFAULT_MIX:
+            raise argparse.ArgumentTypeError(f"Unknown update kind {kind!r}; choose from {', '.join(DEFAULT_MIX)}")
+        mix[kind] = float(weight)
+    return mix
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--rate", type=float, default=200.0, help="Updates per second")
+    parser.add_argument("--count", type=int, default=5000, help="Number of updates to send")
+    parser.add_argument("--users", type=int, default=1000, help="Number of synthetic users (one private chat each)")
+    parser.add_argument("--battles", type=int, default=20, help="Battles created before measuring")
+    parser.add_argument("--mix", type=parse_mix, default=DEFAULT_MIX,
+                        help="Weights overriding the default mix, e.g. vote=80,genre=1")
+    parser.add_argument("--backend-latency-ms", type=float, default=5.0)
+    parser.add_argument("--telegram-latency-ms", type=float, default=20.0)
+    parser.add_argument("--backend-outage-every", type=int, default=0,
+                        help="Answer every Nth backend request with 503 (0: never)")
+    parser.add_argument("--spotify-latency-ms", type=float, default=50.0)
+    parser.add_argument("--spotify-throttle-every", type=int, default=0,
+                        help="Answer every Nth Spotify search with 429 Retry-After (0: never)")
+    parser.add_argument("--rate-limit", action="store_true", help="Throttle Bot API calls like production does")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--max-p99-ms", type=float, default=None, help="Fail if the overall p99 is higher")
+    parser.add_argument("--min-rate", type=float, default=None, help="Fail if fewer updates per second were handled")
+    parser.add_argument("--workers", type=parse_workers, default=None,
+                        help="Run through the sharded mode with this many worker processes, e.g. 4 or 1,2,4")
+    parser.add_argument("--log-level", default="WARNING")
+    parser.add_argument("--log-pipeline", choices=("queue", "sync"), default="queue",
+                        help="The bot's queue-based logging, or the synchronous basicConfig setup it replaced")
+    # Used by run_sharded() to start its worker processes
+    parser.add_argument("--shard-worker", default=None, help=argparse.SUPPRESS)
+    parser.add_argument("--backend-url", default=None, help=argparse.SUPPRESS)
+    parser.add_argument("--spotify-url", default=None, help=argparse.SUPPRESS)
+    parser.add_argument("--wallet-db", default=None, help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.log_pipeline == "sync":
+        logging.basicConfig(
+            format="%(asctime)s - %(name)s - %(levelname)s - %(message)s", level=args.log_level, force=True
+        )
+    else:
+        setup_logging(args.log_level, keep_one_in=bot.LOG_SAMPLING)
+    # As in bot.main()
+    logging.getLogger("httpx").setLevel(logging.WARNING)
+    if args.shard_worker is not None:
+        asyncio.run(run_worker(args))
+        return
+    if args.workers:
+        reports = [asyncio.run(run_sharded(args, workers)) for workers in args.workers]
+        print(json.dumps(reports, indent=2))
+    else:
+        reports = [asyncio.run(run(args))]
+        print(json.dumps(reports[0], indent=2))
+
+    failures = [failure for report in reports for failure in check(report, args)]
+    if failures:
+        raise SystemExit("FAILED: " + "; ".join(failures))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,89 @@
+"""
+Non-blocking, structured logging for the bot.
+
+Records are put on an in-memory queue by a `QueueHandler` and formatted
+and written by a `QueueListener` thread, so handlers never wait on I/O.
+Messages stay unformatted until the listener writes them (use
+`logger.info("... %s", value)`), every record carries the correlation id
+of the update being processed, and high-volume events can be sampled:
+
+    logger.info("Vote submitted for battle %s", battle_id, extra={"sample": "vote"})
+"""
+import atexit
+import contextvars
+import itertools
+import json
+import logging
+import logging.handlers
+import queue
+import sys
+import time
+
+# Id of the update currently being handled, set by the update processor
+correlation_id = contextvars.ContextVar("correlation_id", default=None)
+
+
+class JsonFormatter(logging.Formatter):
+    """One JSON object per line."""
+
+    def format(self, record):
+        entry = {
+            "ts": time.strftime("%Y-%m-%dT%H:%M:%S", time.gmtime(record.created)) + f".{int(record.msecs):03d}Z",
+            "level": record.levelname,
+            "logger": record.name,
+            "msg": record.getMessage(),
+        }
+        if getattr(record, "correlation_id", None) is not None:
+            entry["correlation_id"] = record.correlation_id
+        fields = getattr(record, "fields", None)
+        if fields:
+            entry.update(fields)
+        if record.exc_info:
+            entry["exc"] = self.formatException(record.exc_info)
+        return json.dumps(entry, default=str, ensure_ascii=False)
+
+
+class LazyQueueHandler(logging.handlers.QueueHandler):
+    """QueueHandler that leaves formatting to the listener thread."""
+
+    def prepare(self, record):
+        # The stock prepare() formats the message on the calling thread
+        record.correlation_id = correlation_id.get()
+        return record
+
+
+class SamplingFilter(logging.Filter):
+    """Keeps 1 in N records tagged with `extra={"sample": key}`; warnings and errors always pass."""
+
+    def __init__(self, keep_one_in):
+        super().__init__()
+        self.keep_one_in = keep_one_in
+        self._counters = {key: itertools.count() for key in keep_one_in}
+
+    def filter(self, record):
+        key = getattr(record, "sample", None)
+        if key is None or record.levelno >= logging.WARNING or key not in self.keep_one_in:
+            return True
+        return next(self._counters[key]) % self.keep_one_in[key] == 0
+
+
+def setup_logging(level=logging.INFO, keep_one_in=None, stream=None):
+    """Routes all logging through a background listener; returns the listener."""
+    log_queue = queue.SimpleQueue()
+    queue_handler = LazyQueueHandler(log_queue)
+    if keep_one_in:
+        queue_handler.addFilter(SamplingFilter(keep_one_in))
+
+    output = logging.StreamHandler(stream or sys.stderr)
+    output.setFormatter(JsonFormatter())
+    listener = logging.handlers.QueueListener(log_queue, output, respect_handler_level=True)
+
+    root = logging.getLogger()
+    for handler in list(root.handlers):
+        root.removeHandler(handler)
+    root.addHandler(queue_handler)
+    root.setLevel(level)
+
+    listener.start()
+    atexit.register(listener.stop)
+    return listener
@@ -0,0 +1,284 @@
+"""
+Lightweight in-process metrics with a Prometheus text endpoint.
+
+- `instrument(handler)` records per-handler latency, in-flight count and
+  errors by exception type.
+- `stage("backend")` times a section of a handler (Spotify, backend,
+  Telegram API calls, ...).
+- `MetricsServer` serves everything at http://<host>:<port>/metrics.
+
+Recording a sample is a perf_counter() call, a bisect over the bucket
+bounds and a few integer increments, so it is cheap enough for the hot
+path. Run `python metrics.py bench` to measure the cost per call of
+`instrument`, `stage` and `Histogram.observe`.
+"""
+import argparse
+import asyncio
+import functools
+import json
+import logging
+import time
+from bisect import bisect_left
+
+logger = logging.getLogger(__name__)
+
+# Latency buckets in seconds
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+
+
+class Histogram:
+    __slots__ = ("buckets", "counts", "sum", "count")
+
+    def __init__(self, buckets=DEFAULT_BUCKETS):
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, value):
+        self.counts[bisect_left(self.buckets, value)] += 1
+        self.sum += value
+        self.count += 1
+
+    def quantile(self, q):
+        """Estimates a quantile as the upper bound of the bucket it falls in."""
+        if not self.count:
+            return 0.0
+        rank = q * self.count
+        seen = 0
+        for bound, count in zip(self.buckets, self.counts):
+            seen += count
+            if seen >= rank:
+                return bound
+        return float("inf")
+
+
+class Registry:
+    """Holds every metric, keyed by name and label values."""
+
+    def __init__(self):
+        self.histograms = {}
+        self.counters = {}
+        self.gauges = {}
+        self.help = {}
+
+    def histogram(self, name, labels):
+        histogram = self.histograms.get((name, labels))
+        if histogram is None:
+            histogram = self.histograms[(name, labels)] = Histogram()
+        return histogram
+
+    def inc(self, name, labels, amount=1):
+        key = (name, labels)
+        self.counters[key] = self.counters.get(key, 0) + amount
+
+    def add_gauge(self, name, labels, amount):
+        key = (name, labels)
+        self.gauges[key] = self.gauges.get(key, 0) + amount
+
+    def set_gauge(self, name, labels, value):
+        self.gauges[(name, labels)] = value
+
+    def describe(self, name, text):
+        self.help[name] = text
+
+    def render(self):
+        """Returns all metrics in the Prometheus text exposition format."""
+        lines = []
+        for name in sorted({name for name, _ in self.histograms}):
+            lines.append(f"# HELP {name} {self.help.get(name, name)}")
+            lines.append(f"# TYPE {name} histogram")
+            for (metric, labels), histogram in self.histograms.items():
+                if metric != name:
+                    continue
+                cumulative = 0
+                for bound, count in zip(histogram.buckets, histogram.counts):
+                    cumulative += count
+                    lines.append(f'{name}_bucket{_labels(labels, ("le", bound))} {cumulative}')
+                lines.append(f'{name}_bucket{_labels(labels, ("le", "+Inf"))} {histogram.count}')
+                lines.append(f"{name}_sum{_labels(labels)} {histogram.sum}")
+                lines.append(f"{name}_count{_labels(labels)} {histogram.count}")
+        for kind, values in (("counter", self.counters), ("gauge", self.gauges)):
+            for name in sorted({name for name, _ in values}):
+                lines.append(f"# HELP {name} {self.help.get(name, name)}")
+                lines.append(f"# TYPE {name} {kind}")
+                for (metric, labels), value in values.items():
+                    if metric == name:
+                        lines.append(f"{name}{_labels(labels)} {value}")
+        return "\n".join(lines) + "\n"
+
+
+def _labels(labels, extra=None):
+    pairs = list(labels)
+    if extra is not None:
+        pairs.append(extra)
+    if not pairs:
+        return ""
+    return "{" + ",".join(f'{key}="{value}"' for key, value in pairs) + "}"
+
+
+registry = Registry()
+registry.describe("bot_handler_seconds", "Handler latency")
+registry.describe("bot_stage_seconds", "Latency of external calls made by handlers")
+registry.describe("bot_handler_errors_total", "Exceptions raised by handlers, by type")
+registry.describe("bot_stage_errors_total", "Exceptions raised by external calls, by type")
+registry.describe("bot_handlers_in_flight", "Handlers currently running")
+
+
+def instrument(handler):
+    """Decorates an async PTB handler to record latency, errors and in-flight count."""
+    labels = (("handler", handler.__name__),)
+    histogram = registry.histogram("bot_handler_seconds", labels)
+
+    @functools.wraps(handler)
+    async def wrapper(update, context, *args, **kwargs):
+        registry.add_gauge("bot_handlers_in_flight", labels, 1)
+        started = time.perf_counter()
+        try:
+            return await handler(update, context, *args, **kwargs)
+        except Exception as e:
+            registry.inc("bot_handler_errors_total", labels + (("type", type(e).__name__),))
+            raise
+        finally:
+            histogram.observe(time.perf_counter() - started)
+            registry.add_gauge("bot_handlers_in_flight", labels, -1)
+
+    return wrapper
+
+
+class stage:
+    """Context manager timing one external call: `with stage("backend"): ...`."""
+
+    __slots__ = ("labels", "histogram", "started")
+
+    def __init__(self, name):
+        self.labels = (("stage", name),)
+        self.histogram = registry.histogram("bot_stage_seconds", self.labels)
+
+    def __enter__(self):
+        self.started = time.perf_counter()
+        return self
+
+    def __exit__(self, exc_type, exc, traceback):
+        self.histogram.observe(time.perf_counter() - self.started)
+        if exc_type is not None and issubclass(exc_type, Exception):
+            registry.inc("bot_stage_errors_total", self.labels + (("type", exc_type.__name__),))
+        return False
+
+
+def summary():
+    """Per-handler and per-stage count, p50/p99 (bucket bounds) and error totals."""
+    rows = []
+    for (name, labels), histogram in sorted(registry.histograms.items()):
+        if not histogram.count:
+            continue
+        label = dict(labels).get("handler") or dict(labels).get("stage")
+        rows.append({
+            "kind": "handler" if name == "bot_handler_seconds" else "stage",
+            "name": label,
+            "count": histogram.count,
+            "avg_ms": round(histogram.sum / histogram.count * 1000, 1),
+            "p50_ms": histogram.quantile(0.5) * 1000,
+            "p99_ms": histogram.quantile(0.99) * 1000,
+        })
+    errors = {}
+    for (name, labels), value in registry.counters.items():
+        if name.endswith("errors_total"):
+            errors[f"{dict(labels).get('handler') or dict(labels).get('stage')}:{dict(labels)['type']}"] = value
+    return rows, errors
+
+
+class MetricsServer:
+    """Minimal HTTP server exposing GET /metrics."""
+
+    def __init__(self, host="localhost", port=9100, collectors=()):
+        self.host = host
+        self.port = port
+        # Callables run before each scrape to refresh gauges (queue depths, cache sizes, ...)
+        self.collectors = list(collectors)
+        self._server = None
+
+    async def start(self):
+        self._server = await asyncio.start_server(self._handle, self.host, self.port)
+        logger.info(f"Metrics available on http://{self.host}:{self.port}/metrics")
+
+    async def stop(self):
+        if self._server is not None:
+            self._server.close()
+            await self._server.wait_closed()
+            self._server = None
+
+    async def _handle(self, reader, writer):
+        try:
+            request_line = await reader.readline()
+            # Drain the headers; the request body (if any) is ignored
+            while (await reader.readline()) not in (b"\r\n", b"\n", b""):
+                pass
+            parts = request_line.decode("latin-1").split()
+            if len(parts) >= 2 and parts[0] == "GET" and parts[1].split("?")[0] == "/metrics":
+                for collect in self.collectors:
+                    collect()
+                status, body = "200 OK", registry.render().encode()
+            else:
+                status, body = "404 Not Found", b"Not found\n"
+            writer.write(
+                f"HTTP/1.1 {status}\r\n"
+                f"Content-Type: text/plain; version=0.0.4\r\n"
+                f"Content-Length: {len(body)}\r\n"
+                f"Connection: close\r\n\r\n".encode() + body
+            )
+            await writer.drain()
+        except ConnectionError:
+            pass
+        finally:
+            writer.close()
+
+
+def benchmark(calls):
+    """Times `calls` handler calls with and without `instrument`, and `stage` and `observe` on their own."""
+    async def handler(update, context):
+        return None
+
+    instrumented = instrument(handler)
+
+    async def timed(call):
+        started = time.perf_counter()
+        for _ in range(calls):
+            await call(None, None)
+        return time.perf_counter() - started
+
+    plain_s = asyncio.run(timed(handler))
+    instrumented_s = asyncio.run(timed(instrumented))
+
+    started = time.perf_counter()
+    for _ in range(calls):
+        pass
+    loop_s = time.perf_counter() - started
+    started = time.perf_counter()
+    for _ in range(calls):
+        with stage("bench"):
+            pass
+    stage_s = time.perf_counter() - started - loop_s
+    histogram = Histogram()
+    started = time.perf_counter()
+    for index in range(calls):
+        histogram.observe(index % 1000 / 100)
+    observe_s = time.perf_counter() - started - loop_s
+    return {
+        "calls": calls,
+        "handler_us": round(plain_s / calls * 1e6, 3),
+        "instrumented_handler_us": round(instrumented_s / calls * 1e6, 3),
+        "instrument_overhead_us": round((instrumented_s - plain_s) / calls * 1e6, 3),
+        "stage_overhead_us": round(stage_s / calls * 1e6, 3),
+        "observe_us": round(observe_s / calls * 1e6, 3),
+    }
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Metrics maintenance")
+    subcommands = parser.add_subparsers(dest="command", required=True)
+    bench = subcommands.add_parser("bench", help="Measure the overhead of recording metrics per call")
+    bench.add_argument("--calls", type=int, default=1000000)
+    args = parser.parse_args()
+
+    print(json.dumps(benchmark(args.calls), indent=2))
@@ -203,21 +203,17 @@ async function startBattle(track1, track2, creatorTrack1, creatorTrack2, userAdd
     // Extract battle ID from events
     const battleCreatedEvent = receipt.events?.BattleCreated;
     const battleId = battleCreatedEvent ? battleCreatedEvent.returnValues.battleId : null;
+    // End of the voting period (unix seconds); the bot closes the battle when it passes
+    const endTime = battleCreatedEvent ? battleCreatedEvent.returnValues.endTime : null;
 
     console.log("Battle ID:", battleId);
     console.log("Transaction Hash:", receipt.transactionHash);
 
-    // Schedule the getWinner function after 1 minute
-    if (battleId) {
-      console.log(`Scheduling getWinner for battle ID: ${battleId}`);
-      console.log("Close battle function will be get implemented Now : ********************************************** in 1 minute ***************************************** ")
-      setTimeout(() => getWinner(battleId), 15*1000);
-    }
-
     return {
       balanceBefore: web3.utils.fromWei(balanceBefore, 'ether'),
       balanceAfter: web3.utils.fromWei(balanceAfter, 'ether'),
       battleId: battleId ? battleId.toString() : null,
+      endTime: endTime ? endTime.toString() : null,
       transactionHash: receipt.transactionHash
     };
   } catch (error) {
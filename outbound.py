@@ -0,0 +1,343 @@
+"""
+Outbound scheduler for Telegram API calls.
+
+Plugged into PTB as the bot's rate limiter, so every `reply_text`,
+`edit_message_*` and `answer` goes through it:
+
+- token buckets keep the bot under Telegram's global limit (~30 requests/s)
+  and per-chat limits (~1 message/s in private chats, ~20/min in groups);
+- requests wait in priority lanes, so vote confirmations overtake
+  informational messages when the bot is throttled;
+- an edit of a message that still has an edit waiting replaces the waiting
+  one; both callers get the result of the newer edit;
+- a request still waiting when every caller of it has been cancelled is
+  dropped instead of sent;
+- a `RetryAfter` from Telegram pauses the chat (or everything, for calls
+  without a chat) for the requested time and the request is retried.
+
+The priority of a call comes from `rate_limit_args={"priority": ...}` or,
+for calls made through shortcuts like `reply_text`, from `outbound_priority`:
+
+    outbound_priority.set(PRIORITY_HIGH)
+    await query.message.reply_text("✅ Vote recorded")
+
+`clock` and `sleep` can be replaced to drive the scheduler with a
+simulated clock.
+"""
+import asyncio
+import contextvars
+import logging
+import time
+from collections import deque
+
+from telegram.error import RetryAfter
+from telegram.ext import BaseRateLimiter
+
+from metrics import registry
+
+logger = logging.getLogger(__name__)
+
+PRIORITY_HIGH = 0
+PRIORITY_NORMAL = 1
+PRIORITY_LOW = 2
+
+# Priority of calls made from the current handler, unless rate_limit_args says otherwise
+outbound_priority = contextvars.ContextVar("outbound_priority", default=PRIORITY_NORMAL)
+
+# Endpoints that are latency-sensitive whatever the handler's priority (the button spinner)
+ENDPOINT_PRIORITY = {"answerCallbackQuery": PRIORITY_HIGH}
+
+# Edits where only the latest version matters
+COALESCED_ENDPOINTS = frozenset({"editMessageText", "editMessageReplyMarkup", "editMessageCaption"})
+
+# Refill rounding: sleeping for the computed delay can leave a token a hair short of whole
+TOKEN_EPSILON = 1e-9
+
+
+class TokenBucket:
+    __slots__ = ("rate", "capacity", "tokens", "updated", "paused_until")
+
+    def __init__(self, rate, capacity, now):
+        self.rate = rate
+        self.capacity = capacity
+        self.tokens = capacity
+        self.updated = now
+        self.paused_until = 0.0
+
+    def delay(self, now):
+        """Seconds until a token is available (0 if one is available now)."""
+        if now < self.paused_until:
+            return self.paused_until - now
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+        if self.tokens >= 1 - TOKEN_EPSILON:
+            return 0.0
+        return (1 - self.tokens) / self.rate
+
+    def take(self):
+        self.tokens -= 1
+
+    def pause(self, until):
+        self.paused_until = max(self.paused_until, until)
+
+    def idle(self, now):
+        return now >= self.paused_until and self.tokens + (now - self.updated) * self.rate >= self.capacity
+
+
+class _Request:
+    __slots__ = ("priority", "chat_id", "key", "callback", "args", "kwargs", "future", "attempts", "waiters")
+
+    def __init__(self, priority, chat_id, key, callback, args, kwargs, future):
+        self.priority = priority
+        self.chat_id = chat_id
+        self.key = key
+        self.callback = callback
+        self.args = args
+        self.kwargs = kwargs
+        self.future = future
+        self.attempts = 0
+        # Callers awaiting the future: the first one and those whose edits it replaced
+        self.waiters = 1
+
+
+class OutboundScheduler(BaseRateLimiter):
+    """Throttles, prioritises and coalesces outgoing Bot API requests."""
+
+    # Per-chat buckets that are full and not paused are dropped past this many chats
+    MAX_IDLE_CHATS = 10000
+
+    def __init__(self, global_rate=30.0, global_burst=30, chat_rate=1.0, chat_burst=3,
+                 group_rate=20 / 60, group_burst=10, max_retries=3,
+                 clock=time.monotonic, sleep=asyncio.sleep):
+        self.chat_rate = chat_rate
+        self.chat_burst = chat_burst
+        self.group_rate = group_rate
+        self.group_burst = group_burst
+        self.max_retries = max_retries
+        self.clock = clock
+        self.sleep = sleep
+
+        self._global = TokenBucket(global_rate, global_burst, clock())
+        self._chats = {}
+        self._lanes = (deque(), deque(), deque())
+        # Coalescing key -> request still waiting in a lane
+        self._waiting_edits = {}
+        self._wakeup = asyncio.Event()
+        self._dispatcher = None
+        self._in_flight = set()
+
+        self.sent = 0
+        self.coalesced = 0
+        self.retried = 0
+        self.max_wait = 0.0
+
+    async def initialize(self):
+        if self._dispatcher is None:
+            self._dispatcher = asyncio.create_task(self._dispatch_loop())
+
+    async def shutdown(self):
+        if self._dispatcher is not None:
+            self._dispatcher.cancel()
+            try:
+                await self._dispatcher
+            except asyncio.CancelledError:
+                pass
+            self._dispatcher = None
+        for lane in self._lanes:
+            while lane:
+                request = lane.popleft()
+                if not request.future.done():
+                    request.future.set_exception(RuntimeError("Outbound scheduler shut down"))
+        self._waiting_edits.clear()
+
+    async def process_request(self, callback, args, kwargs, endpoint, data, rate_limit_args):
+        await self.initialize()
+        priority = outbound_priority.get()
+        if rate_limit_args and "priority" in rate_limit_args:
+            priority = rate_limit_args["priority"]
+        priority = min(priority, ENDPOINT_PRIORITY.get(endpoint, priority))
+
+        chat_id = data.get("chat_id")
+        key = None
+        if endpoint in COALESCED_ENDPOINTS:
+            key = (endpoint, chat_id, data.get("message_id"), data.get("inline_message_id"))
+            waiting = self._waiting_edits.get(key)
+            if waiting is not None:
+                # Superseded: send the newer edit instead and share its result
+                waiting.callback, waiting.args, waiting.kwargs = callback, args, kwargs
+                if priority < waiting.priority:
+                    self._lanes[waiting.priority].remove(waiting)
+                    waiting.priority = priority
+                    self._lanes[priority].append(waiting)
+                self.coalesced += 1
+                registry.inc("bot_outbound_coalesced_total", ())
+                waiting.waiters += 1
+                return await self._wait(waiting)
+
+        request = _Request(priority, chat_id, key, callback, args, kwargs, asyncio.get_running_loop().create_future())
+        if key is not None:
+            self._waiting_edits[key] = request
+        self._lanes[priority].append(request)
+        self._wakeup.set()
+
+        queued_at = self.clock()
+        try:
+            return await self._wait(request)
+        finally:
+            waited = self.clock() - queued_at
+            if waited > self.max_wait:
+                self.max_wait = waited
+
+    def stats(self):
+        return {
+            "waiting": sum(len(lane) for lane in self._lanes),
+            "waiting_high": len(self._lanes[PRIORITY_HIGH]),
+            "in_flight": len(self._in_flight),
+            "sent": self.sent,
+            "coalesced": self.coalesced,
+            "retried": self.retried,
+            "chats": len(self._chats),
+            "max_wait_s": round(self.max_wait, 3),
+        }
+
+    async def _wait(self, request):
+        try:
+            # Shielded: the request is shared with the callers of coalesced edits
+            return await asyncio.shield(request.future)
+        except asyncio.CancelledError:
+            request.waiters -= 1
+            if not request.waiters:
+                self._withdraw(request)
+            raise
+
+    def _withdraw(self, request):
+        """Drops a request nobody waits for, unless it is already being sent."""
+        lane = self._lanes[request.priority]
+        if request not in lane:
+            return
+        lane.remove(request)
+        if request.key is not None and self._waiting_edits.get(request.key) is request:
+            del self._waiting_edits[request.key]
+        request.future.cancel()
+
+    async def _dispatch_loop(self):
+        while True:
+            self._wakeup.clear()
+            request, wait = self._next_ready(self.clock())
+            if request is not None:
+                self._start(request)
+                continue
+            if wait is None:
+                await self._wakeup.wait()
+                continue
+            # Sleep until a bucket refills, or until a new request arrives
+            sleeper = asyncio.ensure_future(self.sleep(wait))
+            woken = asyncio.ensure_future(self._wakeup.wait())
+            try:
+                await asyncio.wait((sleeper, woken), return_when=asyncio.FIRST_COMPLETED)
+            finally:
+                sleeper.cancel()
+                woken.cancel()
+
+    def _next_ready(self, now):
+        """Returns (request to send now, None) or (None, seconds until one may be ready)."""
+        global_delay = self._global.delay(now)
+        earliest = None
+        for lane in self._lanes:
+            if not lane:
+                continue
+            if global_delay:
+                return None, global_delay
+            blocked = set()
+            for request in lane:
+                if request.chat_id in blocked:
+                    continue
+                bucket = self._chat_bucket(request.chat_id, now)
+                delay = bucket.delay(now) if bucket is not None else 0.0
+                if not delay:
+                    lane.remove(request)
+                    return request, None
+                blocked.add(request.chat_id)
+                earliest = delay if earliest is None else min(earliest, delay)
+        return None, earliest
+
+    def _start(self, request):
+        now = self.clock()
+        self._global.take()
+        bucket = self._chat_bucket(request.chat_id, now)
+        if bucket is not None:
+            bucket.take()
+        if request.key is not None and self._waiting_edits.get(request.key) is request:
+            del self._waiting_edits[request.key]
+        task = asyncio.create_task(self._send(request))
+        self._in_flight.add(task)
+        task.add_done_callback(self._in_flight.discard)
+
+    async def _send(self, request):
+        try:
+            result = await request.callback(*request.args, **request.kwargs)
+        except RetryAfter as e:
+            self._retry_later(request, e)
+        except Exception as e:
+            if not request.future.done():
+                request.future.set_exception(e)
+        else:
+            self.sent += 1
+            if not request.future.done():
+                request.future.set_result(result)
+
+    def _retry_later(self, request, error):
+        retry_after = getattr(error.retry_after, "total_seconds", lambda: error.retry_after)()
+        until = self.clock() + retry_after
+        bucket = self._chat_bucket(request.chat_id, self.clock())
+        (bucket or self._global).pause(until)
+        logger.warning(
+            "Flood control: pausing %s for %ss", f"chat {request.chat_id}" if bucket else "all requests", retry_after
+        )
+        registry.inc("bot_outbound_retry_after_total", ())
+
+        if request.attempts >= self.max_retries:
+            request.future.set_exception(error)
+            return
+        request.attempts += 1
+        self.retried += 1
+        newer = self._waiting_edits.get(request.key) if request.key is not None else None
+        if newer is not None:
+            # A newer edit of the same message is already waiting; this one is obsolete
+            newer.future.add_done_callback(lambda future: _copy_outcome(future, request.future))
+            return
+        if request.key is not None:
+            self._waiting_edits[request.key] = request
+        # Retried requests go first in their lane to keep per-chat order
+        self._lanes[request.priority].appendleft(request)
+        self._wakeup.set()
+
+    def _chat_bucket(self, chat_id, now):
+        if chat_id is None:
+            return None
+        bucket = self._chats.get(chat_id)
+        if bucket is None:
+            if len(self._chats) >= self.MAX_IDLE_CHATS:
+                self._prune(now)
+            group = str(chat_id).startswith("-") or str(chat_id).startswith("@")
+            bucket = self._chats[chat_id] = TokenBucket(
+                self.group_rate if group else self.chat_rate,
+                self.group_burst if group else self.chat_burst,
+                now,
+            )
+        return bucket
+
+    def _prune(self, now):
+        for chat_id in [chat_id for chat_id, bucket in self._chats.items() if bucket.idle(now)]:
+            del self._chats[chat_id]
+
+
+def _copy_outcome(source, target):
+    if target.done():
+        return
+    if source.cancelled():
+        target.cancel()
+    elif source.exception() is not None:
+        target.set_exception(source.exception())
+    else:
+        target.set_result(source.result())
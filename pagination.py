@@ -0,0 +1,240 @@
+"""
+Paginated replies for long lists (wallets, voters).
+
+A list is rendered from an iterator of lines into pages that fit in one
+Telegram message. Only the first page is rendered when the command runs;
+the "Next" button renders further pages on demand, pulling just enough
+lines from the source, and every rendered page is kept so "Prev" and
+repeated presses are served without touching the source again.
+
+    query_id, page = await pages.open(lines, header="Voters:")
+    await update.message.reply_text(page.text, reply_markup=page.keyboard)
+
+The buttons carry `callbacks.encode_page(query_id, index)`.
+
+`python pagination.py bench` renders a list of wallet lines both as the
+former single message and page by page, and sends pages through a Bot
+whose requests are answered in-process, reporting render and send times
+and the size of each sendMessage payload.
+"""
+import argparse
+import asyncio
+import json
+import logging
+import secrets
+import time
+from collections import OrderedDict
+
+from telegram import InlineKeyboardButton, InlineKeyboardMarkup
+
+from callbacks import encode_page
+
+logger = logging.getLogger(__name__)
+
+# Telegram rejects messages longer than 4096 characters; leave room for the header
+MAX_PAGE_CHARS = 3500
+MAX_PAGE_LINES = 50
+
+
+class Page:
+    __slots__ = ("text", "index", "has_next", "keyboard", "parse_mode")
+
+    def __init__(self, text, index, has_next, keyboard, parse_mode):
+        self.text = text
+        self.index = index
+        self.has_next = has_next
+        self.keyboard = keyboard
+        self.parse_mode = parse_mode
+
+
+class _Query:
+    """Rendering state of one paginated list."""
+
+    __slots__ = ("lines", "header", "parse_mode", "pages", "carry", "done", "lock", "touched_at")
+
+    def __init__(self, lines, header, parse_mode, now):
+        self.lines = lines
+        self.header = header
+        self.parse_mode = parse_mode
+        self.pages = []
+        # First line of the next page, read ahead to know whether there is one
+        self.carry = None
+        self.done = False
+        self.lock = asyncio.Lock()
+        self.touched_at = now
+
+
+async def _aiter(lines):
+    for line in lines:
+        yield line
+
+
+class PageCache:
+    """Renders pages lazily and keeps them per query (LRU, with a TTL)."""
+
+    def __init__(self, max_queries=256, ttl=900, max_chars=MAX_PAGE_CHARS,
+                 max_lines=MAX_PAGE_LINES, clock=time.monotonic):
+        self.max_queries = max_queries
+        self.ttl = ttl
+        self.max_chars = max_chars
+        self.max_lines = max_lines
+        self.clock = clock
+        self._queries = OrderedDict()
+        self.rendered = 0
+        self.hits = 0
+        self.expired = 0
+
+    async def open(self, lines, header="", parse_mode=None):
+        """Registers a list and renders its first page; returns (query_id, page).
+
+        `lines` may be a plain or an async iterable; it is only consumed as
+        far as the pages that get viewed.
+        """
+        if not hasattr(lines, "__anext__"):
+            lines = _aiter(lines)
+        query_id = secrets.token_urlsafe(6)
+        self._queries[query_id] = _Query(lines, header, parse_mode, self.clock())
+        self._evict()
+        return query_id, await self.page(query_id, 0)
+
+    async def page(self, query_id, index):
+        """Returns page `index` of a query, or None if the query expired or has no such page."""
+        query = self._queries.get(query_id)
+        if query is None or self.clock() - query.touched_at > self.ttl:
+            self._queries.pop(query_id, None)
+            self.expired += 1
+            return None
+        query.touched_at = self.clock()
+        self._queries.move_to_end(query_id)
+
+        if index < len(query.pages):
+            self.hits += 1
+        else:
+            async with query.lock:
+                while index >= len(query.pages) and not query.done:
+                    await self._render_next(query)
+            if index >= len(query.pages):
+                return None
+
+        text = query.pages[index]
+        has_next = index + 1 < len(query.pages) or not query.done
+        total = len(query.pages) if query.done else None
+        return Page(text, index, has_next, self._keyboard(query_id, index, has_next, total), query.parse_mode)
+
+    def stats(self):
+        return {
+            "queries": len(self._queries),
+            "rendered": self.rendered,
+            "hits": self.hits,
+            "expired": self.expired,
+        }
+
+    async def _render_next(self, query):
+        # Lines are collected and joined once, so a page costs O(its size)
+        budget = self.max_chars - len(query.header)
+        parts = []
+        if query.carry is not None:
+            parts.append(query.carry)
+            budget -= len(query.carry) + 1
+            query.carry = None
+
+        async for line in query.lines:
+            if len(line) > self.max_chars // 2:
+                line = line[: self.max_chars // 2 - 1] + "…"
+            if parts and (len(parts) >= self.max_lines or len(line) + 1 > budget):
+                query.carry = line
+                break
+            parts.append(line)
+            budget -= len(line) + 1
+        else:
+            query.done = True
+
+        if parts or not query.pages:
+            body = "\n".join(parts)
+            query.pages.append(f"{query.header}\n{body}" if query.header else body)
+            self.rendered += 1
+        if query.done:
+            # The source is exhausted; drop the iterator and what it holds on to
+            query.lines = None
+
+    def _keyboard(self, query_id, index, has_next, total):
+        if index == 0 and not has_next:
+            return None
+        buttons = []
+        if index > 0:
+            buttons.append(InlineKeyboardButton("◀ Prev", callback_data=encode_page(query_id, index - 1)))
+        label = f"{index + 1}/{total}" if total else f"{index + 1}"
+        buttons.append(InlineKeyboardButton(label, callback_data=encode_page(query_id, index)))
+        if has_next:
+            buttons.append(InlineKeyboardButton("Next ▶", callback_data=encode_page(query_id, index + 1)))
+        return InlineKeyboardMarkup([buttons])
+
+    def _evict(self):
+        while len(self._queries) > self.max_queries:
+            self._queries.popitem(last=False)
+
+
+async def benchmark(entries, sends):
+    """Renders `entries` wallet lines as one string and as pages, then times `sends` page sends."""
+    from telegram import Bot
+    from stubs import FakeTelegramRequest
+
+    def lines():
+        for user_id in range(entries):
+            yield f"User ID {user_id} (@user{user_id}): EQ{user_id:046d}"
+
+    # The former /listwallets reply: one string grown line by line
+    started = time.perf_counter()
+    message = "Global Wallet Mappings:\n"
+    for line in lines():
+        message += line + "\n"
+    single_ms = (time.perf_counter() - started) * 1000
+
+    pages = PageCache()
+    started = time.perf_counter()
+    query_id, first = await pages.open(lines(), header="Global Wallet Mappings:")
+    first_page_ms = (time.perf_counter() - started) * 1000
+    started = time.perf_counter()
+    rendered = [first]
+    while rendered[-1].has_next:
+        rendered.append(await pages.page(query_id, len(rendered)))
+    all_pages_ms = (time.perf_counter() - started) * 1000
+    started = time.perf_counter()
+    for page in rendered:
+        await pages.page(query_id, page.index)
+    cached_page_us = (time.perf_counter() - started) / len(rendered) * 1e6
+
+    payloads = sorted(
+        len(json.dumps({"chat_id": 1, "text": page.text, "reply_markup": page.keyboard.to_dict()}).encode())
+        for page in rendered
+    )
+    request = FakeTelegramRequest()
+    async with Bot("1:bench", request=request) as bot:
+        started = time.perf_counter()
+        for index in range(sends):
+            page = rendered[index % len(rendered)]
+            await bot.send_message(1, page.text, reply_markup=page.keyboard)
+        send_us = (time.perf_counter() - started) / sends * 1e6
+    return {
+        "entries": entries,
+        "single_message_chars": len(message),
+        "single_message_ms": round(single_ms, 2),
+        "pages": len(rendered),
+        "first_page_ms": round(first_page_ms, 3),
+        "all_pages_ms": round(all_pages_ms, 2),
+        "cached_page_us": round(cached_page_us, 2),
+        "payload_bytes_median": payloads[len(payloads) // 2],
+        "payload_bytes_max": payloads[-1],
+        "send_page_us": round(send_us, 1),
+    }
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Pagination maintenance")
+    subcommands = parser.add_subparsers(dest="command", required=True)
+    bench = subcommands.add_parser("bench", help="Measure page rendering, payload sizes and send time")
+    bench.add_argument("--entries", type=int, default=100000)
+    bench.add_argument("--sends", type=int, default=1000)
+    args = parser.parse_args()
+
+    print(json.dumps(asyncio.run(benchmark(args.entries, args.sends)), indent=2))
@@ -0,0 +1,230 @@
+"""
+Replays recorded Telegram updates through the bot, delivered by webhook and
+by polling, and compares how long each update takes to be handled.
+
+Each line of the input file is one Update JSON object, as Telegram sends
+it. For every delivery mode the bot's handlers run in this process, behind
+PTB's real `Updater`, with the Bot API replaced by `FakeBotApi` and the
+backend and Spotify by the other stubs of stubs.py:
+
+- webhook: `Updater.start_webhook` serves the bot's webhook endpoint and the
+  updates are POSTed to it;
+- polling: `Updater.start_polling` long-polls `FakeBotApi`, which hands out
+  the updates as they are pushed to it.
+
+Updates are delivered at the requested rate. The end-to-end latency of an
+update runs from its delivery until its handlers have finished; the report
+gives its p50/p99 and the achieved rate per mode, plus for the webhook the
+time until it was accepted (the HTTP 200). Every message between Telegram
+and the bot (each Bot API answer, each webhook POST) takes
+--telegram-latency-ms:
+
+    python replay_updates.py updates.jsonl --rate 500 --count 5000
+    python replay_updates.py updates.jsonl --delivery polling --telegram-latency-ms 50
+"""
+import argparse
+import asyncio
+import itertools
+import json
+import os
+import socket
+import tempfile
+import time
+
+import httpx
+from telegram.ext import Application
+
+# Before bot: loadtest sets the stub credentials bot.py reads at import
+from loadtest import BOT_TOKEN, spotify_client, unthrottled_scheduler
+import bot
+from stubs import FakeBotApi, FakeSpotify, StubBackend
+from wallet_store import create_wallet_store
+
+DELIVERIES = ("webhook", "polling")
+WEBHOOK_PATH = "telegram"
+WEBHOOK_SECRET = "replay"
+# Seconds the polling Updater waits in each getUpdates call
+POLL_TIMEOUT = 10
+
+
+class TimedApplication(Application):
+    """An Application recording when the handlers of each update have finished."""
+
+    def __init__(self, **kwargs):
+        super().__init__(**kwargs)
+        self.finished = {}
+
+    async def process_update(self, update):
+        try:
+            await super().process_update(update)
+        finally:
+            self.finished[update.update_id] = time.perf_counter()
+
+
+def percentile(sorted_values, fraction):
+    if not sorted_values:
+        return 0.0
+    index = min(len(sorted_values) - 1, int(fraction * len(sorted_values)))
+    return sorted_values[index]
+
+
+def free_port():
+    with socket.socket() as probe:
+        probe.bind(("127.0.0.1", 0))
+        return probe.getsockname()[1]
+
+
+async def replay(updates, delivery, rate, telegram_latency=0.0, concurrency=100):
+    api = FakeBotApi(latency=telegram_latency)
+    backend = StubBackend()
+    spotify = FakeSpotify()
+    for server in (api, backend, spotify):
+        await server.start()
+    workdir = tempfile.mkdtemp(prefix="replay-")
+
+    # Point the bot's shared clients and stores at the stubs
+    bot.backend = bot.BackendClient(backend.url, pool_size=bot.BACKEND_POOL_SIZE, breakers=bot.backend_breakers)
+    bot.spotify = bot.track_cache.client = spotify_client(spotify.url)
+    bot.wallet_store = create_wallet_store("json", os.path.join(workdir, "wallets.json"))
+    bot.wallet_store.load()
+    bot.battle_sessions.path = None
+    bot.leaderboard.path = None
+
+    application = (
+        Application.builder()
+        .application_class(TimedApplication)
+        .token(BOT_TOKEN)
+        .base_url(f"{api.url}/bot")
+        .update_queue(asyncio.Queue(maxsize=bot.UPDATE_QUEUE_SIZE))
+        .concurrent_updates(bot.update_processor)
+        .rate_limiter(unthrottled_scheduler())
+        .build()
+    )
+    bot.register_handlers(application)
+
+    delivered = {}
+    accept_latencies = []
+    failures = 0
+    semaphore = asyncio.Semaphore(concurrency)
+    webhook_port = free_port()
+
+    async with application, httpx.AsyncClient(limits=httpx.Limits(max_connections=concurrency)) as client:
+        async def post(update):
+            nonlocal failures
+            async with semaphore:
+                started = time.perf_counter()
+                await asyncio.sleep(telegram_latency)
+                try:
+                    response = await client.post(
+                        f"http://127.0.0.1:{webhook_port}/{WEBHOOK_PATH}", json=update,
+                        headers={"X-Telegram-Bot-Api-Secret-Token": WEBHOOK_SECRET},
+                    )
+                    response.raise_for_status()
+                except httpx.HTTPError:
+                    failures += 1
+                    return
+                accept_latencies.append(time.perf_counter() - started)
+
+        async def push(update):
+            api.push(update)
+
+        bot.spotify.start()
+        await bot.track_cache.warm(list(bot.GENRES))
+        bot.battle_scheduler.start(lambda battle_id: bot.expire_battle(application.bot, battle_id))
+        if delivery == "webhook":
+            await application.updater.start_webhook(
+                listen="127.0.0.1", port=webhook_port, url_path=WEBHOOK_PATH, secret_token=WEBHOOK_SECRET,
+            )
+            deliver = post
+        else:
+            await application.updater.start_polling(poll_interval=0.0, timeout=POLL_TIMEOUT)
+            deliver = push
+        await application.start()
+
+        started = time.perf_counter()
+        tasks = []
+        for index, update in enumerate(updates):
+            # Pace the deliveries so update `index` goes out at index / rate seconds
+            delay = started + index / rate - time.perf_counter()
+            if delay > 0:
+                await asyncio.sleep(delay)
+            delivered[update["update_id"]] = time.perf_counter()
+            tasks.append(asyncio.create_task(deliver(update)))
+        await asyncio.gather(*tasks)
+        while len(application.finished) < len(delivered) - failures:
+            await asyncio.sleep(0.01)
+
+        await application.updater.stop()
+        await application.stop()
+        await bot.battle_scheduler.stop()
+        await bot.wallet_store.close()
+    await bot.backend.close()
+    await bot.spotify.close()
+    for server in (api, backend, spotify):
+        await server.stop()
+
+    finished = application.finished
+    latencies = sorted(finished[update_id] - delivered[update_id] for update_id in finished)
+    elapsed = max(finished.values(), default=started) - started
+    report = {
+        "delivery": delivery,
+        "sent": len(delivered),
+        "failed": failures,
+        "handled": len(finished),
+        "elapsed_s": round(elapsed, 3),
+        "rate_per_s": round(len(finished) / elapsed, 1) if elapsed else 0.0,
+        "p50_ms": round(percentile(latencies, 0.50) * 1000, 2),
+        "p99_ms": round(percentile(latencies, 0.99) * 1000, 2),
+    }
+    if delivery == "webhook":
+        accept_latencies.sort()
+        report["accept_p50_ms"] = round(percentile(accept_latencies, 0.50) * 1000, 2)
+        report["accept_p99_ms"] = round(percentile(accept_latencies, 0.99) * 1000, 2)
+    else:
+        report["get_updates_calls"] = api.calls["getUpdates"]
+    return report
+
+
+def load_updates(path, count):
+    with open(path) as file:
+        recorded = [json.loads(line) for line in file if line.strip()]
+    if not recorded:
+        raise SystemExit(f"No updates found in {path}")
+    # Cycle through the recording with fresh update ids so PTB treats each one as new
+    updates = []
+    for update_id, update in zip(range(1, count + 1), itertools.cycle(recorded)):
+        updates.append({**update, "update_id": update_id})
+    return updates
+
+
+def parse_deliveries(text):
+    deliveries = [delivery for delivery in text.split(",") if delivery]
+    unknown = set(deliveries) - set(DELIVERIES)
+    if unknown or not deliveries:
+        raise argparse.ArgumentTypeError(f"Expected a list of {', '.join(DELIVERIES)}, got {text!r}")
+    return deliveries
+
+
+async def compare(updates, deliveries, rate, telegram_latency):
+    # One event loop for every run: the bot's module-level clients and queues stay bound to it
+    return [await replay(updates, delivery, rate, telegram_latency) for delivery in deliveries]
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("updates", help="JSONL file of recorded Telegram updates")
+    parser.add_argument("--delivery", type=parse_deliveries, default=list(DELIVERIES),
+                        help="Delivery modes to run, e.g. webhook or webhook,polling")
+    parser.add_argument("--rate", type=float, default=100.0, help="Updates per second")
+    parser.add_argument("--count", type=int, default=1000, help="Number of updates to send")
+    parser.add_argument("--telegram-latency-ms", type=float, default=20.0,
+                        help="Delay of each message between Telegram and the bot")
+    args = parser.parse_args()
+
+    updates = load_updates(args.updates, args.count)
+    reports = asyncio.run(compare(updates, args.delivery, args.rate, args.telegram_latency_ms / 1000))
+    print(json.dumps(reports, indent=2))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,110 @@
+"""
+Read-through cache for backend read endpoints.
+
+Entries are keyed by (endpoint, battle_id), expire after a per-endpoint TTL
+and are evicted least-recently-used beyond `max_entries`. Concurrent misses
+for the same key share one in-flight fetch, and every entry of a battle can
+be dropped at once when the bot sees a vote or a close for it. If the caller
+running the shared fetch is cancelled, the callers waiting on it fetch again.
+"""
+import asyncio
+import logging
+import time
+from collections import OrderedDict
+
+logger = logging.getLogger(__name__)
+
+
+class ResponseCache:
+    """Keyed async TTL/LRU cache with request coalescing."""
+
+    def __init__(self, ttls, max_entries=1024, clock=time.monotonic):
+        self.ttls = ttls
+        self.max_entries = max_entries
+        self.clock = clock
+
+        self.hits = 0
+        self.misses = 0
+        self.coalesced = 0
+        self.invalidations = 0
+
+        self._entries = OrderedDict()
+        self._by_battle = {}
+        self._in_flight = {}
+
+    async def get(self, endpoint, battle_id, fetch):
+        """Returns the cached value, or awaits `fetch()` and caches its result.
+
+        `fetch` returns (value, cacheable); uncacheable values (e.g. errors)
+        are handed back without being stored.
+        """
+        key = (endpoint, str(battle_id))
+        entry = self._entries.get(key)
+        if entry is not None and entry[0] > self.clock():
+            self.hits += 1
+            self._entries.move_to_end(key)
+            return entry[1]
+
+        future = self._in_flight.get(key)
+        if future is not None:
+            self.coalesced += 1
+            try:
+                return await asyncio.shield(future)
+            except asyncio.CancelledError:
+                if not future.cancelled() or asyncio.current_task().cancelling():
+                    raise
+            # The caller running the fetch was cancelled, this one was not
+            return await self.get(endpoint, battle_id, fetch)
+
+        self.misses += 1
+        future = asyncio.get_running_loop().create_future()
+        self._in_flight[key] = future
+        try:
+            value, cacheable = await fetch()
+        except Exception as e:
+            future.set_exception(e)
+            # Waiters re-raise it; mark it retrieved in case there are none
+            future.exception()
+            raise
+        else:
+            future.set_result(value)
+            if cacheable and self._in_flight.get(key) is future:
+                self._store(key, value)
+            return value
+        finally:
+            if not future.done():
+                # Cancelled: wake the waiters rather than leave them hanging
+                future.cancel()
+            if self._in_flight.get(key) is future:
+                del self._in_flight[key]
+
+    def invalidate(self, battle_id):
+        """Drops every cached response for a battle."""
+        battle_id = str(battle_id)
+        for key in self._by_battle.pop(battle_id, ()):
+            self._entries.pop(key, None)
+        # A fetch started before the change must not repopulate the cache
+        for key in [key for key in self._in_flight if key[1] == battle_id]:
+            del self._in_flight[key]
+        self.invalidations += 1
+
+    def stats(self):
+        return {
+            "entries": len(self._entries),
+            "hits": self.hits,
+            "misses": self.misses,
+            "coalesced": self.coalesced,
+            "invalidations": self.invalidations,
+        }
+
+    def _store(self, key, value):
+        self._entries[key] = (self.clock() + self.ttls.get(key[0], 0), value)
+        self._entries.move_to_end(key)
+        self._by_battle.setdefault(key[1], set()).add(key)
+        while len(self._entries) > self.max_entries:
+            evicted, _ = self._entries.popitem(last=False)
+            keys = self._by_battle.get(evicted[1])
+            if keys is not None:
+                keys.discard(evicted)
+                if not keys:
+                    del self._by_battle[evicted[1]]
@@ -0,0 +1,377 @@
+"""
+Multi-process mode: one front process receives Telegram's webhook calls
+and hands each update to one of N worker processes, each running the bot's
+`Application` for its share of the chats.
+
+Updates are assigned by consistent hashing of their chat id (the user id
+when there is no chat). A chat therefore always goes to the same worker, so
+its updates stay in order and its in-memory state (battle sessions, vote
+dedup, debounced keyboard edits) lives in one process. Changing the number
+of workers moves only about 1/N of the chats. The front parses the JSON just
+far enough to find the chat. Building `Update` objects, the handlers,
+keyboards and logging all run in the workers.
+
+Front and workers talk over local TCP with length-prefixed frames:
+
+    length:u32 | kind:u8 | body
+
+    update  the webhook request body, as Telegram sent it
+    event   a side channel event (JSON), sent to every worker
+
+Wallets are the state every worker reads, so sharded mode keeps them in
+SQLite, which all the workers open.
+"""
+import asyncio
+import bisect
+import hashlib
+import json
+import logging
+import os
+import signal
+
+from telegram import Update
+
+from side_channel import HEADER
+
+logger = logging.getLogger(__name__)
+
+KIND_UPDATE = 1
+KIND_EVENT = 2
+
+# Telegram updates are far smaller; anything bigger is treated as a broken stream
+MAX_UPDATE_SIZE = 1 << 20
+
+
+def _hash(text):
+    return int.from_bytes(hashlib.blake2b(text.encode(), digest_size=8).digest(), "big")
+
+
+class HashRing:
+    """Consistent hashing of keys onto nodes, with `replicas` points per node."""
+
+    def __init__(self, nodes, replicas=100):
+        points = sorted((_hash(f"{node}#{replica}"), node) for node in nodes for replica in range(replicas))
+        self._hashes = [point for point, _ in points]
+        self._nodes = [node for _, node in points]
+
+    def node_for(self, key):
+        index = bisect.bisect(self._hashes, _hash(str(key)))
+        return self._nodes[index % len(self._nodes)]
+
+
+def shard_key(update):
+    """The chat id of a raw update (a dict), else its user id, else its update id."""
+    for name, payload in update.items():
+        if name == "update_id" or not isinstance(payload, dict):
+            continue
+        # Messages and member updates carry a chat; button presses carry the message they belong to
+        chat = payload.get("chat") or (payload.get("message") or {}).get("chat")
+        if chat:
+            return chat["id"]
+        user = payload.get("from") or payload.get("user")
+        if user:
+            return user["id"]
+    return update.get("update_id")
+
+
+def pack_frame(kind, body):
+    return HEADER.pack(len(body) + 1) + bytes((kind,)) + body
+
+
+async def read_frame(reader):
+    """Reads one (kind, body) frame, returning None once the peer closes the connection."""
+    try:
+        header = await reader.readexactly(HEADER.size)
+    except asyncio.IncompleteReadError:
+        return None
+    (length,) = HEADER.unpack(header)
+    if not 0 < length <= MAX_UPDATE_SIZE + 1:
+        raise ValueError(f"Invalid frame length {length}")
+    body = await reader.readexactly(length)
+    return body[0], body[1:]
+
+
+class WorkerLink:
+    """The front's connection to one worker, reopened after a failure."""
+
+    def __init__(self, host, port, connect_timeout=30.0):
+        self.host = host
+        self.port = port
+        # Workers take a few seconds to start; connecting is retried for this long
+        self.connect_timeout = connect_timeout
+        self.sent = 0
+        self._writer = None
+        self._lock = asyncio.Lock()
+
+    async def send(self, frame, timeout=None):
+        """Writes one frame.
+
+        While the worker is not reading (its update queue is full), waits for it
+        to take the frames sent before, for at most `timeout` seconds (None: as
+        long as it takes) before raising TimeoutError, an OSError. Nothing is
+        written then.
+        """
+        async with asyncio.timeout(timeout):
+            await self._lock.acquire()
+        try:
+            if self._writer is None or self._writer.is_closing():
+                self._writer = await self._connect()
+            try:
+                async with asyncio.timeout(timeout):
+                    await self._writer.drain()
+                self._writer.write(frame)
+            except ConnectionError:
+                self._writer.close()
+                self._writer = None
+                raise
+            self.sent += 1
+        finally:
+            self._lock.release()
+
+    async def close(self):
+        if self._writer is not None:
+            self._writer.close()
+            try:
+                await self._writer.wait_closed()
+            except ConnectionError:
+                pass
+            self._writer = None
+
+    async def _connect(self):
+        loop = asyncio.get_running_loop()
+        deadline = loop.time() + self.connect_timeout
+        while True:
+            try:
+                _, writer = await asyncio.open_connection(self.host, self.port)
+                return writer
+            except OSError:
+                if loop.time() >= deadline:
+                    raise
+                await asyncio.sleep(0.2)
+
+
+class ShardFront:
+    """Webhook endpoint that forwards each update to the worker owning its chat.
+
+    Telegram gets its 200 once the update is handed to the worker, and a 503
+    (so it delivers the update again later) when the worker cannot be
+    reached or has not taken its earlier updates within `forward_timeout`
+    seconds. The bound keeps one backed-up worker from tying up the
+    connections Telegram delivers the other workers' updates on.
+    """
+
+    def __init__(self, workers, host="0.0.0.0", port=8443, path="telegram", secret_token=None, forward_timeout=None):
+        self.forward_timeout = forward_timeout
+        self.links = [WorkerLink(worker_host, worker_port) for worker_host, worker_port in workers]
+        self.ring = HashRing(range(len(self.links)))
+        self.host = host
+        self.port = port
+        self.path = "/" + path.strip("/")
+        self.secret_token = secret_token
+        self.received = 0
+        self.rejected = 0
+        self.failed = 0
+        self._server = None
+
+    async def start(self):
+        self._server = await asyncio.start_server(self._handle, self.host, self.port)
+        logger.info(f"Webhook front listening on {self.host}:{self.port}{self.path} for {len(self.links)} workers")
+
+    async def stop(self):
+        if self._server is not None:
+            self._server.close()
+            await self._server.wait_closed()
+            self._server = None
+        for link in self.links:
+            await link.close()
+
+    async def forward(self, body):
+        """Sends one update (the raw JSON body) to its worker; returns the worker's index."""
+        update = json.loads(body)
+        if not isinstance(update, dict):
+            raise ValueError("An update must be a JSON object")
+        index = self.ring.node_for(shard_key(update))
+        await self.links[index].send(pack_frame(KIND_UPDATE, body), self.forward_timeout)
+        self.received += 1
+        return index
+
+    async def broadcast(self, event):
+        """Sends a side channel event to every worker."""
+        frame = pack_frame(KIND_EVENT, json.dumps(event).encode())
+        for index, link in enumerate(self.links):
+            try:
+                await link.send(frame, self.forward_timeout)
+            except OSError as e:
+                logger.error(f"Could not pass {event.get('type')} to worker {index}: {e!r}")
+
+    def stats(self):
+        stats = {"received": self.received, "rejected": self.rejected, "failed": self.failed}
+        for index, link in enumerate(self.links):
+            stats[f"worker_{index}"] = link.sent
+        return stats
+
+    async def _handle(self, reader, writer):
+        try:
+            while True:
+                request_line = await reader.readline()
+                if not request_line:
+                    break
+                headers = {}
+                while True:
+                    line = await reader.readline()
+                    if line in (b"\r\n", b"\n", b""):
+                        break
+                    name, _, value = line.decode("latin-1").partition(":")
+                    headers[name.strip().lower()] = value.strip()
+                length = int(headers.get("content-length", 0))
+                if length > MAX_UPDATE_SIZE:
+                    writer.write(b"HTTP/1.1 413 Payload Too Large\r\nContent-Length: 0\r\nConnection: close\r\n\r\n")
+                    break
+                body = await reader.readexactly(length)
+                writer.write(await self._respond(request_line, headers, body))
+                await writer.drain()
+                if headers.get("connection", "").lower() == "close":
+                    break
+        except (ConnectionError, asyncio.IncompleteReadError, ValueError):
+            pass
+        finally:
+            writer.close()
+
+    async def _respond(self, request_line, headers, body):
+        parts = request_line.decode("latin-1").split()
+        if len(parts) < 2 or parts[0] != "POST" or parts[1].split("?")[0] != self.path:
+            status = "404 Not Found"
+        elif self.secret_token and headers.get("x-telegram-bot-api-secret-token") != self.secret_token:
+            self.rejected += 1
+            status = "403 Forbidden"
+        else:
+            try:
+                await self.forward(body)
+                status = "200 OK"
+            except ValueError:
+                self.rejected += 1
+                status = "400 Bad Request"
+            except OSError as e:
+                self.failed += 1
+                logger.warning(f"Could not forward an update: {e!r}")
+                status = "503 Service Unavailable"
+        return f"HTTP/1.1 {status}\r\nContent-Length: 0\r\n\r\n".encode()
+
+
+class ShardReceiver:
+    """Worker end of the front's connection: updates go to `submit`, events to `dispatch`."""
+
+    def __init__(self, host, port, bot, submit, dispatch):
+        self.host = host
+        self.port = port
+        self.bot = bot
+        # Usually `application.update_queue.put`: a full queue stops the reads and makes the front wait
+        self.submit = submit
+        self.dispatch = dispatch
+        self.updates = 0
+        self.events = 0
+        self._server = None
+        self._connections = {}
+
+    async def start(self):
+        self._server = await asyncio.start_server(self._handle, self.host, self.port)
+        logger.info(f"Shard worker listening on {self.host}:{self.port}")
+
+    async def stop(self):
+        if self._server is not None:
+            self._server.close()
+            # Closing the connections ends their reads; the frames already read are submitted first
+            for writer in self._connections.values():
+                writer.close()
+            await asyncio.gather(*self._connections, return_exceptions=True)
+            await self._server.wait_closed()
+            self._server = None
+
+    async def _handle(self, reader, writer):
+        self._connections[asyncio.current_task()] = writer
+        try:
+            while True:
+                frame = await read_frame(reader)
+                if frame is None:
+                    break
+                kind, body = frame
+                try:
+                    data = json.loads(body)
+                except ValueError as e:
+                    logger.warning(f"Dropping malformed frame from the front: {e}")
+                    continue
+                if kind == KIND_UPDATE:
+                    self.updates += 1
+                    await self.submit(Update.de_json(data, self.bot))
+                elif kind == KIND_EVENT:
+                    self.events += 1
+                    await self.dispatch(data)
+                else:
+                    logger.warning(f"Dropping frame of unknown kind {kind}")
+        except (ConnectionError, asyncio.IncompleteReadError, ValueError) as e:
+            logger.warning(f"Connection from the front dropped: {e}")
+        finally:
+            del self._connections[asyncio.current_task()]
+            writer.close()
+
+
+class WorkerProcesses:
+    """Runs `command` once per worker and restarts workers that exit.
+
+    Worker `index` gets the current environment plus `environment(index)`.
+    """
+
+    def __init__(self, command, count, environment, restart_delay=1.0):
+        self.command = command
+        self.count = count
+        self.environment = environment
+        self.restart_delay = restart_delay
+        self.restarts = 0
+        self._processes = {}
+        self._tasks = []
+        self._stopping = False
+
+    async def start(self):
+        self._tasks = [asyncio.create_task(self._supervise(index)) for index in range(self.count)]
+
+    async def stop(self, timeout=10.0):
+        self._stopping = True
+        for process in self._processes.values():
+            if process.returncode is None:
+                process.terminate()
+        try:
+            await asyncio.wait_for(asyncio.gather(*self._tasks, return_exceptions=True), timeout)
+        except asyncio.TimeoutError:
+            for process in self._processes.values():
+                if process.returncode is None:
+                    process.kill()
+            await asyncio.gather(*self._tasks, return_exceptions=True)
+
+    async def _supervise(self, index):
+        environment = {**os.environ, **self.environment(index)}
+        while True:
+            # A session of its own keeps Ctrl-C away from the workers: the front stops them in order
+            process = self._processes[index] = await asyncio.create_subprocess_exec(
+                *self.command, env=environment, start_new_session=True
+            )
+            returncode = await process.wait()
+            if self._stopping:
+                return
+            self.restarts += 1
+            logger.error(f"Worker {index} exited with status {returncode}, restarting")
+            await asyncio.sleep(self.restart_delay)
+            if self._stopping:
+                return
+
+
+async def wait_for_signal(signals=(signal.SIGINT, signal.SIGTERM)):
+    """Returns once the process receives one of `signals`."""
+    received = asyncio.Event()
+    loop = asyncio.get_running_loop()
+    for signum in signals:
+        loop.add_signal_handler(signum, received.set)
+    try:
+        await received.wait()
+    finally:
+        for signum in signals:
+            loop.remove_signal_handler(signum)
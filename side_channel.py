@@ -0,0 +1,108 @@
+"""
+Asyncio side channel the backend uses to push battle events into the bot.
+
+Protocol: every frame is a 4-byte big-endian length followed by a UTF-8
+JSON object with a "type" key, e.g.
+
+    {"type": "vote_recorded", "battleId": 3, "trackNumber": 1, "userAddress": "0x..."}
+    {"type": "battle_closed", "battleId": 3}
+
+The server answers every frame with {"ok": true} or {"ok": false, "error": ...}.
+A connection may send any number of frames.
+"""
+import asyncio
+import json
+import logging
+import struct
+
+logger = logging.getLogger(__name__)
+
+HEADER = struct.Struct(">I")
+MAX_FRAME_SIZE = 64 * 1024
+
+# Event types the backend is expected to send
+BATTLE_CLOSED = "battle_closed"
+VOTE_RECORDED = "vote_recorded"
+
+
+def encode_frame(message):
+    """Encodes a JSON-serializable object as one length-prefixed frame."""
+    body = json.dumps(message).encode("utf-8")
+    return HEADER.pack(len(body)) + body
+
+
+async def read_frame(reader):
+    """Reads one frame, returning None once the peer closes the connection."""
+    try:
+        header = await reader.readexactly(HEADER.size)
+    except asyncio.IncompleteReadError:
+        return None
+    (length,) = HEADER.unpack(header)
+    if length > MAX_FRAME_SIZE:
+        raise ValueError(f"Frame of {length} bytes exceeds the {MAX_FRAME_SIZE} byte limit")
+    body = await reader.readexactly(length)
+    return json.loads(body)
+
+
+class SideChannelServer:
+    """Accepts many concurrent backend connections and dispatches their events."""
+
+    def __init__(self, host="localhost", port=9999):
+        self.host = host
+        self.port = port
+        self.connections = 0
+        self.events_received = 0
+        self._handlers = {}
+        self._server = None
+
+    def on(self, event_type, callback):
+        """Registers an async callback for an event type."""
+        self._handlers.setdefault(event_type, []).append(callback)
+
+    async def start(self):
+        self._server = await asyncio.start_server(self._handle_connection, self.host, self.port)
+        logger.info(f"Side channel listening on {self.host}:{self.port}")
+
+    async def stop(self):
+        if self._server is not None:
+            self._server.close()
+            await self._server.wait_closed()
+            self._server = None
+
+    async def dispatch(self, event):
+        """Runs every callback registered for the event's type."""
+        self.events_received += 1
+        for callback in self._handlers.get(event.get("type"), []):
+            try:
+                await callback(event)
+            except Exception as e:
+                logger.error(f"Side channel handler failed for {event.get('type')}: {e}")
+
+    async def _handle_connection(self, reader, writer):
+        self.connections += 1
+        peer = writer.get_extra_info("peername")
+        try:
+            while True:
+                try:
+                    event = await read_frame(reader)
+                except (ValueError, asyncio.IncompleteReadError) as e:
+                    logger.warning(f"Dropping side channel connection from {peer}: {e}")
+                    writer.write(encode_frame({"ok": False, "error": str(e)}))
+                    break
+                if event is None:
+                    break
+                if not isinstance(event, dict) or "type" not in event:
+                    writer.write(encode_frame({"ok": False, "error": "Missing event type"}))
+                else:
+                    await self.dispatch(event)
+                    writer.write(encode_frame({"ok": True}))
+                await writer.drain()
+        except ConnectionError:
+            pass
+        finally:
+            self.connections -= 1
+            writer.close()
+            try:
+                await writer.wait_closed()
+            except ConnectionError:
+                pass
@@ -0,0 +1,314 @@
+"""
+Async client for the Spotify Web API searches the bot makes.
+
+Replaces spotipy, whose blocking calls had to run in threads and which
+requested a new client-credentials token inside whichever search found the
+old one expired. Here:
+
+- one pooled httpx session serves every request;
+- a background task renews the access token `refresh_margin` seconds
+  before it expires, so searches do not wait for it;
+- `search_tracks()` fetches the first page, then the rest concurrently;
+- every request takes a slot from one shared token bucket, and a 429
+  pauses that bucket for the Retry-After Spotify sent, so all concurrent
+  requests back off together before the request is retried.
+
+Run `python spotify_client.py bench` to compare genre refills against the
+FakeSpotify server of stubs.py with spotipy in threads, as the bot used to
+make them, and with this client.
+"""
+import argparse
+import asyncio
+import functools
+import json
+import logging
+import time
+
+import httpx
+
+from circuit_breaker import is_outage
+from outbound import TokenBucket
+
+logger = logging.getLogger(__name__)
+
+API_URL = "https://api.spotify.com/v1"
+TOKEN_URL = "https://accounts.spotify.com/api/token"
+
+# Spotify caps search results at 50 per page, and offset + limit at 1000
+PAGE_SIZE = 50
+MAX_RESULTS = 1000
+
+# Used when a 429 comes without a Retry-After header in seconds
+DEFAULT_RETRY_AFTER = 1.0
+
+
+def retry_after_seconds(value):
+    """The delay of a Retry-After header; DEFAULT_RETRY_AFTER if it is missing or an HTTP date."""
+    try:
+        return float(value)
+    except (TypeError, ValueError):
+        return DEFAULT_RETRY_AFTER
+
+
+class SpotifyError(Exception):
+    """A Spotify API or token request that failed."""
+
+    def __init__(self, status_code, message):
+        super().__init__(f"Spotify returned HTTP {status_code}: {message}")
+        self.status_code = status_code
+
+
+class SpotifyClient:
+    """Client-credentials Spotify client sharing one session, token and rate limit."""
+
+    def __init__(
+        self,
+        client_id,
+        client_secret,
+        api_url=API_URL,
+        token_url=TOKEN_URL,
+        rate=10.0,
+        burst=10,
+        max_concurrency=4,
+        max_retries=3,
+        refresh_margin=300,
+        retry_interval=10.0,
+        timeout=10.0,
+        pool_size=10,
+        breaker=None,
+        clock=time.monotonic,
+        sleep=asyncio.sleep,
+    ):
+        self.client_id = client_id
+        self.client_secret = client_secret
+        self.api_url = api_url.rstrip("/")
+        self.token_url = token_url
+        self.max_retries = max_retries
+        self.refresh_margin = refresh_margin
+        # Wait between attempts when a background token refresh fails
+        self.retry_interval = retry_interval
+        self.timeout = timeout
+        # API calls go through the breaker; its adaptive timeout is capped at `timeout`
+        self.breaker = breaker
+        self.clock = clock
+        self.sleep = sleep
+        self._limits = httpx.Limits(max_connections=pool_size, max_keepalive_connections=pool_size)
+        self._client = None
+        self._bucket = TokenBucket(rate, burst, clock())
+        self._concurrency = asyncio.Semaphore(max_concurrency)
+        self._token = None
+        self._token_lifetime = 0.0
+        self._token_expires_at = 0.0
+        self._token_lock = asyncio.Lock()
+        self._refresh_task = None
+
+        self.requests = 0
+        self.throttled = 0
+        self.token_refreshes = 0
+        self.errors = 0
+
+    @property
+    def client(self):
+        """The underlying session, created on first use so it binds to the running loop."""
+        if self._client is None or self._client.is_closed:
+            self._client = httpx.AsyncClient(limits=self._limits, timeout=self.timeout)
+        return self._client
+
+    def start(self):
+        """Starts renewing the access token in the background."""
+        if self._refresh_task is None:
+            self._refresh_task = asyncio.create_task(self._refresh_loop())
+
+    async def close(self):
+        if self._refresh_task is not None:
+            self._refresh_task.cancel()
+            try:
+                await self._refresh_task
+            except asyncio.CancelledError:
+                pass
+            self._refresh_task = None
+        if self._client is not None and not self._client.is_closed:
+            await self._client.aclose()
+        self._client = None
+
+    def stats(self):
+        return {
+            "requests": self.requests,
+            "throttled": self.throttled,
+            "token_refreshes": self.token_refreshes,
+            "errors": self.errors,
+        }
+
+    async def search(self, q, type="track", limit=10, offset=0):
+        """One page of /search results, as Spotify returns them."""
+        return await self._request("/search", {"q": q, "type": type, "limit": limit, "offset": offset})
+
+    async def search_tracks(self, query, total, page_size=PAGE_SIZE):
+        """Up to `total` tracks matching `query`; pages after the first are fetched concurrently."""
+        total = min(total, MAX_RESULTS)
+        first = (await self.search(query, limit=min(page_size, total)))["tracks"]
+        available = min(total, first["total"])
+        pages = await asyncio.gather(*(
+            self.search(query, limit=min(page_size, available - offset), offset=offset)
+            for offset in range(len(first["items"]), available, page_size)
+        ))
+        items = first["items"] + [item for page in pages for item in page["tracks"]["items"]]
+        # Spotify occasionally returns null entries
+        return [item for item in items if item]
+
+    async def _request(self, path, params):
+        for attempt in range(self.max_retries + 1):
+            async with self._concurrency:
+                await self._wait_for_slot()
+                token = await self._access_token()
+
+                async def send(timeout):
+                    return await self.client.get(
+                        self.api_url + path, params=params, headers={"Authorization": f"Bearer {token}"},
+                        timeout=timeout,
+                    )
+
+                if self.breaker is None:
+                    response = await send(self.timeout)
+                else:
+                    response = await self.breaker.call(send, is_failure=is_outage)
+            self.requests += 1
+
+            if attempt < self.max_retries:
+                if response.status_code == 429:
+                    self.throttled += 1
+                    retry_after = retry_after_seconds(response.headers.get("Retry-After"))
+                    logger.warning(f"Spotify rate limit hit, pausing requests for {retry_after:.0f}s")
+                    self._bucket.pause(self.clock() + retry_after)
+                    continue
+                if response.status_code == 401:
+                    # The token was revoked or expired early
+                    self._token = None
+                    continue
+            if response.status_code != 200:
+                self.errors += 1
+                raise SpotifyError(response.status_code, response.text)
+            return response.json()
+
+    async def _wait_for_slot(self):
+        while True:
+            delay = self._bucket.delay(self.clock())
+            if delay <= 0:
+                self._bucket.take()
+                return
+            await self.sleep(delay)
+
+    async def _access_token(self):
+        if self._token is None or self.clock() >= self._token_expires_at:
+            # Requests arriving while the token is renewed wait for that one request
+            async with self._token_lock:
+                if self._token is None or self.clock() >= self._token_expires_at:
+                    await self._fetch_token()
+        return self._token
+
+    async def _fetch_token(self):
+        response = await self.client.post(
+            self.token_url, data={"grant_type": "client_credentials"}, auth=(self.client_id, self.client_secret)
+        )
+        if response.status_code != 200:
+            raise SpotifyError(response.status_code, response.text)
+        data = response.json()
+        self._token = data["access_token"]
+        self._token_lifetime = data.get("expires_in", 3600)
+        self._token_expires_at = self.clock() + self._token_lifetime
+        self.token_refreshes += 1
+
+    async def _refresh_loop(self):
+        while True:
+            # Tokens shorter-lived than twice the margin are renewed halfway through
+            margin = min(self.refresh_margin, self._token_lifetime / 2)
+            delay = self._token_expires_at - margin - self.clock()
+            if delay > 0:
+                await self.sleep(delay)
+            try:
+                async with self._token_lock:
+                    await self._fetch_token()
+            except Exception as e:
+                # Requests fall back to fetching the token themselves once it expires
+                logger.error(f"Failed to refresh the Spotify token: {e}")
+                await self.sleep(self.retry_interval)
+
+
+def _spotipy_client(url):
+    """A spotipy client, configured as the bot's was, pointed at a FakeSpotify server."""
+    from spotipy import Spotify
+    from spotipy.cache_handler import MemoryCacheHandler
+    from spotipy.oauth2 import SpotifyClientCredentials
+
+    class Credentials(SpotifyClientCredentials):
+        OAUTH_TOKEN_URL = url + "/api/token"
+
+    client = Spotify(auth_manager=Credentials("bench", "secret", cache_handler=MemoryCacheHandler()), retries=0)
+    client.prefix = url + "/v1/"
+    return client
+
+
+async def _spotipy_tracks(client, genre, total):
+    """The bot's former fetch: one page after the other, each blocking call in a thread."""
+    tracks = []
+    while len(tracks) < total:
+        limit = min(PAGE_SIZE, total - len(tracks))
+        search = functools.partial(client.search, q=f"genre:{genre}", type="track", limit=limit, offset=len(tracks))
+        items = [item for item in (await asyncio.to_thread(search))["tracks"]["items"] if item]
+        tracks.extend(items)
+        if len(items) < limit:
+            break
+    return tracks
+
+
+async def _time_refills(fetch, genres, tracks):
+    """Milliseconds for one genre's pool, then for all `genres` refilled at once."""
+    # Both clients hold a token before the timing starts
+    await fetch(genres[0], 1)
+    started = time.perf_counter()
+    assert len(await fetch(genres[0], tracks)) == tracks
+    refill_s = time.perf_counter() - started
+    started = time.perf_counter()
+    await asyncio.gather(*(fetch(genre, tracks) for genre in genres))
+    warm_s = time.perf_counter() - started
+    return {"refill_ms": round(refill_s * 1000, 1), f"warm_{len(genres)}_genres_ms": round(warm_s * 1000, 1)}
+
+
+async def benchmark(genres, tracks, latency, token_ttl):
+    """Times genre refills through spotipy in threads and through SpotifyClient against FakeSpotify."""
+    from stubs import FakeSpotify
+
+    spotify = FakeSpotify(latency=latency, token_ttl=token_ttl)
+    await spotify.start()
+    names = [f"genre {index}" for index in range(genres)]
+    try:
+        before = await _time_refills(functools.partial(_spotipy_tracks, _spotipy_client(spotify.url)), names, tracks)
+        client = SpotifyClient("bench", "secret", api_url=spotify.url + "/v1", token_url=spotify.url + "/api/token",
+                               rate=100.0, burst=100)
+        client.start()
+        try:
+            after = await _time_refills(client.search_tracks, names, tracks)
+        finally:
+            await client.close()
+    finally:
+        await spotify.stop()
+    return {
+        "genres": genres,
+        "tracks_per_genre": tracks,
+        "spotify_latency_ms": latency * 1000,
+        "before": before,
+        "after": after,
+    }
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Spotify client maintenance")
+    subcommands = parser.add_subparsers(dest="command", required=True)
+    bench = subcommands.add_parser("bench", help="Compare spotipy in threads with the async client")
+    bench.add_argument("--genres", type=int, default=4, help="genres refilled at once")
+    bench.add_argument("--tracks", type=int, default=200, help="tracks per genre pool")
+    bench.add_argument("--latency-ms", type=float, default=50.0, help="FakeSpotify response time")
+    bench.add_argument("--token-ttl", type=int, default=3600, help="FakeSpotify token lifetime in seconds")
+    args = parser.parse_args()
+
+    print(json.dumps(asyncio.run(benchmark(args.genres, args.tracks, args.latency_ms / 1000, args.token_ttl)), indent=2))
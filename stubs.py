@@ -0,0 +1,358 @@
+"""
+Local stand-ins for the services the bot talks to, shared by loadtest.py,
+the tests and the benchmark subcommands:
+
+- `FakeTelegramRequest`: a `BaseRequest` answering every Bot API call
+  in-process;
+- `FakeBotApi`: the same answers from an HTTP server, which also hands out
+  pushed updates through long-polled getUpdates;
+- `StubBackend`: an HTTP server on 127.0.0.1 implementing the app.js
+  endpoints bot.py calls, with configurable latency and injected outages;
+- `FakeSpotify`: an HTTP server with the Spotify token and search endpoints
+  `SpotifyClient` calls.
+"""
+import asyncio
+import itertools
+import json
+import random
+import re
+import time
+from collections import Counter, defaultdict
+from http import HTTPStatus
+from urllib.parse import parse_qs, urlsplit
+
+from telegram.request import BaseRequest
+
+
+class FakeTelegramRequest(BaseRequest):
+    """Answers Bot API calls locally, as Telegram would for a successful call."""
+
+    def __init__(self, latency=0.0):
+        self.latency = latency
+        self.calls = Counter()
+        self._message_ids = itertools.count(1000)
+
+    @property
+    def read_timeout(self):
+        return None
+
+    async def initialize(self):
+        pass
+
+    async def shutdown(self):
+        pass
+
+    async def do_request(self, url, method, request_data=None, read_timeout=None, write_timeout=None,
+                         connect_timeout=None, pool_timeout=None):
+        endpoint = url.rsplit("/", 1)[-1]
+        self.calls[endpoint] += 1
+        if self.latency:
+            await asyncio.sleep(self.latency)
+        parameters = request_data.parameters if request_data is not None else {}
+        result = bot_api_result(endpoint, parameters, self._message_ids)
+        return 200, json.dumps({"ok": True, "result": result}).encode()
+
+
+def bot_api_result(endpoint, parameters, message_ids):
+    """The result Telegram gives for a successful call of `endpoint`."""
+    if endpoint == "getMe":
+        return {"id": 1, "is_bot": True, "first_name": "Load test", "username": "loadtest_bot"}
+    if endpoint in ("sendMessage", "editMessageText", "editMessageReplyMarkup"):
+        chat_id = int(parameters.get("chat_id", 0))
+        return {
+            "message_id": int(parameters.get("message_id") or next(message_ids)),
+            "date": int(time.time()),
+            "chat": {"id": chat_id, "type": "private" if chat_id > 0 else "group"},
+            "text": parameters.get("text", ""),
+        }
+    return True
+
+
+class StubServer:
+    """Minimal keep-alive HTTP/1.1 server on 127.0.0.1 answering with JSON.
+
+    Subclasses implement `_dispatch(method, target, headers, body)`, returning
+    (status, payload) or (status, payload, extra headers).
+    """
+
+    def __init__(self):
+        self._server = None
+        self.url = None
+
+    async def start(self):
+        self._server = await asyncio.start_server(self._handle, "127.0.0.1", 0)
+        self.url = f"http://127.0.0.1:{self._server.sockets[0].getsockname()[1]}"
+
+    async def stop(self):
+        self._server.close()
+        await self._server.wait_closed()
+
+    async def _handle(self, reader, writer):
+        try:
+            while True:
+                request_line = await reader.readline()
+                if not request_line:
+                    break
+                headers = {}
+                while True:
+                    line = await reader.readline()
+                    if line in (b"\r\n", b"\n", b""):
+                        break
+                    name, _, value = line.decode("latin-1").partition(":")
+                    headers[name.strip().lower()] = value.strip()
+                body = await reader.readexactly(int(headers.get("content-length", 0)))
+                method, target = request_line.decode("latin-1").split()[:2]
+                status, payload, *extra = await self._dispatch(method, target, headers, body)
+                data = json.dumps(payload).encode()
+                extra_headers = "".join(f"{name}: {value}\r\n" for name, value in (extra[0] if extra else {}).items())
+                writer.write(
+                    f"HTTP/1.1 {status} {HTTPStatus(status).phrase}\r\nContent-Type: application/json\r\n"
+                    f"{extra_headers}Content-Length: {len(data)}\r\n\r\n".encode() + data
+                )
+                await writer.drain()
+        except (ConnectionError, asyncio.IncompleteReadError):
+            pass
+        finally:
+            writer.close()
+
+    async def _dispatch(self, method, target, headers, body):
+        raise NotImplementedError
+
+
+class FakeBotApi(StubServer):
+    """The Bot API over HTTP, for a bot built with base_url=f"{url}/bot".
+
+    Updates passed to `push` are returned by getUpdates, which waits up to
+    its `timeout` for one to arrive, as Telegram's long polling does. Every
+    answer is delayed by `latency`.
+    """
+
+    def __init__(self, latency=0.0):
+        super().__init__()
+        self.latency = latency
+        self.calls = Counter()
+        self._message_ids = itertools.count(1000)
+        self._updates = []
+        self._arrived = asyncio.Event()
+        self._stopping = False
+
+    async def stop(self):
+        # Answer a getUpdates still waiting, instead of leaving it to be cancelled
+        self._stopping = True
+        self._arrived.set()
+        await super().stop()
+
+    def push(self, update):
+        self._updates.append(update)
+        self._arrived.set()
+
+    async def _dispatch(self, method, target, headers, body):
+        endpoint = urlsplit(target).path.rsplit("/", 1)[-1]
+        self.calls[endpoint] += 1
+        parameters = {name: values[0] for name, values in parse_qs(body.decode()).items()}
+        if endpoint == "getUpdates":
+            result = await self.get_updates(
+                int(parameters.get("offset", 0)), float(parameters.get("timeout", 0)), int(parameters.get("limit", 100))
+            )
+        else:
+            result = bot_api_result(endpoint, parameters, self._message_ids)
+        if self.latency:
+            await asyncio.sleep(self.latency)
+        return 200, {"ok": True, "result": result}
+
+    async def get_updates(self, offset, timeout, limit):
+        # Like Telegram, asking for `offset` confirms the updates before it
+        self._updates = [update for update in self._updates if update["update_id"] >= offset]
+        if not self._updates and timeout and not self._stopping:
+            self._arrived.clear()
+            try:
+                await asyncio.wait_for(self._arrived.wait(), timeout)
+            except TimeoutError:
+                pass
+        return self._updates[:limit]
+
+
+class StubBackend(StubServer):
+    """Implements the Express endpoints used by bot.py.
+
+    Like app.js, a vote or winner request for a battle that was never
+    started (a reverted contract call) is answered 500. Outages are
+    injected with `outage` (every request answers 503 while it is set) or
+    `outage_every` (every that many requests answer 503).
+    """
+
+    ROUTES = [
+        ("POST", re.compile(r"^/startbattle$"), "start_battle"),
+        ("POST", re.compile(r"^/votetrack$"), "vote"),
+        ("POST", re.compile(r"^/votetrack/batch$"), "vote_batch"),
+        ("GET", re.compile(r"^/battle/(\d+)/votes$"), "votes"),
+        ("GET", re.compile(r"^/battle/(\d+)/details$"), "details"),
+        ("GET", re.compile(r"^/battle/(\d+)/voters$"), "voters"),
+        ("GET", re.compile(r"^/battle/(\d+)/votersList$"), "voters_list"),
+        ("GET", re.compile(r"^/battle/(\d+)/winner$"), "winner"),
+        ("GET", re.compile(r"^/leaderboard/(\d+)$"), "leaderboard"),
+        ("GET", re.compile(r"^/balance/?$"), "balance"),
+    ]
+
+    def __init__(self, latency=0.0, battle_duration=3600, outage_every=0):
+        super().__init__()
+        self.latency = latency
+        self.battle_duration = battle_duration
+        self.outage = False
+        self.outage_every = outage_every
+        self.calls = Counter()
+        self._requests = 0
+        self._battle_ids = itertools.count(1)
+        # (battle id, payment amount) of every battle started
+        self.battles = []
+        self._votes = defaultdict(lambda: [0, 0])
+        self._voters = defaultdict(dict)
+
+    async def _dispatch(self, method, target, headers, body):
+        path = target.split("?")[0]
+        body = json.loads(body) if body else None
+        for route_method, pattern, name in self.ROUTES:
+            match = pattern.match(path)
+            if match and method == route_method:
+                self.calls[name] += 1
+                self._requests += 1
+                if self.latency:
+                    await asyncio.sleep(self.latency)
+                if self.outage or (self.outage_every and self._requests % self.outage_every == 0):
+                    self.calls["outage"] += 1
+                    return 503, {"error": "Service Unavailable"}
+                return getattr(self, name)(body, *match.groups())
+        self.calls["not_found"] += 1
+        return 404, {"error": "Not found"}
+
+    def start_battle(self, body):
+        battle_id = next(self._battle_ids)
+        self.battles.append((battle_id, body["paymentAmount"]))
+        return 200, {
+            "message": f"Music Battle between {body['track1']} and {body['track2']} has started!",
+            "battleId": str(battle_id),
+            "balanceBefore": "100.0",
+            "balanceAfter": "99.9",
+            "transactionHash": f"0x{battle_id:064x}",
+            "endTime": str(int(time.time() + self.battle_duration)),
+        }
+
+    def vote(self, body):
+        if body.get("trackNumber") not in (1, 2) or not body.get("userAddress"):
+            return 400, {"errors": [{"msg": "Track number must be 1 or 2"}]}
+        battle_id, voter = int(body["battleId"]), body["userAddress"]
+        if not self._started(battle_id):
+            return 500, {"error": "Failed to register vote"}
+        if voter in self._voters[battle_id]:
+            return 200, {"message": "You have already voted in this battle."}
+        self._voters[battle_id][voter] = body["trackNumber"]
+        self._votes[battle_id][body["trackNumber"] - 1] += 1
+        return 200, {"message": "Vote recorded", "transactionHash": f"0x{random.getrandbits(256):064x}"}
+
+    def vote_batch(self, body):
+        if not isinstance(body.get("votes"), list):
+            return 400, {"errors": [{"msg": "votes must be an array"}]}
+        results = []
+        for vote in body["votes"]:
+            status, data = self.vote(vote)
+            results.append({"status": status, "body": data})
+        return 200, {"results": results}
+
+    def votes(self, body, battle_id):
+        track1, track2 = self._votes[int(battle_id)]
+        return 200, {"battleId": int(battle_id), "track1Votes": track1, "track2Votes": track2}
+
+    def details(self, body, battle_id):
+        track1, track2 = self._votes[int(battle_id)]
+        return 200, {
+            "battleId": int(battle_id), "track1": "Track A", "track2": "Track B",
+            "votesTrack1": track1, "votesTrack2": track2, "timestamp": int(time.time()), "isActive": True,
+        }
+
+    def voters(self, body, battle_id):
+        return 200, {"battleId": int(battle_id), "totalVoters": len(self._voters[int(battle_id)])}
+
+    def voters_list(self, body, battle_id):
+        return 200, {"battleId": int(battle_id), "votersList": list(self._voters[int(battle_id)])}
+
+    def winner(self, body, battle_id):
+        if not self._started(int(battle_id)):
+            return 500, {"error": "Failed to retrieve battle winner"}
+        voters = self._voters[int(battle_id)]
+        track1, track2 = self._votes[int(battle_id)]
+        winner = 1 if track1 >= track2 else 2
+        return 200, {
+            "battleId": int(battle_id),
+            "part1": f"Track {winner} is the winner",
+            "winnerVotersList": [voter for voter, track in voters.items() if track == winner],
+            "resultMessage": "Balance sheet",
+        }
+
+    def leaderboard(self, body, battle_id):
+        track1, track2 = self._votes[int(battle_id)]
+        return 200, {"leaderboard": [{"track": "Track A", "votes": track1}, {"track": "Track B", "votes": track2}]}
+
+    def balance(self, body):
+        return 200, {"balance": "1000.0"}
+
+    def _started(self, battle_id):
+        return 0 < battle_id <= len(self.battles)
+
+
+class FakeSpotify(StubServer):
+    """The Spotify accounts and Web API endpoints used by `SpotifyClient`.
+
+    Tokens expire after `token_ttl` seconds; with `throttle_every` set, every
+    that many searches one is answered 429 with `retry_after`.
+    """
+
+    def __init__(self, latency=0.0, catalogue_size=1000, token_ttl=3600, throttle_every=0, retry_after=1):
+        super().__init__()
+        self.latency = latency
+        self.catalogue_size = catalogue_size
+        self.token_ttl = token_ttl
+        self.throttle_every = throttle_every
+        self.retry_after = retry_after
+        self.calls = Counter()
+        self._tokens = {}
+        self._token_ids = itertools.count(1)
+
+    async def _dispatch(self, method, target, headers, body):
+        url = urlsplit(target)
+        if method == "POST" and url.path == "/api/token":
+            self.calls["token"] += 1
+            token = f"token-{next(self._token_ids)}"
+            self._tokens[token] = time.monotonic() + self.token_ttl
+            return 200, {"access_token": token, "token_type": "Bearer", "expires_in": self.token_ttl}
+        if method != "GET" or url.path != "/v1/search":
+            self.calls["not_found"] += 1
+            return 404, {"error": {"status": 404, "message": "Not found"}}
+
+        token = headers.get("authorization", "").removeprefix("Bearer ")
+        if self._tokens.get(token, 0) <= time.monotonic():
+            self.calls["unauthorized"] += 1
+            return 401, {"error": {"status": 401, "message": "The access token expired"}}
+        self.calls["search"] += 1
+        if self.throttle_every and self.calls["search"] % self.throttle_every == 0:
+            self.calls["throttled"] += 1
+            return 429, {"error": {"status": 429, "message": "API rate limit exceeded"}}, {
+                "Retry-After": self.retry_after
+            }
+        if self.latency:
+            await asyncio.sleep(self.latency)
+        query = {name: values[0] for name, values in parse_qs(url.query).items()}
+        return 200, self.search(query["q"], int(query.get("limit", 10)), int(query.get("offset", 0)))
+
+    def search(self, q, limit, offset):
+        genre = q.split(":", 1)[-1]
+        end = min(offset + limit, self.catalogue_size)
+        items = [
+            {
+                "id": f"{genre}-{index}",
+                "name": f"{genre} song {index}",
+                "artists": [{"name": f"{genre} artist {index % 50}"}],
+                "preview_url": None,
+            }
+            for index in range(offset, end)
+        ]
+        return {"tracks": {"items": items, "total": self.catalogue_size}}
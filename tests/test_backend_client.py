@@ -0,0 +1,32 @@
+import asyncio
+import time
+
+from backend_client import BackendClient
+from stubs import StubBackend
+
+
+def test_callers_beyond_the_pool_are_served_in_order():
+    async def scenario():
+        backend = StubBackend(latency=0.02)
+        await backend.start()
+        client = BackendClient(backend.url, pool_size=4)
+        latencies = []
+
+        async def handler(index):
+            for number in range(5):
+                started = time.perf_counter()
+                response = await client.get(f"/battle/{index}/votes")
+                assert response.status_code == 200
+                latencies.append(time.perf_counter() - started)
+
+        try:
+            await asyncio.gather(*(handler(index) for index in range(20)))
+        finally:
+            await client.close()
+            await backend.stop()
+        return sorted(latencies), backend.calls["votes"]
+
+    latencies, calls = asyncio.run(scenario())
+    assert calls == 100
+    # 20 callers on 4 connections each wait about 5 responses (~0.1s); none is left waiting much longer
+    assert latencies[-1] < 0.25
@@ -0,0 +1,178 @@
+import asyncio
+
+from battle_scheduler import BattleScheduler
+from battle_sessions import BattleSessionStore
+
+
+class ManualClock:
+    """A clock that only moves when the test advances it; `sleep` waits for that."""
+
+    def __init__(self, now=0.0):
+        self.now = now
+        self._sleepers = []
+
+    def __call__(self):
+        return self.now
+
+    async def sleep(self, delay):
+        future = asyncio.get_running_loop().create_future()
+        self._sleepers.append((self.now + delay, future))
+        await future
+
+    async def advance(self, seconds):
+        self.now += seconds
+        for wake_at, future in self._sleepers:
+            if wake_at <= self.now and not future.done():
+                future.set_result(None)
+        self._sleepers = [(wake_at, future) for wake_at, future in self._sleepers if not future.done()]
+        await settle()
+
+
+async def settle():
+    for _ in range(10):
+        await asyncio.sleep(0)
+
+
+def make_scheduler(clock):
+    fired = []
+
+    async def on_expire(battle_id):
+        fired.append((battle_id, clock.now))
+
+    scheduler = BattleScheduler(clock=clock, sleep=clock.sleep)
+    scheduler.start(on_expire)
+    return scheduler, fired
+
+
+def test_battles_fire_in_deadline_order():
+    async def scenario():
+        clock = ManualClock()
+        scheduler, fired = make_scheduler(clock)
+        for battle_id, deadline in ((1, 30), (2, 10), (3, 20), (4, 10)):
+            scheduler.schedule(battle_id, deadline)
+        await settle()
+        await clock.advance(9)
+        assert fired == []
+        await clock.advance(1)
+        for _ in range(4):
+            await clock.advance(5)
+        await scheduler.stop()
+        return fired, scheduler.stats()
+
+    fired, stats = asyncio.run(scenario())
+    assert fired == [(2, 10), (4, 10), (3, 20), (1, 30)]
+    assert stats == {"pending": 0, "heap": 0, "running": 0, "expired": 4}
+
+
+def test_an_earlier_deadline_wakes_the_sleeping_loop():
+    async def scenario():
+        clock = ManualClock()
+        scheduler, fired = make_scheduler(clock)
+        scheduler.schedule(1, 100)
+        await settle()
+        # The loop now sleeps until 100
+        scheduler.schedule(2, 5)
+        await settle()
+        await clock.advance(5)
+        await scheduler.stop()
+        return fired
+
+    assert asyncio.run(scenario()) == [(2, 5)]
+
+
+def test_cancelled_and_rescheduled_battles_fire_only_at_their_last_deadline():
+    async def scenario():
+        clock = ManualClock()
+        scheduler, fired = make_scheduler(clock)
+        scheduler.schedule(1, 10)
+        scheduler.schedule(2, 20)
+        scheduler.schedule(3, 15)
+        await settle()
+        scheduler.cancel(1)
+        scheduler.schedule(2, 30)
+        scheduler.schedule(3, 5)
+        assert (scheduler.deadline(1), scheduler.deadline(2), len(scheduler)) == (None, 30, 2)
+        for _ in range(8):
+            await clock.advance(5)
+        await scheduler.stop()
+        return fired, scheduler.stats()
+
+    fired, stats = asyncio.run(scenario())
+    assert fired == [(3, 5), (2, 30)]
+    assert stats["expired"] == 2
+    assert stats["heap"] == 0
+
+
+def test_cancelled_entries_are_compacted_out_of_the_heap():
+    async def scenario():
+        clock = ManualClock()
+        scheduler, fired = make_scheduler(clock)
+        for battle_id in range(100):
+            scheduler.schedule(battle_id, 10 + battle_id)
+        for battle_id in range(82):
+            scheduler.cancel(battle_id)
+        # 100 entries for 18 battles is still within 2 * 18 + 64
+        assert scheduler.stats()["heap"] == 100
+        scheduler.cancel(82)
+        heap_after_compaction = scheduler.stats()["heap"]
+        await clock.advance(200)
+        await scheduler.stop()
+        return heap_after_compaction, fired
+
+    heap_after_compaction, fired = asyncio.run(scenario())
+    assert heap_after_compaction == 17
+    assert [battle_id for battle_id, _ in fired] == list(range(83, 100))
+
+
+def test_a_failing_close_does_not_stop_the_scheduler():
+    async def scenario():
+        clock = ManualClock()
+        fired = []
+
+        async def on_expire(battle_id):
+            fired.append(battle_id)
+            if battle_id == 1:
+                raise RuntimeError("backend down")
+
+        scheduler = BattleScheduler(clock=clock, sleep=clock.sleep)
+        scheduler.start(on_expire)
+        scheduler.schedule(1, 5)
+        scheduler.schedule(2, 10)
+        await clock.advance(5)
+        await clock.advance(5)
+        await scheduler.stop()
+        return fired
+
+    assert asyncio.run(scenario()) == [1, 2]
+
+
+def test_open_battles_are_rescheduled_from_the_session_store_after_a_restart(tmp_path):
+    path = str(tmp_path / "sessions.json")
+    clock = ManualClock(now=1000.0)
+
+    async def previous_run():
+        store = BattleSessionStore(path, clock=clock)
+        store.create(1, genre="Pop", ends_at=1060.0)
+        store.create(2, genre="Rock", ends_at=1200.0)
+        store.create(3, genre="Jazz", ends_at=1200.0)
+        store.close(3)
+        # Started elsewhere: no known end
+        store.ensure(4)
+        await store.stop()
+
+    async def restart():
+        store = BattleSessionStore(path, clock=clock)
+        store.load()
+        scheduler, fired = make_scheduler(clock)
+        scheduler.reschedule(store, grace=5)
+        assert (scheduler.deadline(1), scheduler.deadline(2), len(scheduler)) == (1065.0, 1205.0, 2)
+        # Battle 1 ended while the bot was down
+        await settle()
+        assert fired == [(1, 1100.0)]
+        await clock.advance(105)
+        await scheduler.stop()
+        return fired
+
+    asyncio.run(previous_run())
+    clock.now = 1100.0
+    assert asyncio.run(restart()) == [(1, 1100.0), (2, 1205.0)]
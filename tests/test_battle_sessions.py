@@ -0,0 +1,121 @@
+import asyncio
+import json
+
+from battle_sessions import BattleSessionStore
+
+
+class FakeClock:
+    def __init__(self):
+        self.now = 1000.0
+
+    def __call__(self):
+        return self.now
+
+
+def make_store(path=None, clock=None):
+    return BattleSessionStore(path, closed_ttl=3600, flush_delay=0.0, clock=clock or FakeClock())
+
+
+def test_sessions_round_trip_through_the_snapshot(tmp_path):
+    path = str(tmp_path / "sessions.json")
+
+    async def scenario():
+        store = make_store(path)
+        session = store.create(1, genre="Pop", tracks=(("Song", "Artist"), ("Other", "Band")),
+                               creators=("0xa", "0xb"), payment_amount=5, ends_at=2000.0)
+        session.votes = [3, 4]
+        session.messages[(10, 20)] = 5
+        store.create(2, genre="Rock", ends_at=2000.0)
+        store.close(2)
+        await store.stop()
+
+    asyncio.run(scenario())
+    # Closed battles are left out of the snapshot
+    assert [data["battle_id"] for data in json.loads((tmp_path / "sessions.json").read_text())] == [1]
+
+    reloaded = make_store(path)
+    reloaded.load()
+    session = reloaded.get(1)
+    assert (session.genre, session.payment_amount, session.ends_at) == ("Pop", 5, 2000.0)
+    assert session.tracks == (("Song", "Artist"), ("Other", "Band"))
+    assert session.creators == ("0xa", "0xb")
+    assert session.votes == [3, 4]
+    assert session.messages == {(10, 20): 5}
+    assert session.track_name(2) == "Other by Band"
+    assert 2 not in reloaded
+
+
+def test_changes_are_flushed_after_the_delay(tmp_path):
+    path = tmp_path / "sessions.json"
+
+    async def scenario():
+        store = make_store(str(path))
+        store.create(1, genre="Pop", ends_at=2000.0)
+        assert not path.exists()
+        await asyncio.sleep(0.05)
+        return json.loads(path.read_text())
+
+    assert [data["battle_id"] for data in asyncio.run(scenario())] == [1]
+
+
+def test_closed_sessions_are_evicted_after_the_ttl():
+    clock = FakeClock()
+    store = make_store(clock=clock)
+    store.create(1, ends_at=1060.0)
+    store.create(2, ends_at=1060.0)
+    clock.now = 1100.0
+    store.close(1)
+    assert not store.get(1).voting_open(clock.now)
+    assert store.stats() == {"sessions": 2, "open": 1, "closed": 1}
+
+    clock.now = 1100.0 + 3599
+    assert store.evict() == 0
+    clock.now = 1100.0 + 3600
+    assert store.evict() == 1
+    assert 1 not in store
+    # A battle with a known end stays until it is closed, however late
+    clock.now = 100000.0
+    assert store.evict() == 0
+    assert store.stats() == {"sessions": 1, "open": 1, "closed": 0}
+
+
+def test_bare_sessions_expire_like_closed_ones():
+    clock = FakeClock()
+    store = make_store(clock=clock)
+    store.ensure(1).votes = [1, 0]
+    assert store.ensure(1).votes == [1, 0]
+    clock.now += 3599
+    assert store.evict() == 0
+    clock.now += 1
+    assert store.evict() == 1
+    assert 1 not in store
+    assert store.stats() == {"sessions": 0, "open": 0, "closed": 0}
+
+
+def test_starting_a_bare_session_keeps_its_state_and_stops_its_expiry():
+    clock = FakeClock()
+    store = make_store(clock=clock)
+    store.ensure(1).messages[(10, 20)] = 5
+    session = store.create(1, genre="Pop", ends_at=1060.0)
+    assert session.messages == {(10, 20): 5}
+    clock.now += 7200
+    assert store.evict() == 0
+
+
+def test_expired_sessions_are_dropped_on_load(tmp_path):
+    path = str(tmp_path / "sessions.json")
+    clock = FakeClock()
+
+    async def scenario():
+        store = make_store(path, clock)
+        store.ensure(1)
+        store.create(2, genre="Pop", ends_at=1060.0)
+        await store.stop()
+
+    asyncio.run(scenario())
+    clock.now += 7200
+    reloaded = make_store(path, clock)
+    reloaded.load()
+    # The overdue battle is kept so the scheduler can still close it
+    assert 1 not in reloaded
+    assert [session.battle_id for session in reloaded.open_sessions()] == [2]
@@ -0,0 +1,112 @@
+import base64
+import secrets
+
+import pytest
+
+from callbacks import (
+    HEADER, KIND_GENRE, KIND_PAGE, KIND_VOTE, MAX_CALLBACK_DATA, VERSION, VOTE,
+    CallbackError, CallbackRegistry, GenreCallback, PageCallback, VoteCallback,
+    decode, encode_genre, encode_page, encode_vote,
+)
+
+
+class FakeClock:
+    def __init__(self):
+        self.now = 0.0
+
+    def __call__(self):
+        return self.now
+
+
+def packed(raw):
+    return base64.urlsafe_b64encode(raw).rstrip(b"=").decode("ascii")
+
+
+def test_round_trips():
+    assert decode(encode_vote(123456789, 2, 15.5)) == (KIND_VOTE, VoteCallback(123456789, 2, 15.5))
+    assert decode(encode_genre("Hip-Hop")) == (KIND_GENRE, GenreCallback("Hip-Hop"))
+    assert decode(encode_genre("Música")) == (KIND_GENRE, GenreCallback("Música"))
+    assert decode(encode_page("AbC-_123", 41)) == (KIND_PAGE, PageCallback("AbC-_123", 41))
+
+
+def test_registry_round_trips_payloads_too_large_to_pack():
+    registry = CallbackRegistry()
+    genre = "Progressive Psychedelic Post-Rock " * 3
+    data = encode_genre(genre, registry)
+    assert decode(data, registry) == (KIND_GENRE, GenreCallback(genre))
+    data = encode_vote(10 ** 30, 1, 5, registry)
+    assert decode(data, registry) == (KIND_VOTE, VoteCallback(10 ** 30, 1, 5))
+    with pytest.raises(CallbackError):
+        encode_genre(genre)
+    # Tokens are only meaningful to the registry that issued them
+    with pytest.raises(CallbackError):
+        decode(data)
+    with pytest.raises(CallbackError):
+        decode(data, CallbackRegistry())
+
+
+def test_registry_entries_expire():
+    clock = FakeClock()
+    registry = CallbackRegistry(ttl=60, clock=clock)
+    data = encode_vote(2 ** 64, 1, 5, registry)
+    clock.now = 59.0
+    assert decode(data, registry)[0] == KIND_VOTE
+    clock.now = 60.0
+    with pytest.raises(CallbackError):
+        decode(data, registry)
+    assert registry.stats() == {"entries": 0, "expired": 1}
+
+
+def test_every_encoding_fits_telegrams_limit():
+    registry = CallbackRegistry()
+    encodings = [
+        encode_vote(2 ** 64 - 1, 2, -1.7976931348623157e308),
+        encode_vote(10 ** 40, 2, 5, registry),
+        # PageCache's query ids come from token_urlsafe(6)
+        encode_page(secrets.token_urlsafe(6), 2 ** 32 - 1),
+    ]
+    encodings += [encode_genre("x" * length, registry) for length in range(100)]
+    encodings += [encode_genre("é" * length, registry) for length in range(50)]
+    assert max(len(data.encode()) for data in encodings) <= MAX_CALLBACK_DATA
+    # 64 base64 characters hold 48 bytes, 2 of them the header
+    assert decode(encode_genre("x" * 46)) == (KIND_GENRE, GenreCallback("x" * 46))
+    with pytest.raises(CallbackError):
+        encode_genre("x" * 47)
+
+
+@pytest.mark.parametrize("version", [0, VERSION + 1, 255])
+def test_other_versions_are_rejected(version):
+    data = packed(HEADER.pack(version, KIND_VOTE) + VOTE.pack(1, 1, 5.0))
+    with pytest.raises(CallbackError, match="version"):
+        decode(data)
+
+
+def test_unknown_kinds_are_rejected():
+    with pytest.raises(CallbackError, match="kind"):
+        decode(packed(HEADER.pack(VERSION, 99) + b"payload"))
+
+
+@pytest.mark.parametrize("data", [
+    "",
+    "A",
+    "!!!!",
+    "é",
+    packed(HEADER.pack(VERSION, KIND_VOTE) + b"\x00" * 3),
+    packed(HEADER.pack(VERSION, KIND_GENRE) + b"\xff\xfe"),
+    packed(HEADER.pack(VERSION, KIND_PAGE) + b"\x00"),
+])
+def test_malformed_data_raises_callback_error(data):
+    with pytest.raises(CallbackError):
+        decode(data)
+
+
+def test_legacy_buttons_still_decode():
+    assert decode("vote|track2|42|10") == (KIND_VOTE, VoteCallback(42, 2, 10.0))
+    assert decode("genre|Rock") == (KIND_GENRE, GenreCallback("Rock"))
+    assert decode("page|abc|3") == (KIND_PAGE, PageCallback("abc", 3))
+
+
+@pytest.mark.parametrize("data", ["vote|track1|x|10", "vote|track1|42", "page|abc|x", "unknown|1"])
+def test_malformed_legacy_buttons_are_rejected(data):
+    with pytest.raises(CallbackError):
+        decode(data)
@@ -0,0 +1,184 @@
+import asyncio
+
+import httpx
+import pytest
+
+from backend_client import BackendClient
+from circuit_breaker import CLOSED, OPEN, CircuitBreaker, CircuitOpenError, BreakerGroup, is_outage
+from stubs import StubBackend
+
+
+class FakeClock:
+    def __init__(self):
+        self.now = 0.0
+
+    def __call__(self):
+        return self.now
+
+
+def endpoint(clock, latency):
+    """An operation taking `latency` seconds of fake time, timing out like httpx does."""
+    async def operation(timeout):
+        if latency > timeout:
+            clock.now += timeout
+            raise asyncio.TimeoutError()
+        clock.now += latency
+        return "ok"
+    return operation
+
+
+async def call_until_success(breaker, clock, operation, attempts=20):
+    for _ in range(attempts):
+        try:
+            return await breaker.call(operation)
+        except CircuitOpenError:
+            clock.now += breaker.reset_timeout
+        except asyncio.TimeoutError:
+            pass
+    raise AssertionError("The endpoint never recovered")
+
+
+def make_breaker(clock):
+    return CircuitBreaker("test", failure_threshold=5, reset_timeout=15.0, min_timeout=1.0, max_timeout=60.0,
+                          min_samples=20, clock=clock)
+
+
+def test_timeout_grows_when_the_endpoint_slows_down():
+    async def scenario():
+        clock = FakeClock()
+        breaker = make_breaker(clock)
+        for _ in range(30):
+            await breaker.call(endpoint(clock, 0.1))
+        assert breaker.timeout() == 1.0
+
+        # 3s is well below max_timeout: timed-out calls raise the timeout until calls fit again
+        assert await call_until_success(breaker, clock, endpoint(clock, 3.0)) == "ok"
+        for _ in range(10):
+            assert await breaker.call(endpoint(clock, 3.0)) == "ok"
+        assert breaker.state == CLOSED
+        assert breaker.timeout() >= 3.0
+
+    asyncio.run(scenario())
+
+
+def test_half_open_probe_gets_the_maximum_timeout():
+    async def scenario():
+        clock = FakeClock()
+        breaker = make_breaker(clock)
+        for _ in range(30):
+            await breaker.call(endpoint(clock, 0.1))
+
+        async def failing(timeout):
+            raise ConnectionError("refused")
+
+        for _ in range(breaker.failure_threshold):
+            with pytest.raises(ConnectionError):
+                await breaker.call(failing)
+        assert breaker.state == OPEN
+        # Opening forgets the latency learned before the outage
+        assert breaker.timeout() == breaker.max_timeout
+
+        clock.now += breaker.reset_timeout
+        assert await breaker.call(endpoint(clock, 30.0)) == "ok"
+        assert breaker.state == CLOSED
+
+    asyncio.run(scenario())
+
+
+class Response:
+    def __init__(self, status_code):
+        self.status_code = status_code
+
+
+def test_only_outages_count_as_failures():
+    assert [status for status in (200, 400, 404, 429, 500, 502, 503, 504) if is_outage(Response(status))] == [
+        502, 503, 504,
+    ]
+
+
+def test_backend_breaker_against_injected_failures():
+    async def scenario():
+        backend = StubBackend()
+        await backend.start()
+        breakers = BreakerGroup("backend ", failure_threshold=3, reset_timeout=0.2, min_timeout=0.05, min_samples=5)
+        client = BackendClient(backend.url, timeout=2.0, breakers=breakers)
+        try:
+            # Reverted contract calls (unknown battles) are answered 500 but are not an outage
+            for _ in range(10):
+                response = await client.get("/battle/999/winner")
+                assert response.status_code == 500
+            assert breakers.get("GET /battle/:id/winner").state == CLOSED
+
+            # A real outage opens the breaker, which then fails fast without calling the backend
+            backend.outage = True
+            for _ in range(3):
+                assert (await client.get("/balance")).status_code == 503
+            calls = backend.calls["balance"]
+            with pytest.raises(CircuitOpenError):
+                await client.get("/balance")
+            assert backend.calls["balance"] == calls
+
+            # Once the backend is back the probe closes the breaker again
+            backend.outage = False
+            await asyncio.sleep(0.25)
+            assert (await client.get("/balance")).status_code == 200
+            assert breakers.get("GET /balance").state == CLOSED
+
+            # Fast calls teach a short timeout; a slower backend then times out a few calls and recovers
+            for _ in range(10):
+                await client.get("/balance")
+            assert breakers.get("GET /balance").timeout() == 0.05
+            backend.latency = 0.12
+            statuses = []
+            for _ in range(10):
+                try:
+                    statuses.append((await client.get("/balance")).status_code)
+                except (CircuitOpenError, httpx.TimeoutException):
+                    statuses.append(None)
+                    await asyncio.sleep(0.05)
+            assert statuses[-3:] == [200, 200, 200]
+        finally:
+            await client.close()
+            await backend.stop()
+
+    asyncio.run(scenario())
+
+
+def test_transaction_posts_are_not_cut_off_by_the_learned_timeout():
+    async def scenario():
+        backend = StubBackend()
+        await backend.start()
+        backend.start_battle({"track1": "A", "track2": "B", "paymentAmount": "0.1"})
+        breakers = BreakerGroup("backend ", failure_threshold=3, min_timeout=0.05, min_samples=5)
+        client = BackendClient(backend.url, timeout=2.0, breakers=breakers)
+        votes = iter(
+            {"battleId": 1, "trackNumber": 1, "userAddress": f"0x{user:040x}", "paymentAmount": "0.1"}
+            for user in range(100)
+        )
+        try:
+            # Fast calls teach the read endpoint a short timeout, and would teach /votetrack one too
+            for _ in range(10):
+                await client.get("/balance")
+                assert (await client.post("/votetrack", next(votes))).status_code == 200
+            assert breakers.get("GET /balance").timeout() == 0.05
+
+            backend.latency = 0.3
+            with pytest.raises(httpx.TimeoutException):
+                await client.get("/balance")
+            # The slow transaction still completes, however fast it used to be
+            response = await client.post("/votetrack", next(votes))
+            assert response.status_code == 200 and response.json()["transactionHash"]
+            assert breakers.get("POST /votetrack").timeout() == 60.0
+
+            # Transactions outlasting even the fixed timeout do not open the breaker
+            slow = BackendClient(backend.url, breakers=BreakerGroup("backend ", failure_threshold=3))
+            for _ in range(5):
+                with pytest.raises(httpx.TimeoutException):
+                    await slow.post("/votetrack", next(votes), timeout=0.1)
+            assert slow.breakers.get("POST /votetrack").state == CLOSED
+            await slow.close()
+        finally:
+            await client.close()
+            await backend.stop()
+
+    asyncio.run(scenario())
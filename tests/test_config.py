@@ -0,0 +1,18 @@
+import pytest
+
+from config import BotConfig
+
+CREDENTIALS = {"BOT_TOKEN": "123:abc", "SPOTIFY_CLIENT_ID": "client", "SPOTIFY_CLIENT_SECRET": "secret"}
+
+
+def test_missing_credentials_stop_startup():
+    with pytest.raises(SystemExit, match="BOT_TOKEN, SPOTIFY_CLIENT_SECRET"):
+        BotConfig.from_env({"SPOTIFY_CLIENT_ID": "client", "SPOTIFY_CLIENT_SECRET": ""})
+
+
+def test_credentials_and_overrides_come_from_the_environment():
+    config = BotConfig.from_env({**CREDENTIALS, "BOT_WORKERS": "4", "LEADERBOARD_PATH": ""})
+    assert (config.bot_token, config.spotify_client_id, config.spotify_client_secret) == ("123:abc", "client", "secret")
+    assert config.workers == 4
+    assert config.leaderboard_path is None
+    assert config.backend_url == BotConfig().backend_url
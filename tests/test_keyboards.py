@@ -0,0 +1,63 @@
+from callbacks import KIND_VOTE, CallbackRegistry, VoteCallback, decode
+from keyboards import genre_keyboard, memoized_vote_keyboard
+
+
+def votes(keyboard, registry=None):
+    """(label, decoded vote) of each button of a vote keyboard."""
+    return [(button.text, decode(button.callback_data, registry)) for button in keyboard.inline_keyboard[0]]
+
+
+def test_vote_keyboards_are_not_shared_across_battles():
+    build_vote_keyboard = memoized_vote_keyboard()
+    first = build_vote_keyboard(1, 5)
+    second = build_vote_keyboard(2, 5)
+    assert first is not second
+    assert votes(first)[0][1] == (KIND_VOTE, VoteCallback(1, 1, 5.0))
+    assert votes(second)[0][1] == (KIND_VOTE, VoteCallback(2, 1, 5.0))
+    # A battle's cached dict is left alone by the other's serialization
+    assert first.to_dict() != second.to_dict()
+
+
+def test_vote_keyboards_are_not_shared_across_counts_or_payments():
+    build_vote_keyboard = memoized_vote_keyboard()
+    keyboards = [
+        build_vote_keyboard(1, 5, 0, 0),
+        build_vote_keyboard(1, 5, 1, 0),
+        build_vote_keyboard(1, 5, 0, 1),
+        build_vote_keyboard(1, 10, 0, 0),
+    ]
+    assert len({id(keyboard) for keyboard in keyboards}) == 4
+    assert [label for label, _ in votes(keyboards[1])] == [
+        "🎵 Vote Track 1 (1 votes)", "🎵 Vote Track 2 (0 votes)",
+    ]
+    assert votes(keyboards[3])[1][1] == (KIND_VOTE, VoteCallback(1, 2, 10.0))
+
+
+def test_same_state_reuses_the_keyboard_and_its_serialized_form():
+    build_vote_keyboard = memoized_vote_keyboard()
+    keyboard = build_vote_keyboard(1, 5, 2, 3)
+    assert build_vote_keyboard(1, 5, 2, 3) is keyboard
+    assert keyboard.to_dict() is keyboard.to_dict()
+    assert build_vote_keyboard.cache_info().hits == 1
+
+
+def test_least_recently_used_keyboard_is_evicted():
+    build_vote_keyboard = memoized_vote_keyboard(maxsize=2)
+    first = build_vote_keyboard(1, 5)
+    build_vote_keyboard(2, 5)
+    build_vote_keyboard(3, 5)
+    assert build_vote_keyboard.cache_info().currsize == 2
+    assert build_vote_keyboard(1, 5) is not first
+
+
+def test_oversized_battle_ids_go_through_the_registry():
+    registry = CallbackRegistry()
+    keyboard = memoized_vote_keyboard(registry)(2 ** 70, 5)
+    assert votes(keyboard, registry)[0][1] == (KIND_VOTE, VoteCallback(2 ** 70, 1, 5))
+    assert registry.stats()["entries"] == 2
+
+
+def test_genre_keyboard_has_one_button_per_genre():
+    keyboard = genre_keyboard(["Pop", "Rock"])
+    assert [[button.text for button in row] for row in keyboard.inline_keyboard] == [["Pop"], ["Rock"]]
+    assert keyboard.to_dict() is keyboard.to_dict()
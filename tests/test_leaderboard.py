@@ -0,0 +1,69 @@
+import asyncio
+
+from battle_sessions import BattleSession
+from leaderboard import Leaderboard, SqliteLeaderboard
+
+
+def session(battle_id, genre, first, second, votes=None):
+    battle = BattleSession(battle_id, genre=genre, tracks=((first, "A"), (second, "B")), creators=("0xa", "0xb"))
+    battle.votes = votes
+    return battle
+
+
+async def rankings(board, voter):
+    return (
+        await board.top_tracks(10),
+        await board.top_tracks(10, "Pop"),
+        await board.top_creators(10),
+        await board.top_voters(10),
+        await board.voter_standing(voter),
+    )
+
+
+def test_sharded_workers_share_global_rankings(tmp_path):
+    async def scenario():
+        # Two workers: battle 1 is started from a chat of the first, battle 2 from one of the second
+        first, second = (SqliteLeaderboard(str(tmp_path / "leaderboard.db")) for _ in range(2))
+        for board in (first, second):
+            board.load()
+        battles = {1: session(1, "Pop", "song 1", "song 2"), 2: session(2, "Rock", "song 3", "song 4")}
+        first.record_battle(battles[1])
+        second.record_battle(battles[2])
+        await asyncio.gather(first.top_voters(1), second.top_voters(1))
+
+        votes = [(1, 1, "0x1"), (1, 1, "0x2"), (1, 2, "0x3"), (2, 2, "0x1"), (2, 2, "0x4")]
+        for battle_id, track_number, voter in votes:
+            owner = first if battle_id == 1 else second
+            # The worker of the chat reports the vote with its session, every worker gets the backend's event
+            owner.record_vote(battle_id, track_number, voter, battles[battle_id])
+            for board in (first, second):
+                board.record_vote(battle_id, track_number, voter)
+        battles[1].votes = [2, 1]
+        first.record_close(1, battles[1])
+        second.record_close(1)
+        # A slow worker's report of a vote in the closed battle is still recognised
+        second.record_vote(1, 1, "0x2")
+
+        seen = [await rankings(board, "0x1") for board in (first, second)]
+        stats = first.stats(), second.stats()
+        for board in (first, second):
+            await board.stop()
+
+        # The same votes through the single-process leaderboard
+        reference = Leaderboard()
+        for battle_id, track_number, voter in votes:
+            reference.record_vote(battle_id, track_number, voter, battles[battle_id])
+        battles[1].votes = [2, 1]
+        reference.record_close(1, battles[1])
+        return seen, stats, await rankings(reference, "0x1")
+
+    seen, stats, expected = asyncio.run(scenario())
+    assert seen[0] == seen[1] == expected
+    tracks, pop_tracks, creators, voters, standing = seen[0]
+    assert tracks[:2] == [("song 1 by A", 2), ("song 4 by B", 2)]
+    assert pop_tracks == [("song 1 by A", 2), ("song 2 by B", 1)]
+    assert creators == [("0xb", 3, 0), ("0xa", 2, 1)]
+    assert voters[0] == ("0x1", 2)
+    assert standing == (1, 2)
+    assert sum(board["votes"] for board in stats) == 5
+    assert sum(board["repeats"] for board in stats) == 11
@@ -0,0 +1,67 @@
+import asyncio
+
+import pytest
+
+from metrics import Histogram, Registry, instrument, registry
+
+
+def test_samples_land_in_the_first_bucket_they_fit():
+    histogram = Histogram(buckets=(0.1, 0.5, 1.0))
+    for value in (0.05, 0.1, 0.3, 1.0, 7.0):
+        histogram.observe(value)
+    # A sample equal to a bound counts towards it (Prometheus "le"); larger ones go to +Inf
+    assert histogram.counts == [2, 1, 1, 1]
+    assert histogram.count == 5
+    assert histogram.sum == pytest.approx(8.45)
+    assert histogram.quantile(0.4) == 0.1
+    assert histogram.quantile(0.8) == 1.0
+    assert histogram.quantile(1.0) == float("inf")
+    assert Histogram().quantile(0.99) == 0.0
+
+
+def test_text_exposition_format():
+    metrics = Registry()
+    metrics.describe("handler_seconds", "Handler latency")
+    histogram = metrics.histogram("handler_seconds", (("handler", "vote"),))
+    histogram.buckets = (0.1, 1.0)
+    histogram.counts = [0, 0, 0]
+    for value in (0.05, 0.5, 2.0):
+        histogram.observe(value)
+    metrics.inc("errors_total", (("handler", "vote"), ("type", "KeyError")))
+    metrics.set_gauge("queue_depth", (), 3)
+
+    assert metrics.render().splitlines() == [
+        "# HELP handler_seconds Handler latency",
+        "# TYPE handler_seconds histogram",
+        'handler_seconds_bucket{handler="vote",le="0.1"} 1',
+        'handler_seconds_bucket{handler="vote",le="1.0"} 2',
+        'handler_seconds_bucket{handler="vote",le="+Inf"} 3',
+        'handler_seconds_sum{handler="vote"} 2.55',
+        'handler_seconds_count{handler="vote"} 3',
+        "# HELP errors_total errors_total",
+        "# TYPE errors_total counter",
+        'errors_total{handler="vote",type="KeyError"} 1',
+        "# HELP queue_depth queue_depth",
+        "# TYPE queue_depth gauge",
+        "queue_depth 3",
+    ]
+
+
+def test_instrument_records_latency_errors_and_in_flight():
+    @instrument
+    async def metrics_test_handler(update, context):
+        assert registry.gauges[("bot_handlers_in_flight", labels)] == 1
+        if update == "fail":
+            raise KeyError(update)
+
+    labels = (("handler", "metrics_test_handler"),)
+
+    async def scenario():
+        await metrics_test_handler("ok", None)
+        with pytest.raises(KeyError):
+            await metrics_test_handler("fail", None)
+
+    asyncio.run(scenario())
+    assert registry.histograms[("bot_handler_seconds", labels)].count == 2
+    assert registry.counters[("bot_handler_errors_total", labels + (("type", "KeyError"),))] == 1
+    assert registry.gauges[("bot_handlers_in_flight", labels)] == 0
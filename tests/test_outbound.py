@@ -0,0 +1,162 @@
+import asyncio
+
+from telegram.error import RetryAfter
+
+from outbound import OutboundScheduler, PRIORITY_HIGH, PRIORITY_LOW
+
+
+class SimulatedTime:
+    """A clock whose sleeps return at once, moving the clock forward instead."""
+
+    def __init__(self):
+        self.now = 0.0
+
+    def __call__(self):
+        return self.now
+
+    async def sleep(self, seconds):
+        self.now += seconds
+        await asyncio.sleep(0)
+
+
+def make_scheduler(time, **limits):
+    return OutboundScheduler(clock=time, sleep=time.sleep, **limits)
+
+
+def request(scheduler, time, sent, chat_id, text, endpoint="sendMessage", message_id=None, priority=None, fail=None):
+    """Queues a call through the scheduler; `sent` receives (time, chat_id, text) when it goes out."""
+    async def callback():
+        if fail:
+            raise fail.pop(0)
+        sent.append((time.now, chat_id, text))
+        return text
+
+    data = {"chat_id": chat_id, "message_id": message_id}
+    rate_limit_args = {"priority": priority} if priority is not None else None
+    return asyncio.ensure_future(scheduler.process_request(callback, (), {}, endpoint, data, rate_limit_args))
+
+
+def test_global_rate_spreads_sends_across_chats():
+    async def scenario():
+        time = SimulatedTime()
+        scheduler = make_scheduler(time, global_rate=30.0, global_burst=30)
+        sent = []
+        await asyncio.gather(*(request(scheduler, time, sent, chat_id, "hi") for chat_id in range(90)))
+        await scheduler.shutdown()
+        return sent
+
+    sent = asyncio.run(scenario())
+    assert len(sent) == 90
+    # A burst of 30, then 30 per second
+    assert sum(1 for at, _, _ in sent if at == 0) == 30
+    assert 1.9 < sent[-1][0] < 2.1
+
+
+def test_busy_chat_does_not_hold_back_other_chats():
+    async def scenario():
+        time = SimulatedTime()
+        scheduler = make_scheduler(time, chat_rate=1.0, chat_burst=3)
+        sent = []
+        busy = [request(scheduler, time, sent, 1, f"busy {n}") for n in range(6)]
+        other = request(scheduler, time, sent, 2, "other")
+        await asyncio.gather(*busy, other)
+        await scheduler.shutdown()
+        return sent
+
+    sent = asyncio.run(scenario())
+    times = {text: at for at, _, text in sent}
+    assert times["other"] == 0
+    assert [text for _, chat_id, text in sent if chat_id == 1] == [f"busy {n}" for n in range(6)]
+    assert 2.9 < times["busy 5"] < 3.1
+
+
+def test_group_chats_get_the_group_budget():
+    async def scenario():
+        time = SimulatedTime()
+        scheduler = make_scheduler(time, group_rate=20 / 60, group_burst=10)
+        sent = []
+        await asyncio.gather(*(request(scheduler, time, sent, -100, f"reply {n}") for n in range(12)))
+        await scheduler.shutdown()
+        return sent
+
+    sent = asyncio.run(scenario())
+    # 10 at once, then one every 3 seconds
+    assert 5.9 < sent[-1][0] < 6.1
+
+
+def test_high_priority_overtakes_waiting_requests():
+    async def scenario():
+        time = SimulatedTime()
+        scheduler = make_scheduler(time, global_rate=1.0, global_burst=1)
+        sent = []
+        calls = [request(scheduler, time, sent, chat_id, f"info {chat_id}") for chat_id in range(3)]
+        calls.append(request(scheduler, time, sent, 10, "low", priority=PRIORITY_LOW))
+        calls.append(request(scheduler, time, sent, 11, "vote", priority=PRIORITY_HIGH))
+        await asyncio.gather(*calls)
+        await scheduler.shutdown()
+        return sent
+
+    sent = asyncio.run(scenario())
+    assert [text for _, _, text in sent] == ["vote", "info 0", "info 1", "info 2", "low"]
+
+
+def test_waiting_edit_is_replaced_by_the_newer_one():
+    async def scenario():
+        time = SimulatedTime()
+        scheduler = make_scheduler(time, chat_rate=1.0, chat_burst=1)
+        sent = []
+        first = request(scheduler, time, sent, 1, "message")
+        older = request(scheduler, time, sent, 1, "3 votes", endpoint="editMessageReplyMarkup", message_id=7)
+        newer = request(scheduler, time, sent, 1, "4 votes", endpoint="editMessageReplyMarkup", message_id=7)
+        results = await asyncio.gather(first, older, newer)
+        stats = scheduler.stats()
+        await scheduler.shutdown()
+        return sent, results, stats
+
+    sent, results, stats = asyncio.run(scenario())
+    assert [text for _, _, text in sent] == ["message", "4 votes"]
+    assert results == ["message", "4 votes", "4 votes"]
+    assert stats["coalesced"] == 1
+
+
+def test_retry_after_pauses_only_that_chat():
+    async def scenario():
+        time = SimulatedTime()
+        scheduler = make_scheduler(time)
+        sent = []
+        flooded = request(scheduler, time, sent, 1, "flooded", fail=[RetryAfter(5)])
+        await asyncio.sleep(0)
+        await asyncio.sleep(0)
+        other = request(scheduler, time, sent, 2, "other")
+        await asyncio.gather(flooded, other)
+        stats = scheduler.stats()
+        await scheduler.shutdown()
+        return sent, stats
+
+    sent, stats = asyncio.run(scenario())
+    times = {text: at for at, _, text in sent}
+    assert times["other"] == 0
+    assert times["flooded"] >= 5
+    assert stats["retried"] == 1
+
+
+def test_cancelled_request_is_withdrawn_before_it_is_sent():
+    async def scenario():
+        time = SimulatedTime()
+        scheduler = make_scheduler(time, global_rate=1.0, global_burst=1)
+        sent = []
+        first = request(scheduler, time, sent, 1, "message")
+        abandoned = request(scheduler, time, sent, 2, "keyboard", endpoint="editMessageReplyMarkup", message_id=7)
+        shared = request(scheduler, time, sent, 3, "4 votes", endpoint="editMessageReplyMarkup", message_id=8)
+        sharer = request(scheduler, time, sent, 3, "5 votes", endpoint="editMessageReplyMarkup", message_id=8)
+        await asyncio.sleep(0)
+        abandoned.cancel()
+        # The other caller of a coalesced edit still gets it
+        shared.cancel()
+        results = await asyncio.gather(first, sharer)
+        await scheduler.shutdown()
+        return sent, results
+
+    sent, results = asyncio.run(scenario())
+    assert [text for _, _, text in sent] == ["message", "5 votes"]
+    assert results == ["message", "5 votes"]
@@ -0,0 +1,140 @@
+import asyncio
+
+from callbacks import KIND_PAGE, decode
+from pagination import PageCache
+
+
+class FakeClock:
+    def __init__(self):
+        self.now = 0.0
+
+    def __call__(self):
+        return self.now
+
+
+def buttons(page):
+    """Label -> decoded (kind, payload) of each button under a page."""
+    return {button.text: decode(button.callback_data) for button in page.keyboard.inline_keyboard[0]}
+
+
+def test_pages_hold_at_most_max_lines_and_max_chars():
+    async def scenario():
+        pages = PageCache(max_lines=3, max_chars=40)
+        query_id, first = await pages.open((f"line {index}" for index in range(8)), header="List:")
+        second = await pages.page(query_id, 1)
+        third = await pages.page(query_id, 2)
+        return first, second, third
+
+    first, second, third = asyncio.run(scenario())
+    assert first.text == "List:\nline 0\nline 1\nline 2"
+    assert second.text == "List:\nline 3\nline 4\nline 5"
+    assert third.text == "List:\nline 6\nline 7"
+    assert (first.has_next, second.has_next, third.has_next) == (True, True, False)
+    assert all(len(page.text) <= 40 for page in (first, second, third))
+
+
+def test_long_lines_are_cut_and_split_pages_by_size():
+    async def scenario():
+        pages = PageCache(max_lines=50, max_chars=40)
+        query_id, first = await pages.open(["a" * 15, "b" * 15, "c" * 100])
+        return first, await pages.page(query_id, 1)
+
+    first, second = asyncio.run(scenario())
+    assert first.text == "a" * 15 + "\n" + "b" * 15
+    # Lines longer than half a page are cut to fit
+    assert second.text == "c" * 19 + "…"
+    assert not second.has_next
+
+
+def test_source_is_only_read_as_far_as_the_viewed_pages():
+    read = []
+
+    def lines():
+        for index in range(1000):
+            read.append(index)
+            yield f"line {index}"
+
+    async def scenario():
+        pages = PageCache(max_lines=10)
+        query_id, _ = await pages.open(lines())
+        await pages.page(query_id, 1)
+
+    asyncio.run(scenario())
+    # Two pages, plus the line read ahead to know there is a third
+    assert len(read) == 21
+
+
+def test_next_and_prev_buttons_round_trip_to_their_pages():
+    async def scenario():
+        pages = PageCache(max_lines=2)
+        query_id, first = await pages.open(f"line {index}" for index in range(5))
+        assert set(buttons(first)) == {"1", "Next ▶"}
+
+        kind, position = buttons(first)["Next ▶"]
+        assert kind == KIND_PAGE and position.query_id == query_id
+        second = await pages.page(position.query_id, position.index)
+        assert second.text == "line 2\nline 3"
+        assert set(buttons(second)) == {"◀ Prev", "2", "Next ▶"}
+
+        _, position = buttons(second)["Next ▶"]
+        last = await pages.page(position.query_id, position.index)
+        # The total is known once the source is exhausted
+        assert set(buttons(last)) == {"◀ Prev", "3/3"}
+
+        _, position = buttons(last)["◀ Prev"]
+        again = await pages.page(position.query_id, position.index)
+        assert again.text == second.text
+        return pages.stats()
+
+    stats = asyncio.run(scenario())
+    assert stats["rendered"] == 3
+    assert stats["hits"] == 1
+
+
+def test_single_page_has_no_buttons():
+    async def scenario():
+        pages = PageCache()
+        return await pages.open(["only line"], header="List:")
+
+    _, page = asyncio.run(scenario())
+    assert page.text == "List:\nonly line"
+    assert page.keyboard is None
+
+
+def test_out_of_range_and_unknown_pages_are_none():
+    async def scenario():
+        pages = PageCache(max_lines=2)
+        query_id, _ = await pages.open(f"line {index}" for index in range(4))
+        return await pages.page(query_id, 2), await pages.page(query_id, 7), await pages.page("unknown", 0)
+
+    assert asyncio.run(scenario()) == (None, None, None)
+
+
+def test_queries_expire_after_the_ttl():
+    async def scenario():
+        clock = FakeClock()
+        pages = PageCache(max_lines=2, ttl=60, clock=clock)
+        query_id, _ = await pages.open(f"line {index}" for index in range(6))
+        clock.now = 60.0
+        assert await pages.page(query_id, 1) is not None
+        # Each view renews the TTL
+        clock.now = 121.0
+        assert await pages.page(query_id, 0) is None
+        return pages.stats()
+
+    stats = asyncio.run(scenario())
+    assert (stats["queries"], stats["expired"]) == (0, 1)
+
+
+def test_least_recently_viewed_query_is_evicted():
+    async def scenario():
+        pages = PageCache(max_queries=2)
+        first, _ = await pages.open(["a"])
+        second, _ = await pages.open(["b"])
+        await pages.page(first, 0)
+        await pages.open(["c"])
+        return await pages.page(first, 0), await pages.page(second, 0)
+
+    kept, evicted = asyncio.run(scenario())
+    assert kept.text == "a"
+    assert evicted is None
@@ -0,0 +1,55 @@
+import asyncio
+
+import pytest
+
+from response_cache import ResponseCache
+
+
+def test_waiters_fetch_again_when_the_leading_fetch_is_cancelled():
+    async def scenario():
+        cache = ResponseCache({"votes": 5})
+        calls = []
+        release = asyncio.Event()
+
+        async def fetch():
+            calls.append(len(calls))
+            if len(calls) == 1:
+                await release.wait()
+            return "counts", True
+
+        leader = asyncio.create_task(cache.get("votes", 1, fetch))
+        await asyncio.sleep(0)
+        waiters = [asyncio.create_task(cache.get("votes", 1, fetch)) for _ in range(3)]
+        await asyncio.sleep(0)
+        leader.cancel()
+        results = await asyncio.wait_for(asyncio.gather(*waiters), timeout=1)
+        with pytest.raises(asyncio.CancelledError):
+            await leader
+        return results, calls, cache.stats()
+
+    results, calls, stats = asyncio.run(scenario())
+    assert results == ["counts"] * 3
+    # One waiter fetched again, the other two shared its fetch
+    assert len(calls) == 2
+    assert stats["entries"] == 1
+
+
+def test_cancelled_waiter_leaves_the_fetch_running():
+    async def scenario():
+        cache = ResponseCache({"votes": 5})
+        release = asyncio.Event()
+
+        async def fetch():
+            await release.wait()
+            return "counts", True
+
+        leader = asyncio.create_task(cache.get("votes", 1, fetch))
+        await asyncio.sleep(0)
+        waiter = asyncio.create_task(cache.get("votes", 1, fetch))
+        await asyncio.sleep(0)
+        waiter.cancel()
+        await asyncio.sleep(0)
+        release.set()
+        return await leader, waiter.cancelled()
+
+    assert asyncio.run(scenario()) == ("counts", True)
@@ -0,0 +1,74 @@
+import asyncio
+import json
+
+from sharding import KIND_UPDATE, ShardFront, read_frame
+
+
+async def stalled_worker():
+    """A worker that accepts the front's connection and never reads from it."""
+    connections = []
+
+    async def handle(reader, writer):
+        connections.append(writer)
+        await asyncio.Event().wait()
+
+    server = await asyncio.start_server(handle, "127.0.0.1", 0)
+    return server, server.sockets[0].getsockname()[1], connections
+
+
+async def reading_worker(received):
+    async def handle(reader, writer):
+        while (frame := await read_frame(reader)) is not None:
+            received.append(frame)
+
+    server = await asyncio.start_server(handle, "127.0.0.1", 0)
+    return server, server.sockets[0].getsockname()[1]
+
+
+def update_for_chat(chat_id, padding=0):
+    return json.dumps({"update_id": 1, "message": {"chat": {"id": chat_id}, "text": "x" * padding}}).encode()
+
+
+def test_backed_up_worker_gets_503_without_stalling_the_others():
+    async def scenario():
+        stalled, stalled_port, connections = await stalled_worker()
+        received = []
+        healthy, healthy_port = await reading_worker(received)
+        front = ShardFront([("127.0.0.1", stalled_port), ("127.0.0.1", healthy_port)], forward_timeout=0.2)
+        stalled_chat = next(chat for chat in range(1000) if front.ring.node_for(chat) == 0)
+        healthy_chat = next(chat for chat in range(1000) if front.ring.node_for(chat) == 1)
+
+        # Fill the socket buffers towards the stalled worker until forwarding times out
+        statuses = []
+        for _ in range(100):
+            response = await front._respond(b"POST /telegram HTTP/1.1", {}, update_for_chat(stalled_chat, 500000))
+            statuses.append(response.split(b"\r\n")[0])
+            if statuses[-1] != b"HTTP/1.1 200 OK":
+                break
+
+        # Requests waiting behind the stalled link give up too, instead of queueing on its lock
+        waiting = await asyncio.gather(*(
+            front._respond(b"POST /telegram HTTP/1.1", {}, update_for_chat(stalled_chat)) for _ in range(5)
+        ))
+        started = asyncio.get_running_loop().time()
+        healthy_response = await front._respond(b"POST /telegram HTTP/1.1", {}, update_for_chat(healthy_chat))
+        healthy_elapsed = asyncio.get_running_loop().time() - started
+        await asyncio.sleep(0.05)
+
+        stats = front.stats()
+        # The stalled worker goes first, or closing the front would wait for it to read its buffer
+        for writer in connections:
+            writer.close()
+        await asyncio.sleep(0.05)
+        await front.stop()
+        for server in (stalled, healthy):
+            server.close()
+        return statuses, waiting, healthy_response, healthy_elapsed, received, stats
+
+    statuses, waiting, healthy_response, healthy_elapsed, received, stats = asyncio.run(scenario())
+    assert statuses[-1] == b"HTTP/1.1 503 Service Unavailable"
+    assert all(response.startswith(b"HTTP/1.1 503") for response in waiting)
+    assert healthy_response.startswith(b"HTTP/1.1 200 OK")
+    assert healthy_elapsed < 0.1
+    assert [kind for kind, _ in received] == [KIND_UPDATE]
+    assert stats["failed"] == 1 + len(waiting)
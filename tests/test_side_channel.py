@@ -0,0 +1,110 @@
+import asyncio
+import time
+
+from side_channel import HEADER, VOTE_RECORDED, SideChannelServer, encode_frame, read_frame
+
+
+async def start_server():
+    server = SideChannelServer("127.0.0.1", 0)
+    await server.start()
+    return server, server._server.sockets[0].getsockname()[1]
+
+
+async def send_events(port, events):
+    reader, writer = await asyncio.open_connection("127.0.0.1", port)
+    answers = []
+    for event in events:
+        writer.write(encode_frame(event))
+        await writer.drain()
+        answers.append(await read_frame(reader))
+    writer.close()
+    await writer.wait_closed()
+    return answers
+
+
+def test_hundreds_of_concurrent_connections():
+    connections, per_connection = 300, 10
+
+    async def scenario():
+        server, port = await start_server()
+        seen = []
+
+        async def on_vote(event):
+            seen.append((event["battleId"], event["trackNumber"]))
+        server.on(VOTE_RECORDED, on_vote)
+
+        # Every connection is opened before any of them sends
+        opened = [await asyncio.open_connection("127.0.0.1", port) for _ in range(connections)]
+        await asyncio.sleep(0.1)
+        peak = server.connections
+
+        async def backend_process(index, reader, writer):
+            answers = []
+            for sequence in range(per_connection):
+                writer.write(encode_frame({"type": VOTE_RECORDED, "battleId": index, "trackNumber": sequence}))
+                await writer.drain()
+                answers.append(await read_frame(reader))
+            writer.close()
+            await writer.wait_closed()
+            return answers
+
+        started = time.perf_counter()
+        answers = await asyncio.gather(*(
+            backend_process(index, reader, writer) for index, (reader, writer) in enumerate(opened)
+        ))
+        elapsed = time.perf_counter() - started
+        await asyncio.sleep(0.05)
+        remaining = server.connections
+        await server.stop()
+        return peak, answers, seen, server.events_received, remaining, elapsed
+
+    peak, answers, seen, received, remaining, elapsed = asyncio.run(scenario())
+    assert peak == connections
+    assert all(answer == {"ok": True} for per_process in answers for answer in per_process)
+    assert received == connections * per_connection
+    # Each connection's events are handled in the order it sent them
+    for index in range(connections):
+        assert [sequence for battle_id, sequence in seen if battle_id == index] == list(range(per_connection))
+    assert remaining == 0
+    assert elapsed < 10
+
+
+def test_slow_handler_does_not_hold_up_other_connections():
+    async def scenario():
+        server, port = await start_server()
+
+        async def on_vote(event):
+            if event["battleId"] == 0:
+                await asyncio.sleep(0.5)
+        server.on(VOTE_RECORDED, on_vote)
+
+        slow = asyncio.create_task(send_events(port, [{"type": VOTE_RECORDED, "battleId": 0}]))
+        await asyncio.sleep(0.05)
+        started = time.perf_counter()
+        await asyncio.gather(*(send_events(port, [{"type": VOTE_RECORDED, "battleId": n}]) for n in range(1, 50)))
+        elapsed = time.perf_counter() - started
+        await slow
+        await server.stop()
+        return elapsed
+
+    assert asyncio.run(scenario()) < 0.4
+
+
+def test_bad_frames_are_answered_and_dropped():
+    async def scenario():
+        server, port = await start_server()
+        missing_type = await send_events(port, [{"battleId": 1}, {"type": "unknown"}])
+
+        reader, writer = await asyncio.open_connection("127.0.0.1", port)
+        writer.write(HEADER.pack(1 << 20))
+        await writer.drain()
+        oversized = await read_frame(reader)
+        closed = await reader.read()
+        writer.close()
+        await server.stop()
+        return missing_type, oversized, closed
+
+    missing_type, oversized, closed = asyncio.run(scenario())
+    assert missing_type == [{"ok": False, "error": "Missing event type"}, {"ok": True}]
+    assert oversized["ok"] is False
+    assert closed == b""
@@ -0,0 +1,155 @@
+import asyncio
+import time
+
+from spotify_client import DEFAULT_RETRY_AFTER, SpotifyClient, retry_after_seconds
+from stubs import FakeSpotify
+
+
+class FakeClock:
+    def __init__(self):
+        self.now = 0.0
+        self.sleeps = []
+
+    def __call__(self):
+        return self.now
+
+    async def sleep(self, delay):
+        self.sleeps.append(delay)
+        self.now += delay
+        await asyncio.sleep(0)
+
+
+class RecordingSpotify(FakeSpotify):
+    """A FakeSpotify noting the clock time and status of each search, and how many overlap."""
+
+    def __init__(self, clock=time.monotonic, **kwargs):
+        super().__init__(**kwargs)
+        self.clock = clock
+        self.searches = []
+        self.in_flight = 0
+        self.peak_in_flight = 0
+
+    async def _dispatch(self, method, target, headers, body):
+        if not target.startswith("/v1/search"):
+            return await super()._dispatch(method, target, headers, body)
+        arrived = self.clock()
+        self.in_flight += 1
+        self.peak_in_flight = max(self.peak_in_flight, self.in_flight)
+        try:
+            response = await super()._dispatch(method, target, headers, body)
+        finally:
+            self.in_flight -= 1
+        self.searches.append((arrived, response[0]))
+        return response
+
+
+def make_client(spotify, **kwargs):
+    return SpotifyClient("client", "secret", api_url=spotify.url + "/v1", token_url=spotify.url + "/api/token",
+                         **kwargs)
+
+
+def test_retry_after_falls_back_to_the_default_delay():
+    assert retry_after_seconds("2") == 2.0
+    assert retry_after_seconds(None) == DEFAULT_RETRY_AFTER
+    assert retry_after_seconds("Wed, 21 Oct 2015 07:28:00 GMT") == DEFAULT_RETRY_AFTER
+
+
+def test_refresh_loop_renews_the_token_before_it_expires():
+    async def scenario():
+        spotify = FakeSpotify(token_ttl=1)
+        await spotify.start()
+        client = make_client(spotify, rate=100.0, burst=100)
+        client.start()
+        try:
+            # Tokens live 1s, so the loop renews them every 0.5s
+            deadline = time.monotonic() + 1.3
+            while time.monotonic() < deadline:
+                await client.search("genre:pop")
+                await asyncio.sleep(0.05)
+        finally:
+            await client.close()
+            await spotify.stop()
+        assert client.token_refreshes >= 3
+        assert spotify.calls["unauthorized"] == 0
+
+    asyncio.run(scenario())
+
+
+def test_a_rejected_token_is_fetched_again():
+    async def scenario():
+        spotify = FakeSpotify()
+        await spotify.start()
+        client = make_client(spotify)
+        try:
+            await client.search("genre:pop")
+            # Spotify revokes the token long before its expiry
+            spotify._tokens.clear()
+            page = await client.search("genre:pop", limit=5)
+        finally:
+            await client.close()
+            await spotify.stop()
+        assert [track["id"] for track in page["tracks"]["items"]] == [f"pop-{index}" for index in range(5)]
+        assert spotify.calls["unauthorized"] == 1
+        assert spotify.calls["token"] == 2
+        assert client.token_refreshes == 2
+        assert client.errors == 0
+
+    asyncio.run(scenario())
+
+
+def test_a_429_pauses_every_caller_through_the_shared_bucket():
+    async def scenario():
+        clock = FakeClock()
+        spotify = RecordingSpotify(clock=clock, throttle_every=3, retry_after=2)
+        await spotify.start()
+        client = make_client(spotify, max_concurrency=1, clock=clock, sleep=clock.sleep)
+        try:
+            pages = await asyncio.gather(*(client.search(f"genre:{genre}", limit=1) for genre in "abcde"))
+        finally:
+            await client.close()
+            await spotify.stop()
+        assert [page["tracks"]["items"][0]["id"] for page in pages] == [f"{genre}-0" for genre in "abcde"]
+        assert client.throttled == spotify.calls["throttled"] >= 1
+        # No search, from any caller, reaches Spotify before the pause has run out
+        for index, (arrived, status) in enumerate(spotify.searches):
+            if status == 429:
+                assert all(later >= arrived + 2 for later, _ in spotify.searches[index + 1:])
+
+    asyncio.run(scenario())
+
+
+def test_an_http_date_retry_after_pauses_for_the_default_delay():
+    async def scenario():
+        clock = FakeClock()
+        spotify = RecordingSpotify(clock=clock, throttle_every=2, retry_after="Wed, 21 Oct 2015 07:28:00 GMT")
+        await spotify.start()
+        client = make_client(spotify, clock=clock, sleep=clock.sleep)
+        try:
+            await client.search("genre:pop")
+            page = await client.search("genre:pop")
+        finally:
+            await client.close()
+            await spotify.stop()
+        assert page["tracks"]["items"]
+        assert [status for _, status in spotify.searches] == [200, 429, 200]
+        assert spotify.searches[2][0] - spotify.searches[1][0] == DEFAULT_RETRY_AFTER
+
+    asyncio.run(scenario())
+
+
+def test_pages_after_the_first_are_fetched_concurrently():
+    async def scenario():
+        spotify = RecordingSpotify(latency=0.05)
+        await spotify.start()
+        client = make_client(spotify, max_concurrency=4)
+        try:
+            tracks = await client.search_tracks("genre:pop", 200, page_size=50)
+        finally:
+            await client.close()
+            await spotify.stop()
+        assert [track["id"] for track in tracks] == [f"pop-{index}" for index in range(200)]
+        assert spotify.calls["search"] == 4
+        # The first page gives the total; the other three go out together
+        assert spotify.peak_in_flight == 3
+
+    asyncio.run(scenario())
@@ -0,0 +1,39 @@
+"""
+Startup budgets of the bot, measured in fresh interpreters so the imports
+are not already cached by the test run.
+"""
+import json
+import os
+import subprocess
+import sys
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+# Placeholder credentials: bot.py reads its config at import, and every service is stubbed
+ENVIRONMENT = {**os.environ, "BOT_TOKEN": "123456:STARTUP", "SPOTIFY_CLIENT_ID": "startup", "SPOTIFY_CLIENT_SECRET": "secret"}
+
+# Cumulative `python -X importtime` of bot.py
+IMPORT_BUDGET_MS = 400
+# From building the Application to the first handled update, including the genre track warm-up
+FIRST_UPDATE_BUDGET_MS = 750
+
+
+def run(*args):
+    return subprocess.run(
+        [sys.executable, *args], capture_output=True, text=True, check=True, cwd=ROOT, env=ENVIRONMENT, timeout=60
+    )
+
+
+def test_importing_bot_stays_within_budget():
+    stderr = run("-X", "importtime", "-c", "import bot").stderr
+    # "import time: <self us> | <cumulative us> | <module>", innermost modules first
+    cumulative_us = next(
+        int(fields[1]) for fields in (line.split("|") for line in reversed(stderr.splitlines()))
+        if len(fields) == 3 and fields[2].strip() == "bot"
+    )
+    assert cumulative_us / 1000 < IMPORT_BUDGET_MS
+
+
+def test_first_update_is_handled_within_budget():
+    report = json.loads(run("loadtest.py", "--count", "1", "--battles", "0", "--users", "1").stdout)
+    assert report["handler_errors"] == {}
+    assert report["startup_ms"]["first_update"] < FIRST_UPDATE_BUDGET_MS
@@ -0,0 +1,127 @@
+import asyncio
+from collections import Counter
+
+from track_cache import GenreTrackCache
+
+
+class FakeClock:
+    def __init__(self):
+        self.now = 0.0
+
+    def __call__(self):
+        return self.now
+
+
+class FakeTrackClient:
+    """Answers `search_tracks` like SpotifyClient, counting the calls per query."""
+
+    def __init__(self):
+        self.calls = Counter()
+        self.release = None
+        self.failing = False
+
+    async def search_tracks(self, query, total):
+        self.calls[query] += 1
+        if self.release is not None:
+            await self.release.wait()
+        if self.failing:
+            raise RuntimeError("Spotify is down")
+        genre = query.split(":", 1)[-1]
+        return [{"id": f"{genre}-{index}-{self.calls[query]}"} for index in range(total)]
+
+
+def make_cache(**kwargs):
+    client = FakeTrackClient()
+    clock = FakeClock()
+    return GenreTrackCache(client, pool_size=3, clock=clock, **kwargs), client, clock
+
+
+def test_pools_are_fetched_again_once_their_ttl_has_passed():
+    async def scenario():
+        cache, client, clock = make_cache(ttl=100)
+        first = await cache.get("pop")
+        clock.now = 99.0
+        assert await cache.get("pop") is first
+        clock.now = 100.0
+        assert await cache.get("pop") != first
+        return client.calls, cache.stats()
+
+    calls, stats = asyncio.run(scenario())
+    assert calls == {"genre:pop": 2}
+    assert (stats["hits"], stats["misses"]) == (1, 2)
+
+
+def test_least_recently_used_genre_is_evicted():
+    async def scenario():
+        cache, client, _ = make_cache(max_genres=2)
+        await cache.get("pop")
+        await cache.get("rock")
+        # A hit makes pop the most recently used, so rock goes first
+        await cache.get("pop")
+        await cache.get("jazz")
+        assert cache.stats()["genres"] == 2
+        await cache.get("pop")
+        await cache.get("rock")
+        return client.calls
+
+    assert asyncio.run(scenario()) == {"genre:pop": 1, "genre:rock": 2, "genre:jazz": 1}
+
+
+def test_concurrent_misses_share_one_spotify_call():
+    async def scenario():
+        cache, client, _ = make_cache()
+        client.release = asyncio.Event()
+        waiters = [asyncio.create_task(cache.get("pop")) for _ in range(5)]
+        await asyncio.sleep(0)
+        client.release.set()
+        results = await asyncio.gather(*waiters)
+        return results, client.calls, cache.stats()
+
+    results, calls, stats = asyncio.run(scenario())
+    assert all(result is results[0] for result in results)
+    assert calls == {"genre:pop": 1}
+    assert stats["misses"] == 5
+
+
+def test_refresh_loop_renews_only_pools_about_to_expire():
+    async def scenario():
+        cache, client, clock = make_cache(ttl=100, refresh_margin=10, refresh_interval=0.01)
+        await cache.get("pop")
+        clock.now = 50.0
+        await cache.get("rock")
+        # pop is within the refresh margin of its TTL, rock is not
+        clock.now = 95.0
+        cache.start()
+        try:
+            while cache.refreshes < 1:
+                await asyncio.sleep(0.01)
+        finally:
+            await cache.stop()
+        assert cache._pools["pop"].fetched_at == 95.0
+        # The refreshed pool is served without a miss
+        clock.now = 150.0
+        await cache.get("pop")
+        return client.calls, cache.stats()
+
+    calls, stats = asyncio.run(scenario())
+    assert calls == {"genre:pop": 2, "genre:rock": 1}
+    assert stats["refreshes"] == 1
+    assert (stats["hits"], stats["misses"]) == (1, 2)
+
+
+def test_failed_refresh_keeps_the_old_pool():
+    async def scenario():
+        cache, client, clock = make_cache(ttl=100, refresh_margin=10, refresh_interval=0.01)
+        tracks = await cache.get("pop")
+        client.failing = True
+        clock.now = 95.0
+        cache.start()
+        try:
+            while cache.refresh_errors < 1:
+                await asyncio.sleep(0.01)
+        finally:
+            await cache.stop()
+        return tracks, await cache.get("pop")
+
+    tracks, served = asyncio.run(scenario())
+    assert served is tracks
@@ -0,0 +1,114 @@
+import asyncio
+import random
+import time
+
+from telegram import Update
+
+from update_processor import OrderedUpdateProcessor
+
+
+def message_update(update_id, chat_id, user_id):
+    return Update.de_json({
+        "update_id": update_id,
+        "message": {
+            "message_id": update_id,
+            "date": 0,
+            "chat": {"id": chat_id, "type": "group" if chat_id < 0 else "private"},
+            "from": {"id": user_id, "is_bot": False, "first_name": "Voter"},
+            "text": "/votetrack",
+        },
+    }, None)
+
+
+class Recorder:
+    """Handlers that log when they run, and check no two updates of a key overlap."""
+
+    def __init__(self, seed=0):
+        self.rng = random.Random(seed)
+        self.started = []
+        self.running = set()
+        self.overlaps = 0
+
+    async def handle(self, update_id, keys, duration):
+        if self.running & set(keys):
+            self.overlaps += 1
+        self.running.update(keys)
+        self.started.append(update_id)
+        await asyncio.sleep(duration)
+        self.running.difference_update(keys)
+
+
+async def process_all(processor, recorder, updates, duration=lambda: 0.01):
+    tasks = [
+        asyncio.create_task(processor.process_update(
+            update,
+            recorder.handle(update.update_id, [("chat", update.effective_chat.id), ("user", update.effective_user.id)],
+                            duration()),
+        ))
+        for update in updates
+    ]
+    await asyncio.gather(*tasks)
+
+
+def test_interleaved_chats_keep_their_order_and_run_concurrently():
+    chats, per_chat = 50, 20
+
+    async def scenario():
+        processor = OrderedUpdateProcessor(max_workers=16, max_pending=2000)
+        recorder = Recorder()
+        # Round-robin across the chats, so every chat's updates are interleaved with the others'
+        updates = [
+            message_update(sequence * chats + chat, chat, chat)
+            for sequence in range(per_chat) for chat in range(1, chats + 1)
+        ]
+        started = time.perf_counter()
+        await process_all(processor, recorder, updates, lambda: recorder.rng.uniform(0.005, 0.015))
+        return recorder, processor.stats(), time.perf_counter() - started
+
+    recorder, stats, elapsed = asyncio.run(scenario())
+    assert recorder.overlaps == 0
+    for chat in range(1, chats + 1):
+        order = [update_id for update_id in recorder.started if update_id % chats == chat % chats]
+        assert order == sorted(order)
+    assert stats["processed"] == chats * per_chat
+    assert stats["ordered_keys"] == 0
+    # 1000 updates of ~10ms each: ~10s one at a time, ~0.6s on 16 workers
+    assert elapsed < 2.5
+    assert stats["peak_pending"] > 16
+
+
+def test_user_order_is_kept_across_chats():
+    async def scenario():
+        processor = OrderedUpdateProcessor(max_workers=16)
+        recorder = Recorder()
+        # One user pressing buttons in several groups: a slow first press must not be overtaken
+        updates = [message_update(update_id, -100 - update_id, 7) for update_id in range(10)]
+        durations = iter([0.05] + [0.001] * 9)
+        await process_all(processor, recorder, updates, lambda: next(durations))
+        return recorder
+
+    recorder = asyncio.run(scenario())
+    assert recorder.started == list(range(10))
+    assert recorder.overlaps == 0
+
+
+def test_busy_chat_does_not_hold_workers_from_other_chats():
+    async def scenario():
+        processor = OrderedUpdateProcessor(max_workers=4)
+        recorder = Recorder()
+        updates = [message_update(update_id, 1, update_id) for update_id in range(50)]
+        updates.append(message_update(50, 2, 50))
+        finished = {}
+
+        async def timed(update):
+            await process_all(processor, recorder, [update])
+            finished[update.update_id] = time.perf_counter()
+
+        started = time.perf_counter()
+        await asyncio.gather(*(timed(update) for update in updates))
+        return {update_id: at - started for update_id, at in finished.items()}
+
+    finished = asyncio.run(scenario())
+    # The other chat's update runs right away instead of after the busy chat's 50
+    assert finished[50] < 0.1
+    assert finished[49] > 0.4
@@ -0,0 +1,177 @@
+import asyncio
+
+from backend_client import BackendClient
+from stubs import StubBackend
+from vote_queue import VoteNotSentError, VoteQueue
+
+
+class Backend:
+    """The stub backend behind a BackendClient, counting vote requests in flight."""
+
+    def __init__(self, latency=0.0):
+        self.stub = StubBackend(latency=latency)
+        self.in_flight = 0
+        self.peak_in_flight = 0
+
+    async def __aenter__(self):
+        await self.stub.start()
+        self.client = BackendClient(self.stub.url, timeout=5.0)
+        self.stub.start_battle({"track1": "A", "track2": "B", "paymentAmount": "0.1"})
+        return self
+
+    async def __aexit__(self, *exc_info):
+        await self.client.close()
+        await self.stub.stop()
+
+    async def post(self, path, payload):
+        self.in_flight += 1
+        self.peak_in_flight = max(self.peak_in_flight, self.in_flight)
+        try:
+            response = await self.client.post(path, payload)
+        finally:
+            self.in_flight -= 1
+        return response.status_code, response.json()
+
+    async def send(self, payload):
+        return await self.post("/votetrack", payload)
+
+    async def send_batch(self, payloads):
+        status, data = await self.post("/votetrack/batch", {"votes": payloads})
+        return [(entry["status"], entry["body"]) for entry in data["results"]]
+
+
+def vote(user, battle_id=1, track=1):
+    return {"battleId": battle_id, "trackNumber": track, "userAddress": f"0x{user:040x}", "paymentAmount": "0.1"}
+
+
+def test_double_clicks_reach_the_backend_once():
+    async def scenario():
+        async with Backend(latency=0.02) as backend:
+            queue = VoteQueue(backend.send)
+            presses = await asyncio.gather(*(queue.submit("user", 1, vote(1)) for _ in range(20)))
+            later = await queue.submit("user", 1, vote(1, track=2))
+            return presses, later, queue.stats(), backend.stub.calls["vote"]
+
+    presses, later, stats, backend_calls = asyncio.run(scenario())
+    assert backend_calls == 1
+    assert [press.duplicate for press in presses].count(False) == 1
+    assert all(press[1]["transactionHash"] for press in presses)
+    # A user who has voted is answered without a network call
+    assert later.duplicate and later[1]["message"] == "You have already voted in this battle."
+    assert stats["deduplicated"] == 20
+    assert stats["backend_calls"] == 1
+
+
+def test_backend_requests_in_flight_are_bounded():
+    async def scenario():
+        async with Backend(latency=0.02) as backend:
+            queue = VoteQueue(backend.send, max_in_flight=4)
+            results = await asyncio.gather(*(queue.submit(user, 1, vote(user)) for user in range(40)))
+            return results, backend.peak_in_flight, backend.stub.calls["vote"]
+
+    results, peak_in_flight, backend_calls = asyncio.run(scenario())
+    assert all(status == 200 and data["transactionHash"] for status, data in results)
+    assert backend_calls == 40
+    assert peak_in_flight == 4
+
+
+def test_batches_answer_each_vote_separately():
+    async def scenario():
+        async with Backend() as backend:
+            queue = VoteQueue(backend.send, backend.send_batch, batch_size=20, batch_window=0.01)
+            votes = [queue.submit(user, 1, vote(user)) for user in range(30)]
+            # Votes for an unknown battle and with an invalid track fail on their own
+            votes.append(queue.submit(100, 999, vote(100, battle_id=999)))
+            votes.append(queue.submit(101, 1, vote(101, track=3)))
+            results = await asyncio.gather(*votes)
+            return results, queue.stats(), backend.stub.calls
+
+    results, stats, calls = asyncio.run(scenario())
+    assert [status for status, _ in results] == [200] * 30 + [500, 400]
+    assert stats["backend_calls"] == calls["vote_batch"] == 2
+    assert calls["vote"] == 0
+
+
+class StalledBackend:
+    """A sender whose requests never get an answer."""
+
+    def __init__(self):
+        self.calls = 0
+
+    async def send(self, payload):
+        self.calls += 1
+        await asyncio.Event().wait()
+
+    async def send_batch(self, payloads):
+        return await self.send(payloads)
+
+
+def test_send_tasks_are_kept_until_they_finish():
+    async def scenario():
+        release = asyncio.Event()
+
+        async def send(payload):
+            await release.wait()
+            return 200, {"transactionHash": "0xabc"}
+
+        queue = VoteQueue(send)
+        vote_task = asyncio.create_task(queue.submit("user", 1, vote(1)))
+        await asyncio.sleep(0)
+        in_flight = len(queue._tasks)
+        release.set()
+        result = await vote_task
+        await asyncio.sleep(0)
+        return in_flight, result, len(queue._tasks)
+
+    in_flight, result, remaining = asyncio.run(scenario())
+    assert in_flight == 1
+    assert result == (200, {"transactionHash": "0xabc"})
+    assert remaining == 0
+
+
+def test_close_answers_every_waiting_voter():
+    async def scenario():
+        backend = StalledBackend()
+        queue = VoteQueue(backend.send)
+        # The second press of the first user waits on the first one's request
+        votes = [asyncio.create_task(queue.submit(user, 1, vote(user))) for user in (1, 1, 2)]
+        await asyncio.sleep(0.01)
+        await queue.close()
+        results = await asyncio.wait_for(asyncio.gather(*votes, return_exceptions=True), timeout=1)
+        return backend.calls, results, queue._tasks, queue.stats()
+
+    calls, results, tasks, stats = asyncio.run(scenario())
+    assert calls == 2
+    assert all(isinstance(result, VoteNotSentError) for result in results)
+    assert not tasks
+    assert stats["in_flight"] == 0
+
+
+def test_close_answers_batched_and_pending_votes():
+    async def scenario():
+        backend = StalledBackend()
+        queue = VoteQueue(backend.send, backend.send_batch, batch_size=2, batch_window=60)
+        # Two votes fill a batch that is sent, the third waits for the next one
+        votes = [asyncio.create_task(queue.submit(user, 1, vote(user))) for user in range(3)]
+        await asyncio.sleep(0.01)
+        await queue.close()
+        return backend.calls, await asyncio.wait_for(asyncio.gather(*votes, return_exceptions=True), timeout=1)
+
+    calls, results = asyncio.run(scenario())
+    assert calls == 1
+    assert all(isinstance(result, VoteNotSentError) for result in results)
+
+
+def test_a_cancelled_send_does_not_leave_the_voter_waiting():
+    async def scenario():
+        queue = VoteQueue(StalledBackend().send)
+        vote_task = asyncio.create_task(queue.submit("user", 1, vote(1)))
+        await asyncio.sleep(0.01)
+        for task in list(queue._tasks):
+            task.cancel()
+        try:
+            await asyncio.wait_for(vote_task, timeout=1)
+        except VoteNotSentError:
+            return "not sent"
+
+    assert asyncio.run(scenario()) == "not sent"
@@ -0,0 +1,63 @@
+import asyncio
+
+from outbound import OutboundScheduler, PRIORITY_LOW
+from vote_tally import EditDebouncer, benchmark
+
+
+class SimulatedTime:
+    def __init__(self):
+        self.now = 0.0
+
+    def __call__(self):
+        return self.now
+
+    async def sleep(self, seconds):
+        self.now += seconds
+        await asyncio.sleep(0)
+
+
+def test_cancelled_keyboard_refresh_does_not_follow_the_close_edit():
+    async def scenario():
+        time = SimulatedTime()
+        scheduler = OutboundScheduler(global_rate=1.0, global_burst=1, clock=time, sleep=time.sleep)
+        debouncer = EditDebouncer(interval=2.0, clock=time)
+        sent = []
+
+        def edit(text, endpoint, priority=None):
+            async def callback():
+                sent.append(text)
+            rate_limit_args = {"priority": priority} if priority is not None else None
+            data = {"chat_id": -100, "message_id": 7}
+            return scheduler.process_request(callback, (), {}, endpoint, data, rate_limit_args)
+
+        # Throttled, so the refresh waits in the low priority lane
+        busy = asyncio.ensure_future(edit("other message", "sendMessage"))
+
+        async def render():
+            await edit("vote keyboard", "editMessageReplyMarkup", PRIORITY_LOW)
+        debouncer.schedule((-100, 7), render)
+        for _ in range(3):
+            await asyncio.sleep(0)
+
+        debouncer.cancel((-100, 7))
+        await edit("voting has closed", "editMessageText")
+        await busy
+        for _ in range(3):
+            await asyncio.sleep(0)
+        await scheduler.shutdown()
+        return sent
+
+    assert asyncio.run(scenario()) == ["other message", "voting has closed"]
+
+
+def test_vote_storm_costs_a_few_reads_and_one_edit_per_interval():
+    result = asyncio.run(benchmark(votes=3000, duration=60, messages=5, edit_interval=2.0, reconcile_interval=30.0))
+    after = result["after"]
+    # Reads only to reconcile, instead of one per vote
+    assert after["backend_reads"] <= 3
+    # At most one edit per message per interval, instead of one per vote
+    assert after["edits"] <= 5 * (60 / 2.0 + 2)
+    assert after["max_edits_per_message_minute"] <= 60 / 2.0 + 1
+    # Votes the bot missed are brought back by reconciliation, and every message ends up current
+    assert result["missed_votes"] > 0
+    assert result["all_messages_current"]
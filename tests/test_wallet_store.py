@@ -0,0 +1,38 @@
+import asyncio
+import json
+
+from wallet_store import JsonWalletStore
+
+
+def test_torn_journal_tail_is_cut_before_the_next_append(tmp_path):
+    snapshot = tmp_path / "wallets.json"
+    journal = tmp_path / "wallets.journal"
+    # A crash in the middle of appending user 2's entry
+    journal.write_text(
+        json.dumps({"user_id": "1", "wallet": "0x1", "user_info": "one"}) + "\n" + '{"user_id": "2", "wal'
+    )
+
+    async def recover_and_write():
+        store = JsonWalletStore(str(snapshot), flush_delay=0)
+        store.load()
+        assert await store.get("1") == {"wallet": "0x1", "user_info": "one"}
+        assert await store.get("2") is None
+        await store.set("3", "0x3", "three")
+        await store.journal.flush()
+
+    asyncio.run(recover_and_write())
+    assert [json.loads(line)["user_id"] for line in journal.read_text().splitlines()] == ["1", "3"]
+
+    # The wallet set after the recovery survives the next restart
+    store = JsonWalletStore(str(snapshot))
+    store.load()
+    assert asyncio.run(store.get("3")) == {"wallet": "0x3", "user_info": "three"}
+
+
+def test_whole_entry_missing_its_line_end_is_kept(tmp_path):
+    journal = tmp_path / "wallets.journal"
+    journal.write_text(json.dumps({"user_id": "1", "wallet": "0x1", "user_info": "one"}))
+    store = JsonWalletStore(str(tmp_path / "wallets.json"))
+    store.load()
+    assert store.mapping == {"1": {"wallet": "0x1", "user_info": "one"}}
+    assert journal.read_text().endswith("}\n")
@@ -0,0 +1,143 @@
+"""
+Per-genre Spotify track pools kept in memory.
+
+Battle creation samples tracks from these pools instead of hitting the
+Spotify search API on every genre button press. Pools expire after a TTL,
+the least recently used genres are evicted once the cache is full, and a
+background task refreshes pools shortly before they expire.
+"""
+import asyncio
+import logging
+import time
+from collections import OrderedDict
+
+from metrics import stage
+
+logger = logging.getLogger(__name__)
+
+
+class TrackPool:
+    """Tracks cached for one genre."""
+
+    __slots__ = ("tracks", "fetched_at")
+
+    def __init__(self, tracks, fetched_at):
+        self.tracks = tracks
+        self.fetched_at = fetched_at
+
+
+class GenreTrackCache:
+    """TTL + LRU cache of track pools keyed by genre.
+
+    `client` is anything with an async `search_tracks(query, total)` method
+    returning track dicts, normally a `spotify_client.SpotifyClient`.
+    """
+
+    def __init__(
+        self,
+        client,
+        pool_size=200,
+        ttl=3600,
+        max_genres=32,
+        refresh_margin=300,
+        refresh_interval=60,
+        clock=time.monotonic,
+    ):
+        self.client = client
+        self.pool_size = pool_size
+        self.ttl = ttl
+        self.max_genres = max_genres
+        self.refresh_margin = refresh_margin
+        self.refresh_interval = refresh_interval
+        self.clock = clock
+
+        self.hits = 0
+        self.misses = 0
+        self.refreshes = 0
+        self.refresh_errors = 0
+
+        self._pools = OrderedDict()
+        self._inflight = {}
+        self._refresh_task = None
+
+    async def get(self, genre):
+        """Returns the cached track pool for a genre, fetching it on a miss."""
+        pool = self._pools.get(genre)
+        if pool is not None and self.clock() - pool.fetched_at < self.ttl:
+            self.hits += 1
+            self._pools.move_to_end(genre)
+            return pool.tracks
+
+        self.misses += 1
+        return await self._load(genre)
+
+    async def warm(self, genres):
+        """Fetches the pools for the given genres ahead of the first request."""
+        results = await asyncio.gather(*(self._load(genre) for genre in genres), return_exceptions=True)
+        for genre, result in zip(genres, results):
+            if isinstance(result, Exception):
+                logger.error(f"Failed to warm track pool for {genre}: {result}")
+
+    def stats(self):
+        """Returns the cache counters."""
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "refreshes": self.refreshes,
+            "refresh_errors": self.refresh_errors,
+            "genres": len(self._pools),
+        }
+
+    def start(self):
+        """Starts the background refresh task."""
+        if self._refresh_task is None:
+            self._refresh_task = asyncio.create_task(self._refresh_loop())
+
+    async def stop(self):
+        """Stops the background refresh task."""
+        if self._refresh_task is not None:
+            self._refresh_task.cancel()
+            try:
+                await self._refresh_task
+            except asyncio.CancelledError:
+                pass
+            self._refresh_task = None
+
+    async def _load(self, genre):
+        # Concurrent misses for the same genre share one fetch
+        task = self._inflight.get(genre)
+        if task is None:
+            task = asyncio.ensure_future(self._fetch_and_store(genre))
+            self._inflight[genre] = task
+            task.add_done_callback(lambda _: self._inflight.pop(genre, None))
+        return await asyncio.shield(task)
+
+    async def _fetch_and_store(self, genre):
+        tracks = await self._fetch(genre)
+        self._pools[genre] = TrackPool(tracks, self.clock())
+        self._pools.move_to_end(genre)
+        while len(self._pools) > self.max_genres:
+            evicted, _ = self._pools.popitem(last=False)
+            logger.debug(f"Evicted track pool for {evicted}")
+        return tracks
+
+    async def _fetch(self, genre):
+        with stage("spotify"):
+            return await self.client.search_tracks(f"genre:{genre}", self.pool_size)
+
+    async def _refresh_loop(self):
+        while True:
+            await asyncio.sleep(self.refresh_interval)
+            now = self.clock()
+            stale = [
+                genre
+                for genre, pool in self._pools.items()
+                if now - pool.fetched_at >= self.ttl - self.refresh_margin
+            ]
+            for genre in stale:
+                try:
+                    await self._load(genre)
+                    self.refreshes += 1
+                except Exception as e:
+                    self.refresh_errors += 1
+                    logger.error(f"Failed to refresh track pool for {genre}: {e}")
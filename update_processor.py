@@ -0,0 +1,112 @@
+"""
+Update processor that runs handlers concurrently across chats and users
+while keeping updates from the same chat, and from the same user, in the
+order they arrived.
+
+Each update waits for the previous update of its chat and of its user
+before it takes one of `max_workers` slots, so a busy chat never occupies
+workers that other chats could use.
+"""
+import asyncio
+import logging
+
+from telegram import Update
+from telegram.ext import BaseUpdateProcessor
+
+from logging_setup import correlation_id
+
+logger = logging.getLogger(__name__)
+
+
+def ordering_keys(update):
+    """Returns the keys an update must be ordered by: its chat and its user."""
+    keys = []
+    if isinstance(update, Update):
+        if update.effective_chat is not None:
+            keys.append(("chat", update.effective_chat.id))
+        if update.effective_user is not None:
+            keys.append(("user", update.effective_user.id))
+    return keys
+
+
+class OrderedUpdateProcessor(BaseUpdateProcessor):
+    """Concurrent update processing with per-chat and per-user ordering."""
+
+    def __init__(self, max_workers=16, max_pending=1000):
+        # PTB's own limit bounds how many updates may be pending in total
+        super().__init__(max_concurrent_updates=max_pending)
+        self.max_workers = max_workers
+        self._workers = asyncio.Semaphore(max_workers)
+        self._tails = {}
+
+        self.waiting_for_order = 0
+        self.waiting_for_worker = 0
+        self.running = 0
+        self.processed = 0
+        self.peak_pending = 0
+
+    async def do_process_update(self, update, coroutine):
+        # Link this update behind the last one seen for each of its keys. This
+        # runs before the first await, i.e. in arrival order.
+        done = asyncio.get_running_loop().create_future()
+        keys = ordering_keys(update)
+        predecessors = {self._tails[key] for key in keys if key in self._tails}
+        for key in keys:
+            self._tails[key] = done
+        self._track_pending()
+
+        started = False
+        try:
+            if predecessors:
+                self.waiting_for_order += 1
+                try:
+                    await asyncio.wait(predecessors)
+                finally:
+                    self.waiting_for_order -= 1
+
+            self.waiting_for_worker += 1
+            try:
+                await self._workers.acquire()
+            finally:
+                self.waiting_for_worker -= 1
+
+            try:
+                self.running += 1
+                started = True
+                # Every log record written while handling this update carries its id
+                correlation_id.set(getattr(update, "update_id", None))
+                await coroutine
+            finally:
+                self.running -= 1
+                self.processed += 1
+                self._workers.release()
+        finally:
+            if not started and hasattr(coroutine, "close"):
+                coroutine.close()
+            done.set_result(None)
+            for key in keys:
+                if self._tails.get(key) is done:
+                    del self._tails[key]
+
+    async def initialize(self):
+        pass
+
+    async def shutdown(self):
+        pass
+
+    def stats(self):
+        """Queue depth and throughput counters."""
+        return {
+            "max_workers": self.max_workers,
+            "running": self.running,
+            "waiting_for_order": self.waiting_for_order,
+            "waiting_for_worker": self.waiting_for_worker,
+            "peak_pending": self.peak_pending,
+            "processed": self.processed,
+            "ordered_keys": len(self._tails),
+        }
+
+    def _track_pending(self):
+        pending = self.running + self.waiting_for_order + self.waiting_for_worker + 1
+        if pending > self.peak_pending:
+            self.peak_pending = pending
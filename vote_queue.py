@@ -0,0 +1,180 @@
+"""
+Vote intake queue sitting between handle_voting and the backend.
+
+- (user, battle) pairs are deduplicated locally: a double click waits on
+  the vote already in flight, and a user who has voted is answered
+  without any network call.
+- A semaphore bounds how many backend requests are in flight.
+- With a batch sender configured, votes arriving within `batch_window`
+  seconds are forwarded together and each caller gets its own result.
+
+Results are (status_code, data) tuples, as returned by the backend. A vote
+whose request is cancelled, e.g. by `close()` at shutdown, raises
+`VoteNotSentError` to its callers instead of leaving them waiting.
+"""
+import asyncio
+import logging
+from collections import OrderedDict
+
+logger = logging.getLogger(__name__)
+
+ALREADY_VOTED = "You have already voted in this battle."
+
+
+class VoteNotSentError(Exception):
+    """The vote's backend request was cancelled before the backend answered."""
+
+
+class VoteResult(tuple):
+    """(status_code, data) plus a flag telling whether this press was a duplicate."""
+
+    duplicate = False
+
+
+def _duplicate_of(result):
+    duplicate = VoteResult(result)
+    duplicate.duplicate = True
+    return duplicate
+
+
+def _fail(futures, error):
+    if not isinstance(error, Exception):
+        # Cancelled (or interrupted): the callers must not see that as their own cancellation
+        error = VoteNotSentError("The vote request was cancelled")
+    for future in futures:
+        if not future.done():
+            future.set_exception(error)
+
+
+class VoteQueue:
+    """Deduplicating, concurrency-bounded, optionally batching vote submitter."""
+
+    def __init__(self, send, send_batch=None, max_in_flight=8, batch_size=20,
+                 batch_window=0.05, max_remembered=100000):
+        self.send = send
+        self.send_batch = send_batch
+        self.batch_size = batch_size
+        self.batch_window = batch_window
+        self.max_remembered = max_remembered
+
+        self.submitted = 0
+        self.deduplicated = 0
+        self.backend_calls = 0
+
+        self._semaphore = asyncio.Semaphore(max_in_flight)
+        self._in_flight = {}
+        self._voted = OrderedDict()
+        self._batch = []
+        self._batch_timer = None
+        # The event loop keeps only weak references to tasks; these stay alive until they finish
+        self._tasks = set()
+
+    async def submit(self, user_id, battle_id, payload):
+        """Submits one vote and returns its VoteResult."""
+        self.submitted += 1
+        key = (user_id, battle_id)
+
+        if key in self._voted:
+            self.deduplicated += 1
+            return _duplicate_of((200, {"message": ALREADY_VOTED}))
+
+        future = self._in_flight.get(key)
+        if future is not None:
+            self.deduplicated += 1
+            return _duplicate_of(await asyncio.shield(future))
+
+        future = asyncio.get_running_loop().create_future()
+        self._in_flight[key] = future
+        try:
+            if self.send_batch is None:
+                self._spawn(self._send_one(payload, future))
+            else:
+                self._enqueue(payload, future)
+            result = VoteResult(await asyncio.shield(future))
+        finally:
+            del self._in_flight[key]
+
+        status, data = result
+        if status == 200 and (data.get("transactionHash") or data.get("message") == ALREADY_VOTED):
+            self._remember(key)
+        return result
+
+    def forget_battle(self, battle_id):
+        """Drops the dedup entries of a closed battle."""
+        for key in [key for key in self._voted if key[1] == battle_id]:
+            del self._voted[key]
+
+    async def close(self):
+        """Cancels the votes not yet answered; their callers get VoteNotSentError."""
+        if self._batch_timer is not None:
+            self._batch_timer.cancel()
+            self._batch_timer = None
+        batch, self._batch = self._batch, []
+        _fail([future for _, future in batch], VoteNotSentError("The vote queue was closed"))
+        tasks = list(self._tasks)
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+
+    def stats(self):
+        return {
+            "submitted": self.submitted,
+            "deduplicated": self.deduplicated,
+            "backend_calls": self.backend_calls,
+            "in_flight": len(self._in_flight),
+        }
+
+    def _spawn(self, coroutine):
+        task = asyncio.create_task(coroutine)
+        self._tasks.add(task)
+        task.add_done_callback(self._tasks.discard)
+
+    def _remember(self, key):
+        self._voted[key] = True
+        self._voted.move_to_end(key)
+        while len(self._voted) > self.max_remembered:
+            self._voted.popitem(last=False)
+
+    async def _send_one(self, payload, future):
+        try:
+            async with self._semaphore:
+                self.backend_calls += 1
+                result = await self.send(payload)
+        except BaseException as e:
+            _fail([future], e)
+            if isinstance(e, Exception):
+                return
+            raise
+        future.set_result(result)
+
+    def _enqueue(self, payload, future):
+        self._batch.append((payload, future))
+        if len(self._batch) >= self.batch_size:
+            self._flush_batch()
+        elif self._batch_timer is None:
+            self._batch_timer = asyncio.get_running_loop().call_later(self.batch_window, self._flush_batch)
+
+    def _flush_batch(self):
+        if self._batch_timer is not None:
+            self._batch_timer.cancel()
+            self._batch_timer = None
+        batch, self._batch = self._batch, []
+        if batch:
+            self._spawn(self._send_batch(batch))
+
+    async def _send_batch(self, batch):
+        futures = [future for _, future in batch]
+        try:
+            async with self._semaphore:
+                self.backend_calls += 1
+                results = await self.send_batch([payload for payload, _ in batch])
+        except BaseException as e:
+            _fail(futures, e)
+            if isinstance(e, Exception):
+                return
+            raise
+        if len(results) != len(batch):
+            _fail(futures, RuntimeError(f"Batch endpoint returned {len(results)} results for {len(batch)} votes"))
+            return
+        for (_, future), result in zip(batch, results):
+            future.set_result(result)
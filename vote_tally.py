@@ -0,0 +1,302 @@
+"""
+In-bot vote counts and debounced vote keyboard re-renders.
+
+`VoteTally` is updated optimistically whenever /votetrack succeeds and is
+reconciled with the backend in the background, so the vote path no longer
+reads the counts back after every vote. `EditDebouncer` coalesces keyboard
+edits so each message is edited at most once per interval, always with the
+latest counts. Both take a `sleep` that can be replaced to run them on a
+simulated clock.
+
+Run `python vote_tally.py bench --votes 10000 --duration 60` to count the
+backend reads and keyboard edits of a simulated vote storm, against the one
+read and one edit per vote of the path this replaced.
+"""
+import argparse
+import asyncio
+import heapq
+import json
+import logging
+import random
+import time
+
+from battle_sessions import BattleSessionStore
+
+logger = logging.getLogger(__name__)
+
+
+class VoteTally:
+    """Per-battle vote counts plus the voting messages that display them.
+
+    Counts and messages are kept on the battles' sessions in `sessions`
+    (a `BattleSessionStore`), next to the rest of the battle state.
+    """
+
+    def __init__(self, sessions, reconcile_interval=30, sleep=asyncio.sleep):
+        self.sessions = sessions
+        self.reconcile_interval = reconcile_interval
+        self.sleep = sleep
+        self._dirty = set()
+        self._task = None
+
+    def __contains__(self, battle_id):
+        session = self.sessions.get(battle_id)
+        return session is not None and session.votes is not None
+
+    def get(self, battle_id):
+        """Returns (track1_votes, track2_votes), or None if the battle is unknown."""
+        session = self.sessions.get(battle_id)
+        if session is None or session.votes is None:
+            return None
+        return tuple(session.votes)
+
+    def set(self, battle_id, track1_votes, track2_votes):
+        """Stores authoritative counts; returns True if they changed."""
+        session = self.sessions.ensure(battle_id)
+        new = [int(track1_votes), int(track2_votes)]
+        changed = session.votes != new
+        session.votes = new
+        if changed:
+            self.sessions.changed()
+        return changed
+
+    def record(self, battle_id, track_number):
+        """Counts a vote the backend has just accepted."""
+        session = self.sessions.ensure(battle_id)
+        if session.votes is None:
+            session.votes = [0, 0]
+        session.votes[track_number - 1] += 1
+        self._dirty.add(battle_id)
+        self.sessions.changed()
+
+    def watch(self, battle_id, chat_id, message_id, payment_amount):
+        """Remembers a voting message so it can be re-rendered after reconciliation."""
+        messages = self.sessions.ensure(battle_id).messages
+        if (chat_id, message_id) not in messages:
+            messages[(chat_id, message_id)] = payment_amount
+            self.sessions.changed()
+
+    def messages(self, battle_id):
+        """Returns {(chat_id, message_id): payment_amount} for a battle."""
+        session = self.sessions.get(battle_id)
+        return {} if session is None else session.messages
+
+    def forget(self, battle_id):
+        """Stops tracking a closed battle; its session expires later."""
+        self.sessions.close(battle_id)
+        self._dirty.discard(battle_id)
+
+    def start(self, fetch_counts, on_change):
+        """Starts reconciling recently voted battles with the backend.
+
+        `fetch_counts(battle_id)` returns the backend's (track1, track2) and
+        `on_change(battle_id)` is awaited when they differ from ours.
+        """
+        if self._task is None:
+            self._task = asyncio.create_task(self._reconcile_loop(fetch_counts, on_change))
+
+    async def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+
+    async def _reconcile_loop(self, fetch_counts, on_change):
+        while True:
+            await self.sleep(self.reconcile_interval)
+            dirty, self._dirty = self._dirty, set()
+            for battle_id in dirty:
+                try:
+                    track1_votes, track2_votes = await fetch_counts(battle_id)
+                except Exception as e:
+                    logger.error(f"Failed to reconcile votes for battle {battle_id}: {e}")
+                    continue
+                if battle_id in self and self.set(battle_id, track1_votes, track2_votes):
+                    await on_change(battle_id)
+
+
+class EditDebouncer:
+    """Runs at most one edit per key per `interval` seconds; later requests replace pending ones."""
+
+    def __init__(self, interval=2.0, clock=time.monotonic, sleep=asyncio.sleep):
+        self.interval = interval
+        self.clock = clock
+        self.sleep = sleep
+        self.requested = 0
+        self.edits = 0
+        self._pending = {}
+        self._tasks = {}
+        self._last_edit = {}
+
+    def schedule(self, key, render):
+        """Queues `render()` (an async callable) as the next edit for `key`."""
+        self.requested += 1
+        self._pending[key] = render
+        if key not in self._tasks:
+            self._start(key)
+
+    def cancel(self, key):
+        """Drops the pending edit for `key` and cancels one that is running, e.g. before a final edit."""
+        self._pending.pop(key, None)
+        task = self._tasks.get(key)
+        if task is not None:
+            task.cancel()
+
+    def stats(self):
+        return {"requested": self.requested, "edits": self.edits, "pending": len(self._pending)}
+
+    def _start(self, key):
+        now = self.clock()
+        delay = max(0.0, self._last_edit.get(key, now - self.interval) + self.interval - now)
+        self._tasks[key] = asyncio.create_task(self._run(key, delay))
+
+    async def _run(self, key, delay):
+        try:
+            if delay:
+                await self.sleep(delay)
+            render = self._pending.pop(key)
+            self._last_edit[key] = self.clock()
+            self.edits += 1
+            await render()
+        except Exception as e:
+            logger.error(f"Debounced edit for {key} failed: {e}")
+        finally:
+            del self._tasks[key]
+        if key in self._pending:
+            # A newer request arrived while this edit was running
+            self._start(key)
+        else:
+            self._prune()
+
+    def _prune(self):
+        if len(self._last_edit) > 10000:
+            cutoff = self.clock() - self.interval
+            self._last_edit = {k: t for k, t in self._last_edit.items() if t > cutoff or k in self._tasks}
+
+
+class _SimulatedTime:
+    """A clock and sleep for the benchmark: time only moves when `advance` is awaited."""
+
+    def __init__(self):
+        self.now = 0.0
+        self._sleepers = []
+        self._order = 0
+
+    def __call__(self):
+        return self.now
+
+    async def sleep(self, seconds):
+        future = asyncio.get_running_loop().create_future()
+        self._order += 1
+        heapq.heappush(self._sleepers, (self.now + seconds, self._order, future))
+        await future
+
+    async def advance(self, until):
+        """Moves the clock to `until`, waking each sleeper at its deadline on the way."""
+        while self._sleepers and self._sleepers[0][0] <= until:
+            deadline, _, future = heapq.heappop(self._sleepers)
+            self.now = max(self.now, deadline)
+            if not future.done():
+                future.set_result(None)
+            await self.settle()
+        self.now = max(self.now, until)
+        await self.settle()
+
+    @staticmethod
+    async def settle():
+        # Lets woken tasks run until they wait again
+        for _ in range(5):
+            await asyncio.sleep(0)
+
+
+async def benchmark(votes, duration, messages, edit_interval, reconcile_interval, drift=0.01, seed=0):
+    """Simulates `votes` votes spread over `duration` seconds on a battle shown in `messages` chats.
+
+    Each vote counts optimistically and schedules a re-render of every
+    voting message; `drift` is the share of votes the bot misses (recorded
+    by the backend only), which reconciliation has to bring back.
+    """
+    rng = random.Random(seed)
+    clock = _SimulatedTime()
+    sessions = BattleSessionStore(clock=clock)
+    tally = VoteTally(sessions, reconcile_interval=reconcile_interval, sleep=clock.sleep)
+    debouncer = EditDebouncer(interval=edit_interval, clock=clock, sleep=clock.sleep)
+    battle_id = 1
+    backend_counts = [0, 0]
+    backend_reads = 0
+    shown = {}
+    edit_times = {}
+
+    tally.set(battle_id, 0, 0)
+    for message_id in range(messages):
+        tally.watch(battle_id, -100 - message_id, message_id, "0.1")
+
+    def refresh():
+        for key in tally.messages(battle_id):
+            async def render(key=key):
+                shown[key] = tally.get(battle_id)
+                edit_times.setdefault(key, []).append(clock.now)
+            debouncer.schedule(key, render)
+
+    async def fetch_counts(_battle_id):
+        nonlocal backend_reads
+        backend_reads += 1
+        return tuple(backend_counts)
+
+    async def on_change(_battle_id):
+        refresh()
+
+    tally.start(fetch_counts, on_change)
+    missed = 0
+    for at in sorted(rng.uniform(0, duration) for _ in range(votes)):
+        await clock.advance(at)
+        track_number = rng.choice((1, 2))
+        backend_counts[track_number - 1] += 1
+        if rng.random() < drift:
+            missed += 1
+            continue
+        tally.record(battle_id, track_number)
+        refresh()
+        await clock.settle()
+    # Long enough for a last reconciliation and the edits it triggers
+    await clock.advance(duration + reconcile_interval + 2 * edit_interval)
+    await tally.stop()
+
+    edits = sum(len(times) for times in edit_times.values())
+    busiest_minute = max(
+        (sum(1 for other in times if start <= other < start + 60) for times in edit_times.values() for start in times),
+        default=0,
+    )
+    return {
+        "votes": votes,
+        "missed_votes": missed,
+        "before": {"backend_reads": votes, "edits": votes},
+        "after": {
+            "backend_reads": backend_reads,
+            "edits": edits,
+            "edit_requests": debouncer.requested,
+            "max_edits_per_message_minute": busiest_minute,
+        },
+        "final_counts": list(backend_counts),
+        "all_messages_current": all(shown.get(key) == tuple(backend_counts) for key in tally.messages(battle_id)),
+    }
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Vote tally maintenance")
+    subcommands = parser.add_subparsers(dest="command", required=True)
+    bench = subcommands.add_parser("bench", help="Count backend reads and edits under a simulated vote storm")
+    bench.add_argument("--votes", type=int, default=10000)
+    bench.add_argument("--duration", type=float, default=60.0, help="seconds the votes are spread over")
+    bench.add_argument("--messages", type=int, default=3, help="chats showing the battle's voting message")
+    bench.add_argument("--edit-interval", type=float, default=2.0)
+    bench.add_argument("--reconcile-interval", type=float, default=30.0)
+    bench.add_argument("--drift", type=float, default=0.01)
+    args = parser.parse_args()
+
+    print(json.dumps(asyncio.run(benchmark(
+        args.votes, args.duration, args.messages, args.edit_interval, args.reconcile_interval, args.drift
+    )), indent=2))
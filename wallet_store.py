@@ -0,0 +1,475 @@
+"""
+Storage for the Telegram user -> wallet mapping.
+
+Two interchangeable backends implement `WalletStore`:
+
+- `JsonWalletStore` (default) keeps the mapping in memory. Changes are
+  appended to a journal (one JSON line per changed user) and periodically
+  compacted into a snapshot that is written atomically with a temp file +
+  rename. Disk writes run in a worker thread and bursts of changes are
+  coalesced into a single append.
+- `SqliteWalletStore` keeps the mapping in a WAL-mode SQLite database
+  indexed by user id and by wallet address.
+
+Run `python wallet_store.py migrate <snapshot.json> <wallets.db>` to copy
+the JSON data into SQLite, and `python wallet_store.py bench --users 1000000`
+to time writes, startup and lookups of both backends.
+"""
+import argparse
+import asyncio
+import itertools
+import json
+import logging
+import os
+import random
+import sqlite3
+import tempfile
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+logger = logging.getLogger(__name__)
+
+
+def write_json_atomic(path, data):
+    """Writes `data` as JSON to `path` so readers never see a partial file."""
+    directory = os.path.dirname(os.path.abspath(path))
+    fd, tmp_path = tempfile.mkstemp(dir=directory, prefix=".tmp-", suffix=".json")
+    try:
+        with os.fdopen(fd, "w") as file:
+            json.dump(data, file)
+            file.flush()
+            os.fsync(file.fileno())
+        os.replace(tmp_path, path)
+    except BaseException:
+        os.unlink(tmp_path)
+        raise
+
+
+class WalletJournal:
+    """Snapshot + append-only journal for the wallet mapping."""
+
+    def __init__(self, snapshot_path="user_wallet_mapping.json", journal_path=None,
+                 flush_delay=0.5, compact_threshold=10000):
+        self.snapshot_path = snapshot_path
+        self.journal_path = journal_path or os.path.splitext(snapshot_path)[0] + ".journal"
+        self.flush_delay = flush_delay
+        self.compact_threshold = compact_threshold
+        self.mapping = {}
+        self._journal_entries = 0
+        self._pending = set()
+        self._flush_task = None
+        self._lock = asyncio.Lock()
+
+    def load(self):
+        """Loads the snapshot, replays the journal on top of it and returns the mapping."""
+        try:
+            with open(self.snapshot_path, "r") as file:
+                self.mapping = json.load(file)
+        except FileNotFoundError:
+            logger.info(f"No wallet snapshot at {self.snapshot_path}, starting empty")
+            self.mapping = {}
+
+        self._journal_entries = 0
+        try:
+            with open(self.journal_path, "rb+") as file:
+                complete = 0
+                line = b"\n"
+                for line in file:
+                    try:
+                        entry = json.loads(line)
+                    except ValueError:
+                        # A crash mid-append can only leave the last line torn
+                        logger.warning("Dropping a torn wallet journal entry")
+                        break
+                    user_id = entry.pop("user_id")
+                    self.mapping[user_id] = entry
+                    self._journal_entries += 1
+                    complete += len(line)
+                if complete < file.seek(0, os.SEEK_END):
+                    # Otherwise the next append would continue the torn line and be lost with it
+                    file.truncate(complete)
+                    os.fsync(file.fileno())
+                elif not line.endswith(b"\n"):
+                    # The last entry was written whole, only its line end is missing
+                    file.write(b"\n")
+                    file.flush()
+                    os.fsync(file.fileno())
+        except FileNotFoundError:
+            pass
+
+        logger.info(f"Loaded {len(self.mapping)} wallets ({self._journal_entries} journal entries replayed)")
+        return self.mapping
+
+    def record(self, user_id):
+        """Marks a user's entry as changed; it is written after `flush_delay` seconds."""
+        self._pending.add(user_id)
+        if self._flush_task is None or self._flush_task.done():
+            self._flush_task = asyncio.create_task(self._delayed_flush())
+
+    async def flush(self):
+        """Appends every pending change to the journal, compacting if it grew too large."""
+        async with self._lock:
+            if self._pending:
+                pending, self._pending = self._pending, set()
+                lines = "".join(
+                    json.dumps({"user_id": user_id, **self.mapping[user_id]}) + "\n"
+                    for user_id in pending
+                    if user_id in self.mapping
+                )
+                await asyncio.to_thread(self._append, lines)
+                self._journal_entries += len(pending)
+
+            if self._journal_entries >= self.compact_threshold:
+                await self._compact()
+
+    async def close(self):
+        """Writes any pending changes and compacts the journal into the snapshot."""
+        if self._flush_task is not None and not self._flush_task.done():
+            self._flush_task.cancel()
+        await self.flush()
+        async with self._lock:
+            if self._journal_entries:
+                await self._compact()
+
+    async def _delayed_flush(self):
+        await asyncio.sleep(self.flush_delay)
+        try:
+            await self.flush()
+        except Exception as e:
+            logger.error(f"Problem in storing wallet data: {e}")
+
+    async def _compact(self):
+        # The shallow copy keeps the snapshot consistent while handlers add users
+        snapshot = dict(self.mapping)
+        await asyncio.to_thread(self._write_snapshot, snapshot)
+        self._journal_entries = 0
+
+    def _append(self, lines):
+        with open(self.journal_path, "a") as file:
+            file.write(lines)
+            file.flush()
+            os.fsync(file.fileno())
+
+    def _write_snapshot(self, snapshot):
+        write_json_atomic(self.snapshot_path, snapshot)
+        # Replaying entries already in the snapshot is harmless, so a crash
+        # between the rename and the truncate loses nothing
+        with open(self.journal_path, "w"):
+            pass
+
+
+class WalletStore:
+    """Interface shared by the wallet backends. All lookups are async."""
+
+    def load(self):
+        """Prepares the store at startup."""
+
+    async def get(self, user_id):
+        """Returns {"wallet": ..., "user_info": ...} for a user, or None."""
+        raise NotImplementedError
+
+    async def set(self, user_id, wallet, user_info=None):
+        """Creates or updates a user's wallet; user_info=None keeps the stored one."""
+        raise NotImplementedError
+
+    async def users_for_wallets(self, addresses):
+        """Maps each known address to (user_id, user_info) in one lookup."""
+        raise NotImplementedError
+
+    async def items(self, offset=0, limit=None):
+        """Returns (user_id, entry) pairs in insertion order."""
+        raise NotImplementedError
+
+    async def count(self):
+        raise NotImplementedError
+
+    async def close(self):
+        """Flushes pending writes and releases resources."""
+
+
+class JsonWalletStore(WalletStore):
+    """In-memory dict persisted by `WalletJournal`, with a reverse index by address."""
+
+    def __init__(self, snapshot_path="user_wallet_mapping.json", **journal_options):
+        self.journal = WalletJournal(snapshot_path, **journal_options)
+        self.mapping = self.journal.mapping
+        self._by_wallet = {}
+
+    def load(self):
+        self.mapping = self.journal.load()
+        self._by_wallet = {entry["wallet"].lower(): user_id for user_id, entry in self.mapping.items()}
+
+    async def get(self, user_id):
+        return self.mapping.get(user_id)
+
+    async def set(self, user_id, wallet, user_info=None):
+        entry = self.mapping.get(user_id)
+        if entry is None:
+            entry = self.mapping[user_id] = {"wallet": wallet, "user_info": user_info or "Unknown"}
+        else:
+            if self._by_wallet.get(entry["wallet"].lower()) == user_id:
+                del self._by_wallet[entry["wallet"].lower()]
+            entry["wallet"] = wallet
+            if user_info is not None:
+                entry["user_info"] = user_info
+        self._by_wallet[wallet.lower()] = user_id
+        self.journal.record(user_id)
+
+    async def users_for_wallets(self, addresses):
+        owners = {}
+        for address in addresses:
+            user_id = self._by_wallet.get(address.lower())
+            if user_id is not None:
+                owners[address] = (user_id, self.mapping[user_id]["user_info"])
+        return owners
+
+    async def items(self, offset=0, limit=None):
+        stop = None if limit is None else offset + limit
+        return list(itertools.islice(self.mapping.items(), offset, stop))
+
+    async def count(self):
+        return len(self.mapping)
+
+    async def close(self):
+        await self.journal.close()
+
+
+class SqliteWalletStore(WalletStore):
+    """SQLite (WAL mode) backend; queries run on a dedicated worker thread."""
+
+    # SQLite's default limit on host parameters per statement is 999
+    LOOKUP_CHUNK = 500
+
+    def __init__(self, path="user_wallets.db"):
+        self.path = path
+        self._conn = None
+        # One thread keeps the connection single-threaded and writes ordered
+        self._executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="wallet-db")
+
+    def load(self):
+        self._executor.submit(self._connect).result()
+
+    async def get(self, user_id):
+        row = await self._run(
+            lambda conn: conn.execute(
+                "SELECT wallet, user_info FROM wallets WHERE user_id = ?", (user_id,)
+            ).fetchone()
+        )
+        return None if row is None else {"wallet": row[0], "user_info": row[1]}
+
+    async def set(self, user_id, wallet, user_info=None):
+        def upsert(conn):
+            with conn:
+                conn.execute(
+                    "INSERT INTO wallets (user_id, wallet, user_info) VALUES (?, ?, ?) "
+                    "ON CONFLICT(user_id) DO UPDATE SET wallet = excluded.wallet, "
+                    "user_info = COALESCE(?, wallets.user_info)",
+                    (user_id, wallet, user_info or "Unknown", user_info),
+                )
+        await self._run(upsert)
+
+    async def users_for_wallets(self, addresses):
+        addresses = list(addresses)
+
+        def lookup(conn):
+            by_lower = {}
+            for start in range(0, len(addresses), self.LOOKUP_CHUNK):
+                chunk = addresses[start:start + self.LOOKUP_CHUNK]
+                placeholders = ",".join("?" * len(chunk))
+                rows = conn.execute(
+                    "SELECT wallet, user_id, user_info FROM wallets "
+                    f"WHERE wallet COLLATE NOCASE IN ({placeholders})",
+                    chunk,
+                )
+                for wallet, user_id, user_info in rows:
+                    by_lower[wallet.lower()] = (user_id, user_info)
+            return {a: by_lower[a.lower()] for a in addresses if a.lower() in by_lower}
+
+        return await self._run(lookup)
+
+    async def items(self, offset=0, limit=None):
+        rows = await self._run(
+            lambda conn: conn.execute(
+                "SELECT user_id, wallet, user_info FROM wallets ORDER BY rowid LIMIT ? OFFSET ?",
+                (-1 if limit is None else limit, offset),
+            ).fetchall()
+        )
+        return [(user_id, {"wallet": wallet, "user_info": user_info}) for user_id, wallet, user_info in rows]
+
+    async def count(self):
+        return await self._run(lambda conn: conn.execute("SELECT COUNT(*) FROM wallets").fetchone()[0])
+
+    async def close(self):
+        await asyncio.get_running_loop().run_in_executor(self._executor, self._disconnect)
+        self._executor.shutdown(wait=True)
+
+    def bulk_insert(self, entries):
+        """Inserts (user_id, wallet, user_info) rows in one transaction. Used by the migration."""
+        def insert(conn):
+            with conn:
+                conn.executemany(
+                    "INSERT OR REPLACE INTO wallets (user_id, wallet, user_info) VALUES (?, ?, ?)",
+                    entries,
+                )
+        self._executor.submit(lambda: insert(self._connect())).result()
+
+    def close_sync(self):
+        """Closes the store outside the event loop, e.g. from the migration tool."""
+        self._executor.submit(self._disconnect).result()
+        self._executor.shutdown(wait=True)
+
+    async def _run(self, query):
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(self._executor, lambda: query(self._connect()))
+
+    def _connect(self):
+        if self._conn is None:
+            self._conn = sqlite3.connect(self.path, check_same_thread=False)
+            self._conn.execute("PRAGMA journal_mode=WAL")
+            self._conn.execute("PRAGMA synchronous=NORMAL")
+            self._conn.execute(
+                "CREATE TABLE IF NOT EXISTS wallets ("
+                "user_id TEXT PRIMARY KEY, wallet TEXT NOT NULL, user_info TEXT)"
+            )
+            self._conn.execute(
+                "CREATE INDEX IF NOT EXISTS wallets_by_address ON wallets (wallet COLLATE NOCASE)"
+            )
+        return self._conn
+
+    def _disconnect(self):
+        if self._conn is not None:
+            self._conn.close()
+            self._conn = None
+
+
+def create_wallet_store(backend="json", path=None):
+    """Builds the configured wallet store backend."""
+    if backend == "json":
+        return JsonWalletStore(path or "user_wallet_mapping.json")
+    if backend == "sqlite":
+        return SqliteWalletStore(path or "user_wallets.db")
+    raise ValueError(f"Unknown wallet store backend: {backend}")
+
+
+def migrate_json_to_sqlite(snapshot_path, db_path):
+    """Copies the JSON snapshot + journal into a SQLite database. Returns the row count."""
+    mapping = WalletJournal(snapshot_path).load()
+    store = SqliteWalletStore(db_path)
+    store.bulk_insert(
+        [(user_id, entry["wallet"], entry.get("user_info", "Unknown")) for user_id, entry in mapping.items()]
+    )
+    store.close_sync()
+    return len(mapping)
+
+
+def bench_wallet(index):
+    return f"0x{index:040x}"
+
+
+async def benchmark(backend, users, writes, directory, lookups=10000, bulk=1000, seed=0):
+    """Times startup with `users` stored wallets, `writes` set() calls, the final flush and lookups.
+
+    Lookups are `lookups` get() calls by user id, as many single-address
+    users_for_wallets() calls, and bulk users_for_wallets() calls of `bulk`
+    addresses (half of them unknown), as when a battle's voters are listed.
+    """
+    rng = random.Random(seed)
+    path = os.path.join(directory, "wallets.json" if backend == "json" else "wallets.db")
+    entries = [(str(index), bench_wallet(index), f"user{index}") for index in range(users)]
+    if backend == "json":
+        write_json_atomic(path, {user_id: {"wallet": wallet, "user_info": info} for user_id, wallet, info in entries})
+    else:
+        seed_store = SqliteWalletStore(path)
+        seed_store.bulk_insert(entries)
+        seed_store.close_sync()
+
+    store = create_wallet_store(backend, path)
+    started = time.perf_counter()
+    store.load()
+    startup_s = time.perf_counter() - started
+
+    # Half the writes change existing users' wallets, half add new users
+    started = time.perf_counter()
+    for index in range(writes):
+        user_id = str(rng.randrange(users) if index % 2 else users + index)
+        await store.set(user_id, bench_wallet(users + index), f"user{user_id}")
+    set_s = time.perf_counter() - started
+    started = time.perf_counter()
+    await store.close()
+    close_s = time.perf_counter() - started
+
+    # Startup again, now replaying the journal (JSON) or opening the grown database
+    store = create_wallet_store(backend, path)
+    started = time.perf_counter()
+    store.load()
+    reload_s = time.perf_counter() - started
+    count = await store.count()
+
+    user_ids = [str(rng.randrange(users)) for _ in range(lookups)]
+    started = time.perf_counter()
+    for user_id in user_ids:
+        await store.get(user_id)
+    get_s = time.perf_counter() - started
+
+    addresses = [bench_wallet(rng.randrange(users)) for _ in range(lookups)]
+    started = time.perf_counter()
+    for address in addresses:
+        await store.users_for_wallets([address])
+    address_s = time.perf_counter() - started
+
+    batches = max(1, lookups // bulk)
+    voter_lists = [
+        [bench_wallet(rng.randrange(users * 2)) for _ in range(bulk)] for _ in range(batches)
+    ]
+    started = time.perf_counter()
+    for voters in voter_lists:
+        await store.users_for_wallets(voters)
+    bulk_s = time.perf_counter() - started
+
+    result = {
+        "backend": backend,
+        "users": count,
+        "startup_ms": round(startup_s * 1000, 1),
+        "set_us": round(set_s / writes * 1e6, 2) if writes else 0.0,
+        "close_ms": round(close_s * 1000, 1),
+        "restart_ms": round(reload_s * 1000, 1),
+        "get_us": round(get_s / lookups * 1e6, 2),
+        "address_lookup_us": round(address_s / lookups * 1e6, 2),
+        f"bulk_lookup_{bulk}_ms": round(bulk_s / batches * 1000, 2),
+    }
+    if backend == "json":
+        # What finding a wallet's owner cost before the address index: a scan of the users
+        scanned = addresses[:10]
+        started = time.perf_counter()
+        for address in scanned:
+            next((user_id for user_id, entry in store.mapping.items() if entry["wallet"] == address), None)
+        result["linear_scan_ms"] = round((time.perf_counter() - started) / len(scanned) * 1000, 2)
+    await store.close()
+    return result
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Wallet store maintenance")
+    subcommands = parser.add_subparsers(dest="command", required=True)
+    migrate = subcommands.add_parser("migrate", help="Copy the JSON wallet data into SQLite")
+    migrate.add_argument("snapshot", help="Path to user_wallet_mapping.json")
+    migrate.add_argument("database", help="Path to the SQLite database to create or update")
+    bench = subcommands.add_parser("bench", help="Time startup, writes and lookups of both backends")
+    bench.add_argument("--users", type=int, default=1000000, help="Wallets stored before measuring")
+    bench.add_argument("--writes", type=int, default=20000, help="set() calls to time")
+    bench.add_argument("--lookups", type=int, default=10000, help="Lookups by user id and by address to time")
+    bench.add_argument("--bulk", type=int, default=1000, help="Addresses per bulk reverse lookup")
+    bench.add_argument("--backend", choices=("json", "sqlite"), action="append",
+                       help="Backend to measure (repeatable; default: both)")
+    args = parser.parse_args()
+
+    if args.command == "bench":
+        for backend in args.backend or ("json", "sqlite"):
+            with tempfile.TemporaryDirectory(prefix="wallet-bench-") as directory:
+                print(json.dumps(asyncio.run(benchmark(
+                    backend, args.users, args.writes, directory, args.lookups, args.bulk
+                ))))
+    else:
+        logging.basicConfig(level=logging.INFO)
+        count = migrate_json_to_sqlite(args.snapshot, args.database)
+        print(f"Migrated {count} wallets into {args.database}")